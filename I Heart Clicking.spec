@@ -29,9 +29,34 @@ print(f"Bleak Path: {bleak.__path__}")
 datas=[
     ('img/*', 'img/'),
     ('font/*', 'font/'),
+    ('sounds/*', 'sounds/'),
     ('ui_design_variables.py', '.'),
     ('bluetooth_controller.py', '.'),
     ('bluetooth_device_list.py', '.'),
+    ('ekg_renderer.py', '.'),
+    ('ekg_strip.py', '.'),
+    ('ui_scheduler.py', '.'),
+    ('heart_rate_parser.py', '.'),
+    ('beat_clock.py', '.'),
+    ('bpm_history.py', '.'),
+    ('bpm_filter.py', '.'),
+    ('heartbeat_audio.py', '.'),
+    ('heart_sprites.py', '.'),
+    ('device_cache.py', '.'),
+    ('connection_supervisor.py', '.'),
+    ('bluetooth_transport.py', '.'),
+    ('simulated_peripheral.py', '.'),
+    ('session_recorder.py', '.'),
+    ('ekg_synth.py', '.'),
+    ('heart_pipeline.py', '.'),
+    ('latency_tracer.py', '.'),
+    ('action_dispatcher.py', '.'),
+    ('startup.py', '.'),
+    ('device_session.py', '.'),
+    ('device_grid.py', '.'),
+    ('bpm_broadcast.py', '.'),
+    ('metrics.py', '.'),
+    ('event_log.py', '.'),
     (bleak_path, 'bleak'),
 ]
 
@@ -50,7 +75,12 @@ a = Analysis(
     ],
     datas=datas,
     hiddenimports=[
+        # Imported by the startup stages after the window is shown, not at module load
         'PIL._tkinter_finder', 
+        'PIL.Image',
+        'PIL.ImageTk',
+        'pygame',
+        'pygame.mixer',
         'keyboard', 
         'pyautogui',
         'bleak',
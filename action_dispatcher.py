@@ -0,0 +1,287 @@
+import heapq
+import sys
+
+from latency_tracer import LatencyHistogram, CLICK_DISPATCH, CLICK_DONE
+from event_log import events
+from threading import Thread, Condition
+from itertools import count
+from time import monotonic
+
+
+'''
+Beat actions: what happens at a phase of every beat
+
+An action is any object with a `run()` method, and optionally `prepare()` to do its
+slow setup ahead of the first beat. pyautogui is only imported by prepare(), so
+actions can be configured at import time and the dispatcher itself runs headless.
+pyautogui calls skip the module-wide PAUSE sleep that follows every call by default;
+the failsafe (mouse in a screen corner) is kept, it is the user's emergency stop.
+'''
+class ClickAction:
+
+    click = None
+
+
+    def __init__(self, button="left"):
+        self.button = button
+
+
+    def prepare(self):
+        from pyautogui import click
+        self.click = click
+
+
+    def run(self):
+        if self.click is None:
+            self.prepare()
+        self.click(button=self.button, _pause=False)
+
+
+    def __repr__(self):
+        return f"ClickAction({self.button!r})"
+
+
+class KeyPressAction:
+
+    press = None
+
+
+    def __init__(self, key):
+        self.key = key
+
+
+    def prepare(self):
+        from pyautogui import press
+        self.press = press
+
+
+    def run(self):
+        if self.press is None:
+            self.prepare()
+        self.press(self.key, _pause=False)
+
+
+    def __repr__(self):
+        return f"KeyPressAction({self.key!r})"
+
+
+class CallableAction:
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+    def run(self):
+        self.func(*self.args, **self.kwargs)
+
+
+    def __repr__(self):
+        return f"CallableAction({self.func!r})"
+
+
+'''
+Fires beat actions at absolute deadlines from a dedicated worker thread
+
+Actions are armed ahead of time, as soon as a beat starts and its timing is known,
+and wait in a deadline-ordered heap. The worker sleeps until just before the earliest
+deadline and spins through the last SPIN_SECONDS, so firing does not depend on any
+event loop being responsive or on the OS timer resolution.
+
+An action whose deadline has passed by more than `miss_tolerance` is dropped and
+counted in miss_count rather than fired late. Lateness of fired actions is kept in
+a histogram. Traced actions mark the click stages of the latency tracer.
+'''
+class ActionDispatcher:
+
+    # The last stretch before a deadline is busy-waited
+    SPIN_SECONDS = 0.002
+
+    # Actions later than this are misses
+    MISS_TOLERANCE = 0.015
+
+    # Windows thread priority for the worker, THREAD_PRIORITY_HIGHEST
+    WINDOWS_THREAD_PRIORITY = 2
+
+    clock = None
+    tracer = None
+    miss_tolerance = None
+    is_running = False
+    thread = None
+
+    # Counters
+    armed_count = 0
+    fired_count = 0
+    miss_count = 0
+    cancelled_count = 0
+    error_count = 0
+
+
+    def __init__(self, clock=monotonic, miss_tolerance=None, tracer=None):
+        self.clock = clock
+        self.tracer = tracer
+        self.miss_tolerance = self.MISS_TOLERANCE if miss_tolerance is None else miss_tolerance
+
+        self.condition = Condition()
+        self.heap = []
+        self.sequence = count()
+        self.lateness = LatencyHistogram()
+
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = Thread(target=self.run_worker, name="ActionDispatcher", daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+            self.thread = None
+
+
+    # Schedules `action` to run at the absolute `deadline` on the dispatcher's clock
+    def arm(self, deadline, action, is_traced=False):
+        with self.condition:
+            heapq.heappush(self.heap, (deadline, next(self.sequence), action, is_traced))
+            self.armed_count += 1
+            self.condition.notify()
+
+
+    # Drops every armed action, used when the beat loop stops
+    def cancel_all(self):
+        with self.condition:
+            self.cancelled_count += len(self.heap)
+            self.heap.clear()
+            self.condition.notify()
+
+
+    @property
+    def pending_count(self):
+        return len(self.heap)
+
+
+    def register_metrics(self, metrics):
+        metrics.counter_callback("actions_fired_total", "Beat actions fired", lambda: self.fired_count)
+        metrics.counter_callback("actions_missed_total", "Beat actions fired later than the miss tolerance", lambda: self.miss_count)
+        metrics.counter_callback("action_errors_total", "Beat actions that raised", lambda: self.error_count)
+        metrics.latency_summary("action_lateness_seconds", "Lateness of each beat action against its deadline", lambda: self.lateness)
+
+
+    def run_worker(self):
+        self.raise_thread_priority()
+        clock = self.clock
+
+        while True:
+            with self.condition:
+                while self.is_running:
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    remaining = self.heap[0][0] - clock()
+                    if remaining > self.SPIN_SECONDS:
+                        self.condition.wait(remaining - self.SPIN_SECONDS)
+                        continue
+                    deadline, _, action, is_traced = heapq.heappop(self.heap)
+                    break
+                else:
+                    return
+
+            while clock() < deadline:
+                pass
+
+            self.fire(deadline, action, is_traced)
+
+
+    def fire(self, deadline, action, is_traced):
+        lateness = self.clock() - deadline
+        if lateness > self.miss_tolerance:
+            self.miss_count += 1
+            return
+
+        tracer = self.tracer if is_traced else None
+        if tracer is not None:
+            tracer.mark(CLICK_DISPATCH)
+
+        try:
+            action.run()
+        except Exception as e:
+            self.error_count += 1
+            events.error("beat_action_failed", action=action, error=e)
+            return
+
+        if tracer is not None:
+            tracer.mark(CLICK_DONE)
+        self.fired_count += 1
+        self.lateness.record(lateness)
+
+
+    # Best effort, only Windows lets a thread raise its own priority without privileges
+    def raise_thread_priority(self):
+        if sys.platform != "win32":
+            return
+        try:
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), self.WINDOWS_THREAD_PRIORITY)
+        except (ImportError, AttributeError, OSError):
+            pass
+
+
+'''
+Fires beat actions from the event loop the pipeline runs on, with loop.call_at()
+
+Used with virtual_time.VirtualTimeEventLoop, where the worker thread's real-time waits
+could never follow the loop's clock. Misses, lateness and tracing work as above,
+measured on the loop's clock.
+'''
+class LoopActionDispatcher(ActionDispatcher):
+
+    loop = None
+
+
+    def __init__(self, loop, miss_tolerance=None, tracer=None):
+        super().__init__(loop.time, miss_tolerance, tracer)
+        self.loop = loop
+
+        # Timer handles of armed actions by sequence number
+        self.handles = {}
+
+
+    def start(self):
+        self.is_running = True
+
+
+    def stop(self):
+        self.cancel_all()
+        self.is_running = False
+
+
+    # Must be called from the loop's thread
+    def arm(self, deadline, action, is_traced=False):
+        key = next(self.sequence)
+        self.handles[key] = self.loop.call_at(deadline, self.fire_armed, key, deadline, action, is_traced)
+        self.armed_count += 1
+
+
+    def cancel_all(self):
+        self.cancelled_count += len(self.handles)
+        for handle in self.handles.values():
+            handle.cancel()
+        self.handles.clear()
+
+
+    @property
+    def pending_count(self):
+        return len(self.handles)
+
+
+    def fire_armed(self, key, deadline, action, is_traced):
+        del self.handles[key]
+        self.fire(deadline, action, is_traced)
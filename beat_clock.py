@@ -0,0 +1,146 @@
+from collections import deque
+from time import monotonic
+
+
+'''
+Schedules EKG beats against a monotonic clock
+
+Each beat is given an absolute deadline: the previous deadline plus the beat interval.
+Lateness of one beat is therefore corrected on the next one instead of accumulating.
+
+Beat intervals come from the RR intervals reported by the device when available,
+otherwise from the BPM, interpolated between the last two readings so a BPM change
+eases in over a beat or two rather than jumping.
+
+Drift (how late each beat actually started) is kept as metrics on the instance.
+'''
+class BeatClock:
+
+    # Physiologically plausible bounds for a single beat, in seconds
+    MIN_BEAT_INTERVAL = 0.2
+    MAX_BEAT_INTERVAL = 3.0
+
+    # Seconds over which a new BPM reading is blended in
+    BPM_INTERPOLATION_SECONDS = 1.0
+
+    # RR intervals older than this many beats are dropped when the EKG falls behind
+    MAX_QUEUED_RR_INTERVALS = 8
+
+    # Falling further behind than this resynchronises the schedule to now
+    MAX_DRIFT_BEFORE_RESYNC = 1.0
+
+    clock = None
+
+    previous_bpm = 0
+    current_bpm = 0
+    bpm_updated_at = None
+
+    next_beat_time = None
+    last_interval = 1.0
+
+    # Drift metrics, in seconds
+    beat_count = 0
+    rr_beat_count = 0
+    resync_count = 0
+    last_drift = 0.0
+    max_drift = 0.0
+    total_abs_drift = 0.0
+
+
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.rr_intervals = deque(maxlen=self.MAX_QUEUED_RR_INTERVALS)
+
+
+    # Records a new BPM reading
+    def push_bpm(self, bpm):
+        if bpm <= 0:
+            return
+        now = self.clock()
+        self.previous_bpm = self._interpolated_bpm(now) or bpm
+        self.current_bpm = bpm
+        self.bpm_updated_at = now
+
+
+    # Queues RR intervals (in seconds) to be used as the next beat intervals
+    def push_rr_intervals(self, rr_intervals):
+        for rr in rr_intervals:
+            if self.MIN_BEAT_INTERVAL <= rr <= self.MAX_BEAT_INTERVAL:
+                self.rr_intervals.append(rr)
+
+
+    # Restarts the schedule with the first beat due now
+    def start(self):
+        self.next_beat_time = self.clock()
+        self.rr_intervals.clear()
+        self.beat_count = 0
+        self.rr_beat_count = 0
+        self.resync_count = 0
+        self.last_drift = 0.0
+        self.max_drift = 0.0
+        self.total_abs_drift = 0.0
+
+
+    # Starts the beat that is due and returns (scheduled start time, beat interval)
+    def begin_beat(self):
+        now = self.clock()
+        if self.next_beat_time is None:
+            self.next_beat_time = now
+
+        scheduled = self.next_beat_time
+        drift = now - scheduled
+
+        # Too far behind to catch up without rushing several beats, start over from now
+        if drift > self.MAX_DRIFT_BEFORE_RESYNC:
+            self.resync_count += 1
+            scheduled = now
+            drift = 0.0
+
+        interval = self._next_interval(now)
+        self.next_beat_time = scheduled + interval
+
+        self.beat_count += 1
+        self.last_drift = drift
+        self.max_drift = max(self.max_drift, abs(drift))
+        self.total_abs_drift += abs(drift)
+
+        return scheduled, interval
+
+
+    # Seconds left until the next beat is due, negative when late
+    def time_until_next_beat(self):
+        return self.next_beat_time - self.clock()
+
+
+    @property
+    def mean_drift(self):
+        return self.total_abs_drift / self.beat_count if self.beat_count else 0.0
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def _next_interval(self, now):
+        if self.rr_intervals:
+            self.rr_beat_count += 1
+            self.last_interval = self.rr_intervals.popleft()
+            return self.last_interval
+
+        bpm = self._interpolated_bpm(now)
+        if bpm > 0:
+            interval = 60 / bpm
+            self.last_interval = min(self.MAX_BEAT_INTERVAL, max(self.MIN_BEAT_INTERVAL, interval))
+
+        return self.last_interval
+
+
+    def _interpolated_bpm(self, now):
+        if self.bpm_updated_at is None:
+            return self.current_bpm
+
+        progress = min(1.0, (now - self.bpm_updated_at) / self.BPM_INTERPOLATION_SECONDS)
+        return self.previous_bpm + (self.current_bpm - self.previous_bpm) * progress
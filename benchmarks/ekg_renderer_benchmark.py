@@ -0,0 +1,155 @@
+import tkinter as tk
+
+from ekg_renderer import EKGRenderer
+from time import perf_counter
+
+
+'''
+Micro-benchmark for drawing EKG beats
+
+Compares the old delete/create_line approach against EKGRenderer's in-place line updates.
+Reports the number of Tk canvas calls and the wall time spent per beat.
+A real Tk canvas is used when a display is available, otherwise a call-counting stand-in.
+
+Run from the repository root:
+    python -m benchmarks.ekg_renderer_benchmark
+'''
+
+BEATS = 50
+POINT_COUNTS = [21, 120, 240, 480, 960]
+
+
+# Stand-in canvas used when no display is available
+class CountingCanvas:
+
+    next_id = 0
+
+
+    def create_line(self, *args, **kwargs):
+        self.next_id += 1
+        return self.next_id
+
+
+    def coords(self, item, *args):
+        pass
+
+
+    def insert(self, item, index, coords):
+        pass
+
+
+    def delete(self, item):
+        pass
+
+
+# Wraps a canvas and counts the calls made into Tk
+class CallCounter:
+
+    calls = 0
+
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+
+
+    def create_line(self, *args, **kwargs):
+        self.calls += 1
+        return self.canvas.create_line(*args, **kwargs)
+
+
+    def coords(self, item, *args):
+        self.calls += 1
+        return self.canvas.coords(item, *args)
+
+
+    def insert(self, item, index, coords):
+        self.calls += 1
+        return self.canvas.insert(item, index, coords)
+
+
+    def delete(self, item):
+        self.calls += 1
+        return self.canvas.delete(item)
+
+
+# Builds a waveform of `point_count` points spread across the canvas width
+def build_coords(point_count, canvas_width=240, canvas_height=160):
+    coords = []
+    for i in range(point_count):
+        x = int(i * canvas_width / point_count)
+        y = canvas_height / 1.5 - (0.35 * 300 if i == point_count // 2 else 0)
+        coords.append((x, y))
+    return coords
+
+
+# The drawing approach used before EKGRenderer, kept for comparison
+def draw_beat_legacy(canvas, precomputed_coords):
+    canvas.delete("ekg")
+    line_id = None
+    for point_idx in range(1, len(precomputed_coords) + 1):
+        if line_id:
+            canvas.delete(line_id)
+
+        points_to_draw = []
+        for i in range(min(point_idx, len(precomputed_coords))):
+            points_to_draw.append(precomputed_coords[i][0])
+            points_to_draw.append(precomputed_coords[i][1])
+
+        if len(points_to_draw) >= 4:
+            line_id = canvas.create_line(points_to_draw, fill="#FF7F50", width=3, tags="ekg")
+
+
+def draw_beat_renderer(renderer, point_count):
+    renderer.begin_beat()
+    for point_idx in range(1, point_count + 1):
+        renderer.draw_to(point_idx)
+
+
+# Returns (Tk calls per beat, milliseconds per beat)
+def measure(canvas, point_count, use_renderer):
+    counter = CallCounter(canvas)
+    coords = build_coords(point_count)
+
+    if use_renderer:
+        renderer = EKGRenderer(counter)
+        renderer.set_waveform(coords)
+
+    start = perf_counter()
+    for _ in range(BEATS):
+        if use_renderer:
+            draw_beat_renderer(renderer, point_count)
+        else:
+            draw_beat_legacy(counter, coords)
+        if hasattr(canvas, "update_idletasks"):
+            canvas.update_idletasks()
+    elapsed = perf_counter() - start
+
+    canvas.delete("ekg")
+    return counter.calls / BEATS, elapsed / BEATS * 1000
+
+
+def main():
+    root = None
+    try:
+        root = tk.Tk()
+        canvas = tk.Canvas(root, width=240, height=160)
+        canvas.pack()
+        backend = "tk"
+    except tk.TclError:
+        canvas = CountingCanvas()
+        backend = "counting stand-in (no display)"
+
+    print(f"Canvas backend: {backend}, {BEATS} beats per measurement")
+    print(f"{'points':>8} {'legacy calls':>14} {'legacy ms':>11} {'renderer calls':>16} {'renderer ms':>13}")
+
+    for point_count in POINT_COUNTS:
+        legacy_calls, legacy_ms = measure(canvas, point_count, use_renderer=False)
+        renderer_calls, renderer_ms = measure(canvas, point_count, use_renderer=True)
+        print(f"{point_count:>8} {legacy_calls:>14.0f} {legacy_ms:>11.3f} {renderer_calls:>16.0f} {renderer_ms:>13.3f}")
+
+    if root is not None:
+        root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import tracemalloc
+
+from heart_rate_parser import (
+    parse_heart_rate_measurement,
+    parse_heart_rate_measurements,
+    encode_heart_rate_measurement,
+)
+from random import Random
+from time import perf_counter
+
+
+'''
+Fuzz check and throughput benchmark for the Heart Rate Measurement parser
+
+The fuzz pass feeds random and truncated payloads through the parser, which must
+either decode them or raise ValueError, and checks encode/decode round trips.
+The benchmark reports notifications per second for the single and batch paths
+and the memory allocated while parsing.
+
+Run from the repository root:
+    python -m benchmarks.heart_rate_parser_benchmark
+'''
+
+FUZZ_ITERATIONS = 100_000
+BENCHMARK_NOTIFICATIONS = 200_000
+SEED = 2037
+
+
+def random_measurement(rng):
+    heart_rate = rng.choice([rng.randint(30, 255), rng.randint(256, 0xFFFF)])
+    energy = rng.randint(0, 0xFFFF) if rng.random() < 0.3 else None
+    rr_intervals = tuple(rng.randint(200, 2000) for _ in range(rng.randint(0, 7)))
+    sensor_contact = rng.choice([None, True, False])
+    return heart_rate, energy, rr_intervals, sensor_contact
+
+
+def fuzz(rng):
+    malformed = 0
+    for _ in range(FUZZ_ITERATIONS):
+        # Round trip of a valid payload
+        heart_rate, energy, rr_intervals, sensor_contact = random_measurement(rng)
+        payload = encode_heart_rate_measurement(heart_rate, energy, rr_intervals, sensor_contact)
+        measurement = parse_heart_rate_measurement(payload)
+        assert measurement.heart_rate == heart_rate
+        assert measurement.energy_expended == energy
+        assert measurement.rr_intervals == rr_intervals
+        assert measurement.sensor_contact == sensor_contact
+
+        # Random bytes and truncations must decode or raise ValueError, nothing else
+        garbage = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 24)))
+        for candidate in (garbage, payload[:rng.randint(0, len(payload))]):
+            try:
+                parse_heart_rate_measurement(candidate)
+            except ValueError:
+                malformed += 1
+
+    print(f"Fuzz: {FUZZ_ITERATIONS} round trips OK, {malformed} malformed payloads rejected with ValueError")
+
+
+def benchmark(rng):
+    payloads = [
+        encode_heart_rate_measurement(*random_measurement(rng))
+        for _ in range(BENCHMARK_NOTIFICATIONS)
+    ]
+
+    start = perf_counter()
+    for payload in payloads:
+        parse_heart_rate_measurement(payload)
+    single_elapsed = perf_counter() - start
+
+    start = perf_counter()
+    batch, error_count = parse_heart_rate_measurements(payloads)
+    batch_elapsed = perf_counter() - start
+
+    # Measured separately, tracing slows the parser down
+    tracemalloc.start()
+    parse_heart_rate_measurements(payloads)
+    _, batch_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert error_count == 0 and len(batch) == len(payloads)
+    rr_count = len(batch.rr_intervals)
+
+    print(f"Single: {len(payloads) / single_elapsed:,.0f} notifications/s")
+    print(f"Batch:  {len(payloads) / batch_elapsed:,.0f} notifications/s")
+    print(f"Batch peak allocation: {batch_peak / len(payloads):.1f} bytes/notification "
+          f"({rr_count} RR intervals stored in compact arrays)")
+
+
+def main():
+    rng = Random(SEED)
+    fuzz(rng)
+    benchmark(rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import platform
+
+from heart_pipeline import HeartPipeline, NullRenderer
+from ekg_synth import synthesize_beat, cache_info
+from action_dispatcher import ActionDispatcher, CallableAction
+from latency_tracer import LatencyTracer, NOTIFY, BPM_UPDATE, BEAT_START, R_PEAK, CLICK_DISPATCH, CLICK_DONE
+from simulated_peripheral import SimulatedTransport
+from session_recorder import SessionReplay
+from datetime import datetime
+from os import path as os_path, makedirs
+from time import perf_counter, process_time, monotonic
+
+
+'''
+Throughput and timing benchmark for the headless heart pipeline
+
+Runs HeartPipeline with the NullRenderer, so no display is needed, and reports:
+    notifications/s        raw 0x2A37 payloads through handle_notification
+    per-beat jitter        beat start drift, R peak lateness and dispatched action lateness, in milliseconds
+    CPU per beat           process time spent per beat, in microseconds
+    tracing overhead       cost of marking every stage of one beat, in nanoseconds
+at 60, 120 and 220 BPM. The beat runs use real time, BEATS_PER_RUN beats each.
+
+The stream is synthetic (simulated strap) unless a session recording is given.
+Results are written as JSON to benchmarks/results/ so runs can be compared over time.
+
+Run from the repository root:
+    python -m benchmarks.pipeline_benchmark [session.ihcrec]
+'''
+
+BENCHMARK_BPMS = (60, 120, 220)
+BEATS_PER_RUN = 10
+SYNTHETIC_NOTIFICATIONS = 200_000
+TRACED_BEATS = 200_000
+RESULTS_DIRECTORY = os_path.join(os_path.dirname(os_path.abspath(__file__)), "results")
+
+
+# Pipeline that remembers when each beat's R peak was due
+class TimedPipeline(HeartPipeline):
+
+    r_peak_due_at = None
+
+
+    async def run_beat(self, beat_start_time, seconds_per_beat):
+        self.r_peak_due_at = beat_start_time + self.waveform.phase_fractions["r_peak"] * seconds_per_beat
+        await super().run_beat(beat_start_time, seconds_per_beat)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values, scale):
+    return {
+        "mean": scale * sum(values) / len(values),
+        "p50": scale * percentile(values, 0.5),
+        "p99": scale * percentile(values, 0.99),
+        "max": scale * max(values),
+    }
+
+
+def synthetic_payloads(count):
+    transport = SimulatedTransport(seed=1)
+    return [transport.next_payload(float(second)) for second in range(count)]
+
+
+def measure_throughput(payloads):
+    pipeline = HeartPipeline()
+
+    start = perf_counter()
+    for payload in payloads:
+        pipeline.handle_notification(None, payload)
+    elapsed = perf_counter() - start
+
+    return {
+        "notifications": len(payloads),
+        "parse_errors": pipeline.parse_error_count,
+        "seconds": elapsed,
+        "notifications_per_second": len(payloads) / elapsed,
+    }
+
+
+def measure_synth(resolution=HeartPipeline.waveform_resolution):
+    start = perf_counter()
+    for bpm in range(30, 230):
+        synthesize_beat(bpm, resolution)
+    uncached_elapsed = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(50):
+        for bpm in range(30, 230):
+            synthesize_beat(bpm, resolution)
+    cached_elapsed = perf_counter() - start
+
+    return {
+        "uncached_ms": 1000 * uncached_elapsed / 200,
+        "cached_us": 1e6 * cached_elapsed / (50 * 200),
+        "cache_size": cache_info().currsize,
+    }
+
+
+def measure_tracer_overhead(beats=TRACED_BEATS):
+    tracer = LatencyTracer()
+    mark = tracer.mark
+
+    start = perf_counter()
+    for _ in range(beats):
+        mark(NOTIFY)
+        mark(BPM_UPDATE)
+        mark(BEAT_START)
+        mark(R_PEAK)
+        mark(CLICK_DISPATCH)
+        mark(CLICK_DONE)
+    elapsed = perf_counter() - start
+
+    return {"beats": beats, "ns_per_beat": 1e9 * elapsed / beats}
+
+
+async def measure_beats(bpm, beats=BEATS_PER_RUN):
+    beat_drifts = []
+    r_peak_lateness = []
+
+    def on_r_peak():
+        r_peak_lateness.append(monotonic() - pipeline.r_peak_due_at)
+        beat_drifts.append(pipeline.beat_clock.last_drift)
+        if len(r_peak_lateness) >= beats:
+            pipeline.stop()
+
+    # A no-op action stands in for the click
+    dispatcher = ActionDispatcher()
+    pipeline = TimedPipeline(
+        renderer=NullRenderer(),
+        on_r_peak=on_r_peak,
+        dispatcher=dispatcher,
+        beat_actions={"r_peak": [CallableAction(lambda: None)]},
+    )
+    dispatcher.tracer = pipeline.tracer
+    dispatcher.start()
+    pipeline.update_bpm(bpm)
+
+    cpu_start = process_time()
+    wall_start = perf_counter()
+    await pipeline.run()
+    wall_elapsed = perf_counter() - wall_start
+    cpu_elapsed = process_time() - cpu_start
+    dispatcher.stop()
+
+    return {
+        "bpm": bpm,
+        "beats": pipeline.beat_count,
+        "seconds": wall_elapsed,
+        "beat_drift_ms": summarize(beat_drifts, 1000),
+        "r_peak_lateness_ms": summarize(r_peak_lateness, 1000),
+        "resyncs": pipeline.beat_clock.resync_count,
+        "action_lateness_ms": dispatcher.lateness.summary(),
+        "action_misses": dispatcher.miss_count,
+        "cpu_per_beat_us": 1e6 * cpu_elapsed / pipeline.beat_count,
+        "latency": pipeline.tracer.report(),
+    }
+
+
+def write_results(results):
+    makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    results_path = os_path.join(RESULTS_DIRECTORY, f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    return results_path
+
+
+def main(session_path=None):
+    if session_path:
+        replay = SessionReplay(session_path)
+        payloads = [bytearray(payload) for payload in replay.payloads()]
+        replay.close()
+        source = session_path
+    else:
+        payloads = synthetic_payloads(SYNTHETIC_NOTIFICATIONS)
+        source = "synthetic"
+
+    throughput = measure_throughput(payloads)
+    print(f"Throughput ({source}): {throughput['notifications_per_second']:,.0f} notifications/s, "
+          f"{throughput['parse_errors']} parse errors")
+
+    synth = measure_synth()
+    print(f"EKG synth: {synth['uncached_ms']:.2f} ms per new BPM, {synth['cached_us']:.2f} us cached")
+
+    tracer_overhead = measure_tracer_overhead()
+    print(f"Tracing overhead: {tracer_overhead['ns_per_beat']:,.0f} ns/beat")
+
+    beat_runs = []
+    for bpm in BENCHMARK_BPMS:
+        run = asyncio.run(measure_beats(bpm))
+        beat_runs.append(run)
+        print(f"{bpm:>3} BPM: drift p99 {run['beat_drift_ms']['p99']:.2f} ms, "
+              f"R peak lateness p50 {run['r_peak_lateness_ms']['p50']:.2f} ms / p99 {run['r_peak_lateness_ms']['p99']:.2f} ms, "
+              f"action lateness p99 {run['action_lateness_ms']['p99_ms']:.3f} ms ({run['action_misses']} missed), "
+              f"CPU {run['cpu_per_beat_us']:.0f} us/beat")
+
+    results = {
+        "benchmark": "pipeline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "source": source,
+        "samples_per_beat": HeartPipeline.waveform_resolution,
+        "synth": synth,
+        "throughput": throughput,
+        "tracer_overhead": tracer_overhead,
+        "beats": beat_runs,
+    }
+    print(f"Results written to {write_results(results)}")
+
+
+if __name__ == "__main__":
+    import sys
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
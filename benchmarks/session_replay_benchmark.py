@@ -0,0 +1,65 @@
+import tempfile
+
+from heart_rate_parser import parse_heart_rate_measurements
+from heart_pipeline import HeartPipeline
+from session_recorder import SessionRecorder, SessionReplay
+from simulated_peripheral import SimulatedTransport
+from os import path as os_path
+from time import perf_counter
+
+
+'''
+Records a long synthetic session and replays it as fast as possible
+
+The session is generated by the simulated peripheral at one notification per second,
+written with SessionRecorder and replayed through the memory-mapped SessionReplay
+into HeartPipeline.handle_notification, the handler the app feeds notifications to.
+
+Run from the repository root:
+    python -m benchmarks.session_replay_benchmark [hours]
+'''
+
+DEFAULT_HOURS = 4
+
+
+def record_session(path, hours):
+    transport = SimulatedTransport(seed=1)
+    recorder = SessionRecorder(path)
+    for second in range(int(hours * 3600)):
+        recorder.record(transport.next_payload(float(second)), timestamp=float(second))
+    recorder.close()
+    return recorder.record_count
+
+
+def main(hours=DEFAULT_HOURS):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os_path.join(directory, "session.ihcrec")
+
+        start = perf_counter()
+        record_count = record_session(path, hours)
+        record_elapsed = perf_counter() - start
+        print(f"Recorded {hours} h ({record_count} notifications, {os_path.getsize(path) / 1024:.0f} KiB) in {record_elapsed:.2f}s")
+
+        pipeline = HeartPipeline()
+        replay = SessionReplay(path)
+
+        start = perf_counter()
+        replayed = replay.replay_now(pipeline.handle_notification)
+        replay_elapsed = perf_counter() - start
+        print(f"Replayed through the pipeline in {replay_elapsed:.2f}s ({replayed / replay_elapsed:,.0f} notifications/s)")
+
+        start = perf_counter()
+        batch, error_count = parse_heart_rate_measurements(replay.payloads())
+        batch_elapsed = perf_counter() - start
+        print(f"Batch decoded in {batch_elapsed:.2f}s ({len(batch) / batch_elapsed:,.0f} notifications/s, {error_count} errors)")
+
+        history = pipeline.bpm_history
+        print(f"Session mean BPM (last 300): {history.mean(300):.1f}, RMSSD: {history.rmssd():.1f} ms")
+
+        del batch
+        replay.close()
+
+
+if __name__ == "__main__":
+    import sys
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_HOURS)
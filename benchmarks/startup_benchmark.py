@@ -0,0 +1,95 @@
+import json
+import subprocess
+import sys
+
+from datetime import datetime
+from os import path as os_path, makedirs
+
+
+'''
+Import-time profile of the application's cold start
+
+Imports start.py in a fresh interpreter with `python -X importtime`, which is
+everything that runs before the window can be created, and reports the slowest
+modules. Heavy dependencies (bleak, pygame, PIL, keyboard, pyautogui) are imported
+by the startup stages after the window is shown and must not appear here.
+
+The total is checked against IMPORT_BUDGET_MS; the script exits with status 1 when
+it is over budget or a deferred module was imported eagerly.
+Results are written as JSON to benchmarks/results/.
+
+Run from the repository root:
+    python -m benchmarks.startup_benchmark [budget_ms]
+'''
+
+IMPORT_BUDGET_MS = 150
+REPORTED_MODULES = 15
+
+# Imported by the startup stages, never while start.py loads
+DEFERRED_MODULES = ("bleak", "pygame", "PIL", "keyboard", "pyautogui")
+
+ROOT_DIRECTORY = os_path.dirname(os_path.dirname(os_path.abspath(__file__)))
+RESULTS_DIRECTORY = os_path.join(ROOT_DIRECTORY, "benchmarks", "results")
+
+
+# Returns [(module, self_us, cumulative_us, depth)] from `-X importtime` output
+def profile_imports(module="start"):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIRECTORY,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def main(budget_ms=IMPORT_BUDGET_MS):
+    entries = profile_imports()
+
+    # Top-level entries are the outermost imports, their cumulative times add up to the total
+    top_level_depth = min(depth for _, _, _, depth in entries)
+    total_ms = sum(cumulative for _, _, cumulative, depth in entries if depth == top_level_depth) / 1000
+
+    slowest = sorted(entries, key=lambda entry: entry[2], reverse=True)[:REPORTED_MODULES]
+    print(f"Importing start.py took {total_ms:.1f} ms (budget {budget_ms} ms)")
+    for name, self_us, cumulative_us, _ in slowest:
+        print(f"  {name:<40} {cumulative_us / 1000:8.2f} ms cumulative {self_us / 1000:8.2f} ms self")
+
+    imported_names = {name for name, _, _, _ in entries}
+    eager_modules = [module for module in DEFERRED_MODULES if module in imported_names]
+    if eager_modules:
+        print(f"Deferred modules imported eagerly: {', '.join(eager_modules)}")
+
+    results = {
+        "benchmark": "startup",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "import_ms": total_ms,
+        "budget_ms": budget_ms,
+        "eager_deferred_modules": eager_modules,
+        "slowest_modules": [
+            {"module": name, "cumulative_ms": cumulative_us / 1000, "self_ms": self_us / 1000}
+            for name, self_us, cumulative_us, _ in slowest
+        ],
+    }
+    makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    results_path = os_path.join(RESULTS_DIRECTORY, f"startup-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results written to {results_path}")
+
+    return 0 if total_ms <= budget_ms and not eager_modules else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET_MS))
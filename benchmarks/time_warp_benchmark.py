@@ -0,0 +1,187 @@
+import hashlib
+import json
+import platform
+import sys
+
+from heart_pipeline import HeartPipeline
+from action_dispatcher import LoopActionDispatcher, CallableAction
+from connection_supervisor import ConnectionSupervisor
+from bluetooth_controller import subscribe_heart_rate_notifications
+from device_cache import DeviceCache
+from simulated_peripheral import SimulatedTransport, constant_profile
+from virtual_time import VirtualTimeEventLoop
+from datetime import datetime
+from os import path as os_path, makedirs
+from random import Random
+from time import perf_counter
+from asyncio import sleep, create_task
+
+
+'''
+Deterministic time-warp check of the beat loop
+
+Runs the simulated strap -> connection supervisor -> pipeline -> dispatcher chain on a
+virtual-time event loop, so SESSION_SECONDS of operation take well under a second of
+wall time, and every random choice is seeded so two runs are identical. Checks:
+
+    beats       the number of beats matches the strap's RR intervals
+    drift       no beat started more than MAX_DRIFT_SECONDS after its deadline
+    clicks      every R peak click fired on time, none missed, evenly spaced
+    reconnects  every injected disconnect was followed by a reconnect within MAX_OUTAGE_SECONDS
+
+The script exits with status 1 when a check fails. Results are written as JSON
+to benchmarks/results/, with a digest of the click times to compare runs by.
+
+Run from the repository root:
+    python -m benchmarks.time_warp_benchmark [bpm] [seconds]
+'''
+
+SESSION_BPM = 180
+SESSION_SECONDS = 3600
+DISCONNECT_INTERVAL = 300
+SEED = 1
+
+# The pipeline only wakes for beat events, drawing frames is the renderer benchmark's business
+DRAW_INTERVAL = 1.0
+
+MAX_DRIFT_SECONDS = 0.002
+MAX_CLICK_LATENESS_SECONDS = 0.001
+MAX_CLICK_INTERVAL_ERROR_SECONDS = 0.002
+MAX_OUTAGE_SECONDS = 2.0
+BEAT_COUNT_TOLERANCE = 0.01
+
+SIMULATED_ADDRESS = SimulatedTransport.ADDRESS
+RESULTS_DIRECTORY = os_path.join(os_path.dirname(os_path.abspath(__file__)), "results")
+
+
+async def run_session(loop, bpm, seconds):
+    transport = SimulatedTransport(profile=constant_profile(bpm), disconnect_interval=DISCONNECT_INTERVAL, seed=SEED)
+    device_cache = DeviceCache(is_persistent=False)
+
+    click_times = []
+    dispatcher = LoopActionDispatcher(loop)
+    dispatcher.start()
+
+    pipeline = HeartPipeline(
+        clock=loop.time,
+        dispatcher=dispatcher,
+        beat_actions={"r_peak": [CallableAction(lambda: click_times.append(loop.time()))]},
+    )
+    pipeline.DRAW_INTERVAL = DRAW_INTERVAL
+
+    async def subscribe(client):
+        await subscribe_heart_rate_notifications(client, SIMULATED_ADDRESS, device_cache, pipeline.handle_notification)
+
+    supervisor = ConnectionSupervisor(
+        lambda disconnected_callback: transport.create_client(SIMULATED_ADDRESS, disconnected_callback),
+        on_connected=subscribe,
+        rng=Random(SEED),
+    )
+    supervisor.start()
+    await supervisor.wait_until_settled()
+
+    started_at = loop.time()
+    pipeline_task = create_task(pipeline.run())
+    await sleep(seconds)
+    pipeline.stop()
+    await pipeline_task
+    await supervisor.stop()
+    dispatcher.stop()
+
+    return pipeline, dispatcher, supervisor, transport, click_times, loop.time() - started_at
+
+
+def check_session(pipeline, dispatcher, supervisor, transport, click_times, elapsed, bpm, seconds):
+    checks = {}
+
+    # The strap reports whole 1/1024 s RR intervals, the beat clock follows those
+    rr_seconds = round(60 / bpm * 1024) / 1024
+    expected_beats = elapsed / rr_seconds
+    checks["beats"] = abs(pipeline.beat_count - expected_beats) <= BEAT_COUNT_TOLERANCE * expected_beats
+
+    checks["drift"] = pipeline.beat_clock.max_drift <= MAX_DRIFT_SECONDS
+
+    intervals = [later - earlier for earlier, later in zip(click_times, click_times[1:])]
+    max_interval_error = max(abs(interval - rr_seconds) for interval in intervals) if intervals else float("inf")
+    checks["clicks"] = (
+        dispatcher.miss_count == 0
+        and dispatcher.error_count == 0
+        and dispatcher.lateness.maximum <= MAX_CLICK_LATENESS_SECONDS
+        and max_interval_error <= MAX_CLICK_INTERVAL_ERROR_SECONDS
+    )
+
+    expected_disconnects = int(seconds // DISCONNECT_INTERVAL)
+    mean_outage = supervisor.downtime / supervisor.disconnect_count if supervisor.disconnect_count else 0.0
+    checks["reconnects"] = (
+        supervisor.disconnect_count >= expected_disconnects - 1
+        and supervisor.connect_count == supervisor.disconnect_count + 1
+        and mean_outage <= MAX_OUTAGE_SECONDS
+    )
+
+    digest = hashlib.sha256(json.dumps([round(t, 9) for t in click_times]).encode()).hexdigest()[:16]
+    return checks, {
+        "virtual_seconds": elapsed,
+        "beats": pipeline.beat_count,
+        "expected_beats": expected_beats,
+        "max_drift_ms": 1000 * pipeline.beat_clock.max_drift,
+        "beat_resyncs": pipeline.beat_clock.resync_count,
+        "clicks": len(click_times),
+        "clicks_missed": dispatcher.miss_count,
+        "click_lateness_max_ms": 1000 * dispatcher.lateness.maximum,
+        "click_interval_error_max_ms": 1000 * max_interval_error,
+        "notifications": pipeline.notification_count,
+        "disconnects": supervisor.disconnect_count,
+        "connects": supervisor.connect_count,
+        "mean_outage_s": mean_outage,
+        "click_digest": digest,
+    }
+
+
+def main(bpm=SESSION_BPM, seconds=SESSION_SECONDS):
+    loop = VirtualTimeEventLoop()
+    try:
+        wall_started_at = perf_counter()
+        session = loop.run_until_complete(run_session(loop, bpm, seconds))
+        wall_seconds = perf_counter() - wall_started_at
+    finally:
+        loop.close()
+
+    checks, measurements = check_session(*session, bpm, seconds)
+    print(f"{seconds / 3600:g} h at {bpm} BPM in {wall_seconds:.2f} s wall time "
+          f"({measurements['virtual_seconds'] / wall_seconds:,.0f}x real time)")
+    print(f"  beats       {measurements['beats']} (expected {measurements['expected_beats']:.0f}), "
+          f"max drift {measurements['max_drift_ms']:.3f} ms")
+    print(f"  clicks      {measurements['clicks']}, {measurements['clicks_missed']} missed, "
+          f"max lateness {measurements['click_lateness_max_ms']:.3f} ms, max interval error {measurements['click_interval_error_max_ms']:.3f} ms")
+    print(f"  reconnects  {measurements['disconnects']} disconnects, {measurements['connects']} connects, "
+          f"mean outage {measurements['mean_outage_s']:.2f} s")
+    print(f"  click digest {measurements['click_digest']}")
+
+    failed = [name for name, passed in checks.items() if not passed]
+    print("All checks passed" if not failed else f"Failed checks: {', '.join(failed)}")
+
+    results = {
+        "benchmark": "time_warp",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "bpm": bpm,
+        "session_seconds": seconds,
+        "wall_seconds": wall_seconds,
+        "checks": checks,
+        "measurements": measurements,
+    }
+    makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    results_path = os_path.join(RESULTS_DIRECTORY, f"time-warp-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results written to {results_path}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else SESSION_BPM,
+        float(sys.argv[2]) if len(sys.argv) > 2 else SESSION_SECONDS,
+    ))
@@ -1,10 +1,90 @@
-from asyncio import create_task, sleep
-from bleak import BleakClient
+from connection_supervisor import ConnectionSupervisor
+from bluetooth_transport import BleakTransport
+from device_cache import DeviceCache
+from event_log import events
+
+import sys
+
+
+HEART_RATE_SERVICE_UUID = "0000180d-0000-1000-8000-00805f9b34fb"
+HEART_RATE_CHAR_UUID = "00002a37-0000-1000-8000-00805f9b34fb"
+
+BLUETOOTH_CONNECT_TIMEOUT = 10
+
+
+# # # # # # # #
+#
+# Heart rate helpers, shared with the multi-device sessions
+#
+# # # # # # # #
+
+
+# Returns the heart rate measurement characteristic of a connected client or None
+# Uses the predefined HEART_RATE_SERVICE_UUID and HEART_RATE_CHAR_UUID
+# Those UUIDs are defined in the Bluetooth GATT specification
+def find_heart_rate_characteristic(client):
+    # Services are discovered while connecting, look the service up instead of walking them all
+    service = client.services.get_service(HEART_RATE_SERVICE_UUID)
+    if service is None:
+        return None
+    return service.get_characteristic(HEART_RATE_CHAR_UUID)
+
+
+# Subscribes `handler` to heart rate notifications, returns the characteristic UUID or None on failure
+async def subscribe_heart_rate_notifications(client, address, device_cache, handler):
+    # Reuse the handle cached from a previous session, but only while it still is the heart rate characteristic:
+    # after a firmware update, or for another device at the same address, it can point anywhere
+    cached_device = device_cache.get(address)
+    if cached_device and cached_device.get("characteristic_handle") is not None:
+        characteristic = client.services.get_characteristic(cached_device["characteristic_handle"])
+        if characteristic is not None and characteristic.uuid.lower() == HEART_RATE_CHAR_UUID:
+            try:
+                await client.start_notify(characteristic, handler)
+                return characteristic.uuid
+            except Exception as e:
+                print(f"Cached characteristic handle is stale, rediscovering services:\n{e}")
+        device_cache.invalidate_characteristic(address)
+
+    # Some devices might not support heart rate measurement
+    characteristic = find_heart_rate_characteristic(client)
+    if characteristic is None:
+        print("ERROR: No characteristic UUID found.\nDoes the device support Heart Rate Measurement?")
+        return None
+
+    try:
+        await client.start_notify(characteristic, handler)
+        # Only the handle is cached here, connections are remembered by whoever made them
+        device_cache.remember(
+            address,
+            characteristic_handle=characteristic.handle,
+            characteristic_uuid=characteristic.uuid,
+            is_connection=False,
+        )
+        return characteristic.uuid
+
+    except Exception as e:
+        print(f"Error encountered while starting notifications:\n{e}")
+        return None
+
+
+# Keyword arguments for BleakClient, reusing what worked for a cached device
+def get_connection_parameters(device_cache, address):
+    cached_device = device_cache.get(address) or {}
+    cached_parameters = cached_device.get("connection_parameters", {})
+
+    connection_parameters = {"timeout": cached_parameters.get("timeout", BLUETOOTH_CONNECT_TIMEOUT)}
+
+    # Let Windows reuse its own GATT cache for devices we have connected to before
+    if sys.platform == "win32" and cached_device:
+        connection_parameters["winrt"] = {"use_cached_services": True}
+
+    return connection_parameters
+
 
 '''
 Used to manage bluetooth connections,
 read data,
-keep alive,
+keep alive (through a ConnectionSupervisor),
 and call actions based on the data
 '''
 
@@ -16,6 +96,10 @@ class BluetoothController:
 
     # Bluetooth Device Information
     client = None
+    connection_supervisor = None
+
+    # Creates the clients, real Bleak clients unless a simulated transport is given
+    transport = None
 
     selected_device_name = "Not Connected"
     selected_device_address = None
@@ -25,58 +109,69 @@ class BluetoothController:
     is_bluetooth_device_list_error = False
     is_heart_rate_monitor_running = False
 
-    HEART_RATE_SERVICE_UUID = "0000180d-0000-1000-8000-00805f9b34fb"
-    HEART_RATE_CHAR_UUID = "00002a37-0000-1000-8000-00805f9b34fb"
+    HEART_RATE_SERVICE_UUID = HEART_RATE_SERVICE_UUID
+    HEART_RATE_CHAR_UUID = HEART_RATE_CHAR_UUID
     
     SCANNING_RETRY_SLEEP = 2
-    BLUETOOTH_RECONNECT_RETRY_SLEEP = 2
-    BLUETOOTH_KEEP_ALIVE_SLEEP = 5
+    BLUETOOTH_CONNECT_TIMEOUT = BLUETOOTH_CONNECT_TIMEOUT
+    AUTO_CONNECT_ATTEMPTS = 3
     LISTEN_FOR_CANCEL_SLEEP_TIME = 0.1
 
+    # Counters, over every connection of this run
+    disconnect_count = 0
+    reconnect_count = 0
+
     # Bluetooth Threads
     bluetooth_loop = None
 
 
-    def __init__(self, parent_instance, bluetooth_loop):
+    def __init__(self, parent_instance, bluetooth_loop, transport=None):
         self.parent_instance = parent_instance
         self.bluetooth_loop = bluetooth_loop
-    
+        self.transport = transport or BleakTransport()
+
+        # Last-known names, characteristic handles and connection parameters per device
+        self.device_cache = DeviceCache(is_persistent=self.transport.is_persistent)
 
-    async def connect_bluetooth(self):
-        print(f"Attempting connect to {self.selected_device_name}  ({self.selected_device_address})...")
-        while self.client is None:
-            try:
-                print("Client is None. Attempting to connect...")
-                self.client = BleakClient(self.selected_device_address)
-                await self.client.connect()
 
-                self.is_bluetooth_device_connected = True
-                self.parent_instance.bluetooth_text.config(text=f"{self.parent_instance.bluetooth_device_verbiage}{self.selected_device_name}")
-                self.parent_instance.bluetooth_devices_button.config(text="Disconnect")
+    # Reconnects to the most recently used device, called at startup
+    async def auto_connect(self):
+        address, cached_device = self.device_cache.most_recent()
+        if address is None or self.client is not None:
+            return
 
-                create_task(self.bluetooth_keep_alive())
+        self.selected_device_address = address
+        self.selected_device_name = cached_device.get("name", address)
+        print(f"Auto-connecting to cached device {self.selected_device_name} ({address})...")
 
-            except Exception as e:
-                print(f"Connection error: {e}. Retrying in {self.BLUETOOTH_RECONNECT_RETRY_SLEEP} seconds...")
-                self.parent_instance.bluetooth_text.config(text=f"{self.parent_instance.bluetooth_device_verbiage}Connecting...")
-                await sleep(self.BLUETOOTH_RECONNECT_RETRY_SLEEP)
+        await self.connect_bluetooth(max_attempts=self.AUTO_CONNECT_ATTEMPTS)
+
+        if not self.is_bluetooth_device_connected:
+            self.selected_device_name = "Not Connected"
+            self.update_bluetooth_text(self.selected_device_name)
     
 
-    # Connect to a defined Bluetooth device and keep the connection alive
-    async def bluetooth_keep_alive(self):
-        while self.client is not None:
-            try:
-                if not self.client.is_connected:
-                    await self.client.connect()
-                    self.is_bluetooth_device_connected = True
-                    print(f"Reconnected to {self.selected_device_name} ({self.selected_device_address})")
-                else:
-                    print("Bluetooth device is kept alive.")
-            except Exception as e:
-                print(f"Connection error: {e}")
-                await self.disconnect_bluetooth_device()
-            # Sleep before trying a keep alive again
-            await sleep(self.BLUETOOTH_KEEP_ALIVE_SLEEP)
+    # Connects to the selected device, returning once connected or once the attempts run out
+    # The connection supervisor then keeps it alive, reconnecting as soon as it drops
+    async def connect_bluetooth(self, max_attempts=None):
+        if self.connection_supervisor is not None:
+            await self.connection_supervisor.stop()
+
+        print(f"Attempting connect to {self.selected_device_name}  ({self.selected_device_address})...")
+        self.update_bluetooth_text("Connecting...")
+
+        self.connection_supervisor = ConnectionSupervisor(
+            self.create_client,
+            on_connected=self.on_bluetooth_connected,
+            on_disconnected=self.on_bluetooth_disconnected,
+            max_initial_attempts=max_attempts,
+        )
+        self.connection_supervisor.start()
+
+        if not await self.connection_supervisor.wait_until_settled():
+            self.connection_supervisor = None
+            self.client = None
+            self.update_bluetooth_text(self.selected_device_name)
     
 
     # Begins reading heart rate data from the Bluetooth device
@@ -85,44 +180,29 @@ class BluetoothController:
             print("Bluetooth device is not connected.")
             return
 
-        # Fetch services and characteristics
-        self.selected_device_characteristic_uuid = await self.search_for_characteristic_uuid()
-        
-        # Some devices might not support heart rate measurement
-        if not self.selected_device_characteristic_uuid:
-            print("BPM Char UUID not found.\nPerhaps device does not support BPM?")
-            return
-
-        try:
-            await self.client.start_notify(self.selected_device_characteristic_uuid, self.parent_instance.heart_rate_handler)        
-            self.is_heart_rate_monitor_running = True
-        
-        except Exception as e:
-            print(f"Error encountered while starting notifications:\n{e}")
-            self.stop_heart_rate_monitor()
+        self.is_heart_rate_monitor_running = await self.subscribe_heart_rate()
 
 
     def stop_heart_rate_monitor(self):
         self.is_heart_rate_monitor_running = False
 
 
-    # Handle a situation where the bluetooth device disconnects
+    # Handle a user request to disconnect from the bluetooth device
     async def disconnect_bluetooth_device(self):
         print("Disconnecting from Bluetooth device...")
-        try:
-            await self.client.disconnect()
-        except:
-            pass
+        if self.connection_supervisor is not None:
+            await self.connection_supervisor.stop()
+            self.connection_supervisor = None
 
         self.selected_device_name = "Not Connected"
-        self.parent_instance.bluetooth_text.config(text=f"{self.parent_instance.bluetooth_device_verbiage}{self.selected_device_name}")
-        self.parent_instance.bluetooth_devices_button.config(text="Connect Device")
+        self.update_bluetooth_text(self.selected_device_name)
+        self.parent_instance.run_on_ui(self.parent_instance.bluetooth_devices_button.config, text="Connect Device")
         self.is_bluetooth_device_connected = False
 
         if self.is_heart_rate_monitor_running:
             self.stop_heart_rate_monitor()
 
-        self.parent_instance.stop_actions()
+        self.parent_instance.run_on_ui(self.parent_instance.stop_actions)
 
         self.client = None
 
@@ -133,21 +213,80 @@ class BluetoothController:
     #
     # # # # # # # #   
  
-    # Returns the characteristic UUID for the heart rate service or None
-    # Uses the predefined HEART_RATE_SERVICE_UUID and HEART_RATE_CHAR_UUID
-    # Those UUIDs are defined in the Bluetooth GATT specification
-    async def search_for_characteristic_uuid(self):
-        # Ensure the client is connected before fetching services
-        if not self.client or not await self.client.is_connected():
+    # Subscribes to heart rate notifications, returns True on success
+    async def subscribe_heart_rate(self):
+        if not self.client or not self.client.is_connected:
             print("Bluetooth client is not connected.")
-            return None
-
-        services = await self.client.get_services()
-        for service in services:
-            if service.uuid.lower() == self.HEART_RATE_SERVICE_UUID.lower():
-                for char in service.characteristics:
-                    if char.uuid.lower() == self.HEART_RATE_CHAR_UUID.lower():
-                        return char.uuid
-        
-        print("ERROR: No characteristic UUID found.\nDoes the device support Heart Rate Measurement?")
-        return None
+            return False
+
+        characteristic_uuid = await subscribe_heart_rate_notifications(
+            self.client,
+            self.selected_device_address,
+            self.device_cache,
+            self.parent_instance.heart_rate_handler,
+        )
+        if characteristic_uuid is None:
+            print("BPM Char UUID not found.\nPerhaps device does not support BPM?")
+            return False
+
+        self.selected_device_characteristic_uuid = characteristic_uuid
+        return True
+
+
+    # Builds a new client for the connection supervisor
+    def create_client(self, disconnected_callback):
+        return self.transport.create_client(
+            self.selected_device_address,
+            disconnected_callback=disconnected_callback,
+            **self.get_connection_parameters(),
+        )
+
+
+    # Called by the connection supervisor after every successful (re)connect
+    async def on_bluetooth_connected(self, client):
+        if self.connection_supervisor is not None and self.connection_supervisor.connect_count > 1:
+            self.reconnect_count += 1
+        self.client = client
+        self.is_bluetooth_device_connected = True
+        self.device_cache.remember(
+            self.selected_device_address,
+            name=self.selected_device_name,
+            connection_parameters={"timeout": self.get_connection_parameters()["timeout"]},
+        )
+        self.update_bluetooth_text(self.selected_device_name)
+        self.parent_instance.run_on_ui(self.parent_instance.bluetooth_devices_button.config, text="Disconnect")
+
+        # Notifications do not survive a reconnect, restore them if the monitor was running
+        if self.is_heart_rate_monitor_running:
+            if not await self.subscribe_heart_rate():
+                self.stop_heart_rate_monitor()
+                return
+            events.info("reconnected", device=self.selected_device_address, name=self.selected_device_name)
+
+        # Beat actions were paused while the BPM could not be updated
+        self.parent_instance.pipeline.resume_actions()
+
+
+    # Called by the connection supervisor as soon as the device drops
+    # The session keeps running and the supervisor reconnects in the background,
+    # beat actions are paused meanwhile rather than fired on a BPM that no longer updates
+    def on_bluetooth_disconnected(self):
+        self.disconnect_count += 1
+        self.is_bluetooth_device_connected = False
+        self.parent_instance.pipeline.pause_actions()
+        self.update_bluetooth_text("Reconnecting...")
+
+
+    def register_metrics(self, metrics):
+        metrics.counter_callback("disconnects_total", "Unexpected Bluetooth disconnects", lambda: self.disconnect_count)
+        metrics.counter_callback("reconnects_total", "Successful Bluetooth reconnects", lambda: self.reconnect_count)
+        metrics.gauge("connected", "1 while the heart rate monitor is connected", lambda: int(self.is_bluetooth_device_connected))
+
+
+    def update_bluetooth_text(self, status):
+        self.parent_instance.run_on_ui(self.parent_instance.bluetooth_text.config, text=f"{self.parent_instance.bluetooth_device_verbiage}{status}")
+
+
+    # Keyword arguments for BleakClient, reusing what worked for a cached device
+    def get_connection_parameters(self):
+        return get_connection_parameters(self.device_cache, self.selected_device_address)
@@ -1,14 +1,16 @@
 import ui_design_variables as ui
 import tkinter as tk
 
-from asyncio import run_coroutine_threadsafe
-from bleak import BleakScanner
+from asyncio import run_coroutine_threadsafe, get_running_loop, sleep
 
 
 '''
 Used specifically to open a new window to list available Bluetooth devices
 Includes a Connect and Refresh button
 
+Scanning streams results: devices appear as soon as they advertise,
+are deduplicated by address, sorted by signal strength and can be filtered
+to those advertising the Heart Rate service.
 '''
 class BluetoothDeviceList:
 
@@ -17,15 +19,29 @@ class BluetoothDeviceList:
     bluetooth_controller = None
 
     is_bluetooth_window_open = False
+    is_scanning = False
+    is_refresh_pending = False
 
     scan_window = None
 
+    # Seconds a scan keeps listening for advertisements
+    SCAN_DURATION = 10
+
+    # Signal changes smaller than this (in dBm) do not redraw the list
+    RSSI_REFRESH_THRESHOLD = 5
+
 
     def __init__(self, parent_instance, bluetooth_loop, bluetooth_controller):
         self.parent_instance = parent_instance
         self.bluetooth_loop = bluetooth_loop
         self.bluetooth_controller = bluetooth_controller
 
+        # address -> (name, rssi, has_heart_rate_service)
+        self.discovered_devices = {}
+
+        # Addresses in the order they are shown in the listbox
+        self.listed_addresses = []
+
 
     # Opens a new window to list available Bluetooth devices
     def open_bluetooth_devices(self):
@@ -65,69 +81,140 @@ class BluetoothDeviceList:
         self.refresh_button.config(height=1, bg=ui.refresh_button_color, font=(ui.font, ui.xl_font))
         self.refresh_button.pack(side=tk.RIGHT, padx=10, pady=0)
 
+        #   Only list devices advertising the Heart Rate service
+        self.heart_rate_only_variable = tk.BooleanVar(self.scan_window, value=False)
+        self.heart_rate_only_checkbox = tk.Checkbutton(self.button_frame, text="Heart rate only", variable=self.heart_rate_only_variable, command=self.refresh_device_list)
+        self.heart_rate_only_checkbox.config(bg=ui.background_color, font=(ui.font, ui.lg_font))
+        self.heart_rate_only_checkbox.pack(side=tk.RIGHT, padx=10, pady=0)
+
         self.is_bluetooth_window_open = True
 
     
     # Called by the refresh button to list Bluetooth devices
+    # Devices are added to the list as their advertisements arrive, rather than after the whole scan
     async def list_bluetooth_devices(self):
+        # A scan is already streaming results, start the list over instead of scanning twice
+        if self.is_scanning:
+            self.discovered_devices.clear()
+            self.request_device_list_refresh()
+            return
+
+        self.is_scanning = True
+        self.discovered_devices.clear()
+
         try:
             # Clear the listbox
-            self.device_listbox.delete(0, tk.END)
+            self.parent_instance.run_on_ui(self.device_listbox.delete, 0, tk.END)
 
             # Add a scanning message
-            self.device_listbox.insert(tk.END, "Scanning for Bluetooth devices...")
-
-            # Discover Bluetooth devices
-            devices = await BleakScanner.discover()
-
-            # Iterate once to obtain the max name length
-            #  Required b/c the first name in the list might be the shortest (thus breaking formatting)
-            max_name_length = 10
-
-            for device in devices:
-                selected_device_name = device.name if device.name is not None else "Unknown Name"
-                max_name_length = max(max_name_length, len(selected_device_name) + 2)
+            self.parent_instance.run_on_ui(self.device_listbox.insert, tk.END, "Scanning for Bluetooth devices...")
+
+            # Discover Bluetooth devices, stopping early if the window is closed
+            # Bleak is imported lazily, the startup preloads it in the background
+            from bleak import BleakScanner
+            scanner = BleakScanner(detection_callback=self.on_device_detected)
+            await scanner.start()
+            try:
+                scan_ends_at = get_running_loop().time() + self.SCAN_DURATION
+                while self.is_bluetooth_window_open and get_running_loop().time() < scan_ends_at:
+                    await sleep(self.bluetooth_controller.LISTEN_FOR_CANCEL_SLEEP_TIME)
+            finally:
+                await scanner.stop()
 
-            # Iterate again to insert devices into the listbox
-            for device in devices:              
-                selected_device_name = device.name if device.name is not None else "Unknown Name"
-                self.device_listbox.insert(tk.END, f"{selected_device_name:<{max_name_length}} {device.address}")
-
-            # Delete the scanning message
-            self.device_listbox.delete(0)
             self.bluetooth_controller.is_bluetooth_device_list_error = False
 
+            # Redraw once the scan is over, the scanning message is replaced even when nothing shown was found
+            self.is_scanning = False
+            self.request_device_list_refresh()
+
         except Exception as e:
             # We expect this error if the window is closed before completing.
             error_message = "Error while listing bluetooth devices:"
             print(f"{error_message}\n{e}")
-            self.device_listbox.delete(0)
-            self.device_listbox.insert(tk.END, error_message)
-            self.device_listbox.insert(tk.END, e)
+            self.parent_instance.run_on_ui(self.device_listbox.delete, 0, tk.END)
+            self.parent_instance.run_on_ui(self.device_listbox.insert, tk.END, error_message)
+            self.parent_instance.run_on_ui(self.device_listbox.insert, tk.END, e)
             self.bluetooth_controller.is_bluetooth_device_list_error = True
+
+        finally:
+            self.is_scanning = False
+
+
+    # Called by the scanner for every advertisement received
+    def on_device_detected(self, device, advertisement_data):
+        name = device.name or advertisement_data.local_name or "Unknown Name"
+        rssi = advertisement_data.rssi
+        has_heart_rate_service = self.bluetooth_controller.HEART_RATE_SERVICE_UUID in advertisement_data.service_uuids
+
+        # Devices are deduplicated by address, only refresh the list when something visible changed
+        previous = self.discovered_devices.get(device.address)
+        self.discovered_devices[device.address] = (name, rssi, has_heart_rate_service)
+
+        if previous is None or previous[0] != name or abs(previous[1] - rssi) >= self.RSSI_REFRESH_THRESHOLD:
+            self.request_device_list_refresh()
+
+
+    # Schedules a single list redraw on the Tk thread, however many advertisements arrive meanwhile
+    def request_device_list_refresh(self):
+        if self.is_refresh_pending:
             return
+        self.is_refresh_pending = True
+        self.parent_instance.run_on_ui(self.refresh_device_list)
+
+
+    # Redraws the device list, strongest signal first
+    def refresh_device_list(self):
+        self.is_refresh_pending = False
+        if not self.is_bluetooth_window_open:
+            return
+
+        heart_rate_only = self.heart_rate_only_variable.get()
+        devices = sorted(
+            (
+                (address, name, rssi)
+                for address, (name, rssi, has_heart_rate_service) in list(self.discovered_devices.items())
+                if has_heart_rate_service or not heart_rate_only
+            ),
+            key=lambda device: device[2],
+            reverse=True,
+        )
+
+        self.device_listbox.delete(0, tk.END)
+        self.listed_addresses = [address for address, _, _ in devices]
+
+        if not devices:
+            self.device_listbox.insert(tk.END, "Scanning for Bluetooth devices..." if self.is_scanning else "No devices found.")
+            return
+
+        max_name_length = max(10, *(len(name) + 2 for _, name, _ in devices))
+        for address, name, rssi in devices:
+            self.device_listbox.insert(tk.END, f"{name:<{max_name_length}} {rssi:>4} dBm  {address}")
+
+        # Keep the selected device highlighted when the order changes
+        if self.bluetooth_controller.selected_device_address in self.listed_addresses:
+            self.device_listbox.selection_set(self.listed_addresses.index(self.bluetooth_controller.selected_device_address))
     
 
     # Calls the appropriate controller function to connect to the selected device
     async def connect_to_device(self):
         # Check bluetooth is enabled on the device
         if self.bluetooth_controller.is_bluetooth_device_list_error:
-            self.device_listbox.delete(0, tk.END)
-            self.device_listbox.insert(tk.END, "Error connecting to device...")
-            self.bluetooth_window_close()
+            self.parent_instance.run_on_ui(self.device_listbox.delete, 0, tk.END)
+            self.parent_instance.run_on_ui(self.device_listbox.insert, tk.END, "Error connecting to device...")
+            self.parent_instance.run_on_ui(self.bluetooth_window_close)
         else:
-            self.device_listbox.delete(0, tk.END)
-            self.device_listbox.insert(tk.END, "Attempting to connect...")
+            self.parent_instance.run_on_ui(self.device_listbox.delete, 0, tk.END)
+            self.parent_instance.run_on_ui(self.device_listbox.insert, tk.END, "Attempting to connect...")
             await self.bluetooth_controller.connect_bluetooth()
-            self.bluetooth_window_close()
+            self.parent_instance.run_on_ui(self.bluetooth_window_close)
         
 
     # Called when a device is selected from the Bluetooth devices listbox
     def on_device_select(self, event):
         selected_index = self.device_listbox.curselection()
-        if selected_index:
-            device_info = self.device_listbox.get(selected_index)
-            device_name, device_address = device_info.rsplit(" ", 1)
+        if selected_index and selected_index[0] < len(self.listed_addresses):
+            device_address = self.listed_addresses[selected_index[0]]
+            device_name, _, _ = self.discovered_devices.get(device_address, ("Unknown Name", 0, False))
             self.bluetooth_controller.selected_device_name = device_name
             self.bluetooth_controller.selected_device_address = device_address
 
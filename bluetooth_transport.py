@@ -0,0 +1,19 @@
+'''
+Transport used by BluetoothController to create its clients
+
+A transport only has to build client objects exposing the small part of the
+BleakClient interface the controller relies on: connect(), disconnect(), is_connected,
+services, start_notify() and stop_notify().
+This one talks to real hardware through Bleak, see simulated_peripheral.SimulatedTransport
+for a stand-in that needs no Bluetooth adapter.
+Bleak is imported on first use, so the window does not wait for it.
+'''
+class BleakTransport:
+
+    # Whether devices reached through this transport should be written to the device cache
+    is_persistent = True
+
+
+    def create_client(self, address, disconnected_callback=None, **connection_parameters):
+        from bleak import BleakClient
+        return BleakClient(address, disconnected_callback=disconnected_callback, **connection_parameters)
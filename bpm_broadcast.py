@@ -0,0 +1,405 @@
+from struct import Struct
+from time import monotonic, time, sleep
+from os import getpid, kill
+import sys
+
+
+'''
+Local broadcast of the BPM stream through shared memory
+
+The pipeline writes every filtered reading, its RR intervals and every beat's timing
+into a fixed ring of records in a named shared memory block. Any number of local
+processes (overlays, loggers) attach with BPMReader and read it without a Bluetooth
+connection of their own and without going through the app's Tk thread.
+
+Every slot is guarded by a seqlock: the writer makes the slot's sequence odd, writes the
+record in place and makes it even again; a reader copies the record and retries when
+the sequence was odd or changed meanwhile. The writer never waits for readers, and a
+reader that falls more than a ring behind skips ahead and counts what it missed.
+
+Timestamps are time.monotonic() seconds of the writing process, which every process on
+the machine shares; the header also holds the offset to wall-clock time.
+
+The first running instance writes DEFAULT_NAME, later ones "<name>_<pid>"; a block is only
+taken over once the writer pid in its header is no longer running.
+
+Layout, little-endian:
+    header  magic, version, record size, capacity, write count, writer pid, wall offset
+    ring    `capacity` records of RECORD_STRUCT, record n lives in slot n % capacity
+'''
+
+DEFAULT_NAME = "i_heart_clicking_bpm"
+DEFAULT_CAPACITY = 256
+
+MAGIC = b"IHCB"
+VERSION = 1
+
+# Record kinds
+SAMPLE_RECORD = 1     # A BPM reading: timestamp, bpm, raw_bpm, flags, rr_intervals
+BEAT_RECORD = 2       # A beat was scheduled: timestamp is its start, with seconds_per_beat and r_peak_at
+
+# RR intervals stored per sample record, straps send at most a handful per notification
+MAX_RR_INTERVALS = 4
+
+# RR intervals are stored like the strap sends them, in 1/1024 s
+RR_INTERVAL_UNITS_PER_SECOND = 1024
+
+# Windows process access right and exit code used to tell whether a block's writer still runs
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+STILL_ACTIVE = 259
+
+# magic, version, record size, capacity, write count, writer pid, wall clock offset, padded to 64 bytes
+HEADER_STRUCT = Struct("<4sHHIQQd28x")
+WRITE_COUNT_STRUCT = Struct("<Q")
+WRITE_COUNT_OFFSET = 12
+
+# sequence, kind, rr count, flags, bpm, raw bpm, rr intervals, timestamp, seconds per beat, r peak, padded to 64 bytes
+RECORD_STRUCT = Struct(f"<QBBHfH2x{MAX_RR_INTERVALS}Hddd12x")
+SEQUENCE_STRUCT = Struct("<Q")
+
+
+class BroadcastRecord:
+
+    __slots__ = ("index", "kind", "timestamp", "bpm", "raw_bpm", "flags", "rr_intervals", "seconds_per_beat", "r_peak_at")
+
+
+    def __init__(self, index, kind, timestamp, bpm, raw_bpm, flags, rr_intervals, seconds_per_beat, r_peak_at):
+        self.index = index
+        self.kind = kind
+        self.timestamp = timestamp
+        self.bpm = bpm
+        self.raw_bpm = raw_bpm
+        self.flags = flags
+        self.rr_intervals = rr_intervals
+        self.seconds_per_beat = seconds_per_beat
+        self.r_peak_at = r_peak_at
+
+
+    @property
+    def is_beat(self):
+        return self.kind == BEAT_RECORD
+
+
+    def __repr__(self):
+        if self.is_beat:
+            return f"BroadcastRecord(#{self.index} beat at {self.timestamp:.3f}, {self.seconds_per_beat:.3f} s, r peak at {self.r_peak_at:.3f})"
+        return f"BroadcastRecord(#{self.index} bpm={self.bpm:.1f}, raw={self.raw_bpm}, flags={self.flags:#04x}, rr={self.rr_intervals})"
+
+
+'''
+Writes the ring, owned by the app
+
+Publishing is a few struct.pack_into calls straight into the shared block,
+cheap enough to run on the Bluetooth loop right after the reading is filtered.
+'''
+class BPMBroadcaster:
+
+    name = DEFAULT_NAME
+    capacity = DEFAULT_CAPACITY
+    clock = None
+
+    shared_memory = None
+    write_count = 0
+
+
+    def __init__(self, name=None, capacity=None, clock=monotonic):
+        self.name = name or self.name
+        self.capacity = capacity or self.capacity
+        self.clock = clock
+
+
+    @property
+    def is_open(self):
+        return self.shared_memory is not None
+
+
+    # Creates the shared block, taking over one left behind by a crashed run
+    # While another instance is still writing DEFAULT_NAME, this one broadcasts on "<name>_<pid>" instead
+    def open(self):
+        from multiprocessing.shared_memory import SharedMemory
+
+        size = HEADER_STRUCT.size + self.capacity * RECORD_STRUCT.size
+        for name in (self.name, f"{self.name}_{getpid()}"):
+            try:
+                self.shared_memory = SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                writer_pid = _writer_pid(name)
+                if writer_pid is not None and _is_process_alive(writer_pid):
+                    print(f"Shared memory {name!r} is in use by process {writer_pid}")
+                    continue
+
+                # Tracked like a block we created, so it is still removed when this process exits
+                self.shared_memory = SharedMemory(name)
+                if self.shared_memory.size < size:
+                    self.shared_memory.close()
+                    self.shared_memory = None
+                    raise RuntimeError(f"Shared memory {name!r} was left behind by another version and is too small")
+            self.name = name
+            break
+        else:
+            raise RuntimeError(f"No free shared memory block to broadcast on, tried {self.name!r} and {name!r}")
+
+        self.write_count = 0
+        HEADER_STRUCT.pack_into(
+            self.shared_memory.buf, 0,
+            MAGIC, VERSION, RECORD_STRUCT.size, self.capacity, 0, getpid(), time() - monotonic(),
+        )
+        print(f"Broadcasting BPM on shared memory {self.name!r}")
+
+
+    def close(self):
+        if self.shared_memory is None:
+            return
+        shared_memory, self.shared_memory = self.shared_memory, None
+        shared_memory.close()
+        try:
+            shared_memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+    # A filtered reading, rr_intervals in seconds
+    def publish_sample(self, filtered, rr_intervals=(), timestamp=None):
+        rr_units = [int(round(rr * RR_INTERVAL_UNITS_PER_SECOND)) & 0xFFFF for rr in rr_intervals[-MAX_RR_INTERVALS:]]
+        rr_count = len(rr_units)
+        rr_units.extend([0] * (MAX_RR_INTERVALS - rr_count))
+
+        self.write(
+            SAMPLE_RECORD, rr_count, filtered.flags, filtered.bpm, min(0xFFFF, max(0, int(filtered.raw))),
+            *rr_units, self.clock() if timestamp is None else timestamp, 0.0, 0.0,
+        )
+
+
+    # A beat's timing, as soon as the pipeline scheduled it
+    def publish_beat(self, beat_start_time, seconds_per_beat, r_peak_at):
+        self.write(BEAT_RECORD, 0, 0, 60 / seconds_per_beat, 0, *([0] * MAX_RR_INTERVALS), beat_start_time, seconds_per_beat, r_peak_at)
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def write(self, kind, *fields):
+        if self.shared_memory is None:
+            return
+
+        buffer = self.shared_memory.buf
+        index = self.write_count
+        offset = HEADER_STRUCT.size + (index % self.capacity) * RECORD_STRUCT.size
+
+        # Odd while the slot is being written, the record's even sequence is stored last
+        sequence = 2 * index + 2
+        SEQUENCE_STRUCT.pack_into(buffer, offset, sequence - 1)
+        RECORD_STRUCT.pack_into(buffer, offset, sequence - 1, kind, *fields)
+        SEQUENCE_STRUCT.pack_into(buffer, offset, sequence)
+
+        self.write_count = index + 1
+        WRITE_COUNT_STRUCT.pack_into(buffer, WRITE_COUNT_OFFSET, self.write_count)
+
+
+'''
+Reads the ring from any local process
+
+    reader = BPMReader()
+    while True:
+        for record in reader.read_new():
+            print(record)
+        time.sleep(0.001)
+
+read_new() returns every record published since the previous call, latest() only the newest.
+Reading never blocks the writer; records overwritten before they were read are counted in missed_count.
+'''
+class BPMReader:
+
+    # Retries of a slot the writer is in the middle of, before giving up on it
+    MAX_READ_RETRIES = 100
+
+    name = DEFAULT_NAME
+    shared_memory = None
+    capacity = 0
+    writer_pid = None
+    wall_clock_offset = 0.0
+
+    # Index of the next record to read
+    next_index = 0
+
+    # Counters
+    missed_count = 0
+    retry_count = 0
+
+
+    def __init__(self, name=None, from_start=False):
+        self.name = name or self.name
+        self.shared_memory = _attach(self.name)
+
+        magic, version, record_size, self.capacity, write_count, self.writer_pid, self.wall_clock_offset = HEADER_STRUCT.unpack_from(self.shared_memory.buf, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_STRUCT.size:
+            self.close()
+            raise ValueError(f"Shared memory {self.name!r} is not a version {VERSION} BPM broadcast")
+
+        # Start from the oldest record still in the ring, or from now on
+        self.next_index = max(0, write_count - self.capacity) if from_start else write_count
+
+
+    # Number of records published so far
+    @property
+    def write_count(self):
+        return WRITE_COUNT_STRUCT.unpack_from(self.shared_memory.buf, WRITE_COUNT_OFFSET)[0]
+
+
+    # Every record published since the previous call, oldest first
+    def read_new(self):
+        write_count = self.write_count
+        if write_count - self.next_index > self.capacity:
+            self.missed_count += write_count - self.capacity - self.next_index
+            self.next_index = write_count - self.capacity
+
+        records = []
+        while self.next_index < write_count:
+            record = self.read(self.next_index)
+            if record is None:
+                # Overwritten while we read it, the ring lapped us
+                self.missed_count += 1
+            else:
+                records.append(record)
+            self.next_index += 1
+        return records
+
+
+    # The newest record of `kind`, or of any kind, None when there is none
+    def latest(self, kind=None):
+        write_count = self.write_count
+        for index in range(write_count - 1, max(-1, write_count - 1 - self.capacity), -1):
+            record = self.read(index)
+            if record is not None and (kind is None or record.kind == kind):
+                return record
+        return None
+
+
+    # Polls until a record arrives, returns the new records or [] after `timeout` seconds
+    def wait_for_new(self, timeout=None, poll_interval=0.0005):
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            records = self.read_new()
+            if records or (deadline is not None and monotonic() >= deadline):
+                return records
+            sleep(poll_interval)
+
+
+    def to_wall_clock(self, timestamp):
+        return timestamp + self.wall_clock_offset
+
+
+    def close(self):
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+            self.shared_memory = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # Copies record `index` out of its slot, None once the slot holds a newer record
+    def read(self, index):
+        buffer = self.shared_memory.buf
+        offset = HEADER_STRUCT.size + (index % self.capacity) * RECORD_STRUCT.size
+        expected_sequence = 2 * index + 2
+
+        for _ in range(self.MAX_READ_RETRIES):
+            sequence = SEQUENCE_STRUCT.unpack_from(buffer, offset)[0]
+            if sequence > expected_sequence:
+                return None
+
+            fields = RECORD_STRUCT.unpack_from(buffer, offset)
+            if sequence == expected_sequence and SEQUENCE_STRUCT.unpack_from(buffer, offset)[0] == sequence:
+                _, kind, rr_count, flags, bpm, raw_bpm, *rest = fields
+                rr_intervals = tuple(rr / RR_INTERVAL_UNITS_PER_SECOND for rr in rest[:rr_count])
+                timestamp, seconds_per_beat, r_peak_at = rest[MAX_RR_INTERVALS:]
+                return BroadcastRecord(index, kind, timestamp, bpm, raw_bpm, flags, rr_intervals, seconds_per_beat, r_peak_at)
+            self.retry_count += 1
+        return None
+
+
+# Attaches to an existing block without letting this process's resource tracker delete it on exit
+def _attach(name):
+    from multiprocessing.shared_memory import SharedMemory
+
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name, track=False)
+
+    shared_memory = SharedMemory(name)
+    if sys.platform != "win32":
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shared_memory._name, "shared_memory")
+    return shared_memory
+
+
+# The pid stored by the block's writer, None when the block is not a BPM broadcast
+def _writer_pid(name):
+    try:
+        shared_memory = _attach(name)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        if shared_memory.size < HEADER_STRUCT.size:
+            return None
+        magic, version, _, _, _, writer_pid, _ = HEADER_STRUCT.unpack_from(shared_memory.buf, 0)
+        return writer_pid if magic == MAGIC and version == VERSION else None
+    finally:
+        shared_memory.close()
+
+
+def _is_process_alive(pid):
+    if pid <= 0:
+        return False
+
+    # os.kill() terminates the process on Windows, ask for its exit code instead
+    if sys.platform == "win32":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))) and exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        return True
+    except OSError:
+        return False
+    return True
+
+
+# Prints the stream, e.g. python -m bpm_broadcast
+if __name__ == "__main__":
+    with BPMReader(sys.argv[1] if len(sys.argv) > 1 else None) as reader:
+        print(f"Reading {reader.name!r} from pid {reader.writer_pid}")
+        try:
+            while True:
+                for record in reader.wait_for_new():
+                    print(record)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,242 @@
+from bisect import insort, bisect_left
+from collections import deque
+
+
+'''
+Streaming conditioning of raw BPM readings
+
+Every reading goes through three steps, each a constant amount of work per sample:
+
+    range check   values a heart cannot produce (0, 255, ...) are rejected outright
+    Hampel        a reading further than `threshold` scaled MADs from the median of the
+                  last `window` readings is an outlier and replaced by that median
+    smoother      EMA or a scalar Kalman filter, or none
+
+The Hampel window holds raw in-range readings, outliers included, so a genuine step
+in the heart rate is accepted once it makes up half of the window.
+Each output carries flags saying how far it can be trusted.
+'''
+
+# Flags of a FilteredBPM, 0 means a confident reading
+FLAG_OUT_OF_RANGE = 0x01    # The raw reading was impossible and ignored
+FLAG_OUTLIER = 0x02         # The raw reading was an outlier and replaced by the median
+FLAG_NO_CONTACT = 0x04      # The strap reported no skin contact
+FLAG_WARMING_UP = 0x08      # The Hampel window is not full yet
+FLAG_HELD = 0x10            # No usable reading, the previous estimate is repeated
+
+# Flags meaning the reading should not steer the beat schedule
+# A window that is not full yet cannot reject outliers, so warming-up readings are not trusted either
+UNTRUSTED_FLAGS = FLAG_OUT_OF_RANGE | FLAG_OUTLIER | FLAG_NO_CONTACT | FLAG_WARMING_UP | FLAG_HELD
+
+MIN_VALID_BPM = 25
+MAX_VALID_BPM = 240
+
+# Scales the median absolute deviation to a standard deviation for normal noise
+MAD_SCALE = 1.4826
+
+
+class FilteredBPM:
+
+    __slots__ = ("raw", "bpm", "flags")
+
+
+    def __init__(self, raw, bpm, flags):
+        self.raw = raw
+        self.bpm = bpm
+        self.flags = flags
+
+
+    # False until a first usable reading arrived
+    @property
+    def has_estimate(self):
+        return self.bpm > 0
+
+
+    @property
+    def is_confident(self):
+        return self.has_estimate and not self.flags & UNTRUSTED_FLAGS
+
+
+    def __repr__(self):
+        return f"FilteredBPM(raw={self.raw}, bpm={self.bpm:.1f}, flags={self.flags:#04x})"
+
+
+# Exponential moving average, `alpha` is the weight of the newest value
+class EMASmoother:
+
+    value = None
+
+
+    def __init__(self, alpha=0.3):
+        if not 0 < alpha <= 1:
+            raise ValueError("EMA alpha must be in (0, 1]")
+        self.alpha = alpha
+
+
+    def update(self, measurement):
+        if self.value is None:
+            self.value = float(measurement)
+        else:
+            self.value += self.alpha * (measurement - self.value)
+        return self.value
+
+
+    def reset(self):
+        self.value = None
+
+
+'''
+Scalar Kalman filter for a slowly drifting heart rate
+
+`process_variance` is how much the true BPM may move between readings,
+`measurement_variance` how noisy the strap is; their ratio sets the smoothing.
+'''
+class KalmanSmoother:
+
+    value = None
+    variance = 0.0
+
+
+    def __init__(self, process_variance=1.0, measurement_variance=9.0):
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+
+
+    def update(self, measurement):
+        if self.value is None:
+            self.value = float(measurement)
+            self.variance = self.measurement_variance
+            return self.value
+
+        predicted_variance = self.variance + self.process_variance
+        gain = predicted_variance / (predicted_variance + self.measurement_variance)
+        self.value += gain * (measurement - self.value)
+        self.variance = (1 - gain) * predicted_variance
+        return self.value
+
+
+    def reset(self):
+        self.value = None
+        self.variance = 0.0
+
+
+class NullSmoother:
+
+    def update(self, measurement):
+        return float(measurement)
+
+
+    def reset(self):
+        pass
+
+
+SMOOTHERS = {
+    "ema": EMASmoother,
+    "kalman": KalmanSmoother,
+    None: NullSmoother,
+}
+
+
+class BPMFilter:
+
+    # Hampel window, odd so the median is a reading
+    WINDOW = 7
+
+    # Outlier distance in scaled MADs, and the smallest distance ever called an outlier
+    THRESHOLD = 3.0
+    MIN_DEVIATION = 8
+
+    window = WINDOW
+    threshold = THRESHOLD
+    min_deviation = MIN_DEVIATION
+
+    last_output = None
+
+    # Counters
+    sample_count = 0
+    out_of_range_count = 0
+    outlier_count = 0
+
+
+    # smoother is "ema", "kalman" or None, smoother_options are passed to its constructor
+    def __init__(self, window=None, threshold=None, min_deviation=None, smoother="ema", **smoother_options):
+        if smoother not in SMOOTHERS:
+            raise ValueError(f"Unknown BPM smoother {smoother!r}, expected one of {', '.join(map(repr, SMOOTHERS))}")
+
+        self.window = window or self.window
+        self.threshold = threshold or self.threshold
+        self.min_deviation = self.min_deviation if min_deviation is None else min_deviation
+        self.smoother = SMOOTHERS[smoother](**smoother_options)
+
+        # The window in arrival order, and the same values kept sorted for the median
+        self.recent = deque()
+        self.sorted_recent = []
+
+
+    def update(self, raw_bpm, sensor_contact=None):
+        self.sample_count += 1
+        flags = FLAG_NO_CONTACT if sensor_contact is False else 0
+
+        if not MIN_VALID_BPM <= raw_bpm <= MAX_VALID_BPM:
+            self.out_of_range_count += 1
+            return self.hold(raw_bpm, flags | FLAG_OUT_OF_RANGE)
+
+        self.push(raw_bpm)
+        if len(self.recent) < self.window:
+            flags |= FLAG_WARMING_UP
+
+        # Hampel test against the window, which now includes this reading
+        median = self.median()
+        deviation = MAD_SCALE * self.median_absolute_deviation(median)
+        value = raw_bpm
+        if abs(raw_bpm - median) > max(self.threshold * deviation, self.min_deviation):
+            self.outlier_count += 1
+            flags |= FLAG_OUTLIER
+            value = median
+
+        self.last_output = FilteredBPM(raw_bpm, self.smoother.update(value), flags)
+        return self.last_output
+
+
+    def reset(self):
+        self.recent.clear()
+        self.sorted_recent = []
+        self.smoother.reset()
+        self.last_output = None
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # Repeats the previous estimate, or 0 when there is none yet
+    def hold(self, raw_bpm, flags):
+        previous_bpm = self.last_output.bpm if self.last_output is not None else 0.0
+        return FilteredBPM(raw_bpm, previous_bpm, flags | FLAG_HELD)
+
+
+    def push(self, value):
+        if len(self.recent) == self.window:
+            oldest = self.recent.popleft()
+            del self.sorted_recent[bisect_left(self.sorted_recent, oldest)]
+        self.recent.append(value)
+        insort(self.sorted_recent, value)
+
+
+    def median(self):
+        ordered = self.sorted_recent
+        middle = len(ordered) // 2
+        if len(ordered) % 2:
+            return ordered[middle]
+        return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+    def median_absolute_deviation(self, median):
+        deviations = sorted(abs(value - median) for value in self.sorted_recent)
+        middle = len(deviations) // 2
+        if len(deviations) % 2:
+            return deviations[middle]
+        return (deviations[middle - 1] + deviations[middle]) / 2
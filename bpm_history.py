@@ -0,0 +1,204 @@
+from collections import deque
+from time import monotonic
+from array import array
+from math import sqrt
+
+
+'''
+Rolling mean, min and max over the last `window` values
+
+Values are kept in a fixed-size ring with a running sum for the mean,
+and monotonic deques for min and max, so every push and query is O(1) (amortized for min/max).
+'''
+class RollingStatistics:
+
+    window = 0
+    count = 0
+    total = 0
+
+    # Sequence number of the next pushed value
+    sequence = 0
+
+
+    def __init__(self, window, typecode="d"):
+        if window <= 0:
+            raise ValueError("RollingStatistics window must be positive")
+
+        self.window = window
+        self.values = array(typecode, [0] * window)
+
+        # (sequence, value) pairs, increasing for min and decreasing for max
+        self.min_candidates = deque()
+        self.max_candidates = deque()
+
+
+    def push(self, value):
+        slot = self.sequence % self.window
+        if self.count == self.window:
+            self.total -= self.values[slot]
+        else:
+            self.count += 1
+
+        self.values[slot] = value
+        self.total += value
+
+        # Drop candidates that left the window, then those beaten by the new value
+        oldest_sequence = self.sequence - self.window
+        min_candidates = self.min_candidates
+        max_candidates = self.max_candidates
+
+        while min_candidates and min_candidates[0][0] <= oldest_sequence:
+            min_candidates.popleft()
+        while min_candidates and min_candidates[-1][1] >= value:
+            min_candidates.pop()
+        min_candidates.append((self.sequence, value))
+
+        while max_candidates and max_candidates[0][0] <= oldest_sequence:
+            max_candidates.popleft()
+        while max_candidates and max_candidates[-1][1] <= value:
+            max_candidates.pop()
+        max_candidates.append((self.sequence, value))
+
+        self.sequence += 1
+
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+    @property
+    def min(self):
+        return self.min_candidates[0][1] if self.min_candidates else 0
+
+
+    @property
+    def max(self):
+        return self.max_candidates[0][1] if self.max_candidates else 0
+
+
+    def clear(self):
+        self.count = 0
+        self.total = 0
+        self.sequence = 0
+        self.min_candidates.clear()
+        self.max_candidates.clear()
+
+
+'''
+Per-session BPM and RR interval history
+
+Samples are stored with their monotonic timestamps in fixed-capacity array ring buffers,
+so memory stays bounded however long the session runs.
+Rolling mean, min, max and HRV (RMSSD) are maintained incrementally for each configured
+window, measured in samples, so reading them never scans the history.
+'''
+class BPMHistory:
+
+    # Roughly 12 hours of one-per-second BPM readings
+    DEFAULT_CAPACITY = 43200
+
+    # Window sizes, in samples, for the rolling statistics
+    DEFAULT_BPM_WINDOWS = (10, 60, 300)
+    DEFAULT_RR_WINDOWS = (30, 120)
+
+    capacity = 0
+    size = 0
+    head = 0
+
+    last_rr = None
+
+
+    def __init__(self, capacity=None, bpm_windows=None, rr_windows=None):
+        self.capacity = capacity or self.DEFAULT_CAPACITY
+        self.timestamps = array("d", bytes(8 * self.capacity))
+        self.bpm_values = array("H", bytes(2 * self.capacity))
+
+        self.bpm_statistics = {window: RollingStatistics(window) for window in (bpm_windows or self.DEFAULT_BPM_WINDOWS)}
+
+        # Squared successive RR differences, in ms², whose rolling mean gives RMSSD
+        self.rr_statistics = {window: RollingStatistics(window) for window in (rr_windows or self.DEFAULT_RR_WINDOWS)}
+
+
+    def __len__(self):
+        return self.size
+
+
+    # Records a BPM reading
+    def append(self, bpm, timestamp=None):
+        self.timestamps[self.head] = monotonic() if timestamp is None else timestamp
+        self.bpm_values[self.head] = bpm
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+        for statistics in self.bpm_statistics.values():
+            statistics.push(bpm)
+
+
+    # Records RR intervals, in seconds
+    def append_rr_intervals(self, rr_intervals):
+        for rr in rr_intervals:
+            rr_ms = rr * 1000
+            if self.last_rr is not None:
+                squared_difference = (rr_ms - self.last_rr) ** 2
+                for statistics in self.rr_statistics.values():
+                    statistics.push(squared_difference)
+            self.last_rr = rr_ms
+
+
+    # Returns the latest BPM reading or None when empty
+    def latest(self):
+        if self.size == 0:
+            return None
+        return self.bpm_values[(self.head - 1) % self.capacity]
+
+
+    # Returns the i-th stored (timestamp, bpm) sample, 0 being the oldest
+    def get(self, i):
+        if not 0 <= i < self.size:
+            raise IndexError("BPMHistory index out of range")
+        idx = (self.head - self.size + i) % self.capacity
+        return self.timestamps[idx], self.bpm_values[idx]
+
+
+    def mean(self, window=None):
+        return self._bpm_window(window).mean
+
+
+    def min(self, window=None):
+        return self._bpm_window(window).min
+
+
+    def max(self, window=None):
+        return self._bpm_window(window).max
+
+
+    # Root mean square of successive RR differences in ms, a standard short-term HRV measure
+    # The running sum can end a hair below zero once large differences leave the window
+    def rmssd(self, window=None):
+        return sqrt(max(0.0, self._rr_window(window).mean))
+
+
+    def clear(self):
+        self.size = 0
+        self.head = 0
+        self.last_rr = None
+        for statistics in (*self.bpm_statistics.values(), *self.rr_statistics.values()):
+            statistics.clear()
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # The smallest configured window is used by default
+    def _bpm_window(self, window):
+        return self.bpm_statistics[window or min(self.bpm_statistics)]
+
+
+    def _rr_window(self, window):
+        return self.rr_statistics[window or min(self.rr_statistics)]
@@ -0,0 +1,201 @@
+from asyncio import Event, create_task, wait_for, get_running_loop, TimeoutError as AsyncTimeoutError
+import random
+from event_log import events
+
+
+'''
+Connection supervisor for a single Bluetooth device
+
+A small state machine that owns the client's lifetime:
+
+    CONNECTING -> CONNECTED -> (disconnect callback) -> BACKOFF -> CONNECTING ...
+                      \\-> STOPPED when stop() is called or the initial attempts run out
+
+Disconnects are handled the moment the client's disconnected callback fires,
+instead of being noticed on the next keep-alive poll. Reconnects back off
+exponentially with jitter so a flapping strap is not hammered, and the
+on_connected callback runs after every (re)connect to restore notifications.
+
+client_factory(disconnected_callback) must return a new, unconnected client.
+on_connected(client) is awaited after each successful connect.
+on_disconnected() and on_state_change(state) are plain callbacks.
+`clock` defaults to the event loop's time() and `rng` to the random module; tests
+pass their own to replay a session deterministically.
+'''
+class ConnectionSupervisor:
+
+    IDLE = "idle"
+    CONNECTING = "connecting"
+    CONNECTED = "connected"
+    BACKOFF = "backoff"
+    STOPPED = "stopped"
+
+    # Reconnect delays, in seconds
+    INITIAL_BACKOFF = 0.25
+    MAX_BACKOFF = 8.0
+    BACKOFF_MULTIPLIER = 2.0
+
+    # Each delay is randomised by up to this fraction either way
+    BACKOFF_JITTER = 0.5
+
+    state = IDLE
+    client = None
+    task = None
+
+    # Attempts made since the last successful connection
+    failed_attempts = 0
+
+    # Lifetime counters
+    connect_count = 0
+    disconnect_count = 0
+
+    has_connected = False
+
+    # Time spent disconnected after having been connected, and when the current outage began
+    downtime = 0.0
+    disconnected_at = None
+
+
+    def __init__(self, client_factory, on_connected=None, on_disconnected=None, on_state_change=None, max_initial_attempts=None,
+                 clock=None, rng=None):
+        self.client_factory = client_factory
+        self.on_connected = on_connected
+        self.on_disconnected = on_disconnected
+        self.on_state_change = on_state_change
+        self.clock = clock
+        self.rng = rng or random
+
+        # Give up if the very first connection fails this many times, None retries forever
+        self.max_initial_attempts = max_initial_attempts
+
+
+    # Starts supervising, must be called from the event loop the client runs on
+    def start(self):
+        if self.task is not None and not self.task.done():
+            return
+
+        self.loop = get_running_loop()
+        if self.clock is None:
+            self.clock = self.loop.time
+        self.disconnected_event = Event()
+        self.stop_event = Event()
+        self.settled_event = Event()
+        self.task = create_task(self._run())
+
+
+    # Stops reconnecting and disconnects the client
+    async def stop(self):
+        if self.task is None:
+            return
+
+        self.stop_event.set()
+        self.disconnected_event.set()
+        await self.task
+        self.task = None
+
+
+    # Waits until the first connection succeeded or the supervisor stopped, returns True when connected
+    async def wait_until_settled(self):
+        await self.settled_event.wait()
+        return self.state == self.CONNECTED
+
+
+    # Delay before the next reconnect attempt
+    def get_backoff_delay(self):
+        delay = min(self.MAX_BACKOFF, self.INITIAL_BACKOFF * self.BACKOFF_MULTIPLIER ** max(0, self.failed_attempts - 1))
+        return delay * self.rng.uniform(1 - self.BACKOFF_JITTER, 1 + self.BACKOFF_JITTER)
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    async def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                self._set_state(self.CONNECTING)
+                self.disconnected_event.clear()
+                self.client = self.client_factory(self._handle_disconnect)
+
+                try:
+                    await self.client.connect()
+                except Exception as e:
+                    self.failed_attempts += 1
+                    events.warning("connect_failed", attempt=self.failed_attempts, error=e)
+
+                    if not self.has_connected and self.max_initial_attempts is not None and self.failed_attempts >= self.max_initial_attempts:
+                        break
+
+                    await self._backoff()
+                    continue
+
+                self.failed_attempts = 0
+                self.connect_count += 1
+                self.has_connected = True
+                if self.disconnected_at is not None:
+                    self.downtime += self.clock() - self.disconnected_at
+                    self.disconnected_at = None
+                self._set_state(self.CONNECTED)
+                self.settled_event.set()
+
+                if self.on_connected is not None:
+                    try:
+                        await self.on_connected(self.client)
+                    except Exception as e:
+                        events.error("restore_connection_failed", error=e)
+
+                # Sleeps until the device drops or stop() is called, no polling
+                await self.disconnected_event.wait()
+
+                if self.stop_event.is_set():
+                    break
+
+                self.disconnect_count += 1
+                self.disconnected_at = self.clock()
+                events.warning("disconnected", reconnecting=True)
+                if self.on_disconnected is not None:
+                    self.on_disconnected()
+
+                # Reconnect straight away the first time, back off if that fails
+                self.failed_attempts = 0
+
+        finally:
+            await self._disconnect_client()
+            self._set_state(self.STOPPED)
+            self.settled_event.set()
+
+
+    async def _backoff(self):
+        self._set_state(self.BACKOFF)
+        try:
+            await wait_for(self.stop_event.wait(), timeout=self.get_backoff_delay())
+        except AsyncTimeoutError:
+            pass
+
+
+    # Bleak may call this from another thread, hand it to the supervisor's loop
+    def _handle_disconnect(self, client=None):
+        # Ignore late callbacks from a client that has already been replaced
+        if client is not None and client is not self.client:
+            return
+        self.loop.call_soon_threadsafe(self.disconnected_event.set)
+
+
+    async def _disconnect_client(self):
+        if self.client is None:
+            return
+        try:
+            await self.client.disconnect()
+        except Exception:
+            pass
+
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        if self.on_state_change is not None:
+            self.on_state_change(state)
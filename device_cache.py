@@ -0,0 +1,101 @@
+import json
+
+from os import path as os_path, makedirs, replace
+from time import time
+
+
+'''
+On-disk cache of known Bluetooth devices, keyed by device address
+
+For each device it remembers the last-known name, the handle and UUID of the
+heart rate characteristic and the connection parameters that worked, so the
+controller can reconnect at startup and go straight to the characteristic it used before.
+Entries are only hints: callers check them against the connected device and fall back to discovery.
+'''
+class DeviceCache:
+
+    CACHE_PATH = os_path.join(os_path.expanduser("~"), ".i_heart_clicking", "device_cache.json")
+
+    cache_path = None
+
+    # When False the cache only lives in memory
+    is_persistent = True
+
+
+    def __init__(self, cache_path=None, is_persistent=True):
+        self.cache_path = cache_path or self.CACHE_PATH
+        self.is_persistent = is_persistent
+        self.devices = {}
+        self.load()
+
+
+    def load(self):
+        if not self.is_persistent:
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                devices = json.load(cache_file)
+            self.devices = devices if isinstance(devices, dict) else {}
+        except (OSError, ValueError):
+            self.devices = {}
+
+
+    # Writes to a temporary file first so a crash never leaves a half-written cache
+    def save(self):
+        if not self.is_persistent:
+            return
+        try:
+            makedirs(os_path.dirname(self.cache_path), exist_ok=True)
+            temporary_path = f"{self.cache_path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as cache_file:
+                json.dump(self.devices, cache_file, indent=2)
+            replace(temporary_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not save the device cache:\n{e}")
+
+
+    # Returns the cached entry for an address, or None
+    def get(self, address):
+        if address is None:
+            return None
+        return self.devices.get(address.upper())
+
+
+    # Returns (address, entry) for the most recently connected device, or (None, None)
+    # Devices that were never the main connection, e.g. grid straps, are never returned
+    def most_recent(self):
+        connected = [address for address, entry in self.devices.items() if "last_connected" in entry]
+        if not connected:
+            return None, None
+        address = max(connected, key=lambda address: self.devices[address]["last_connected"])
+        return address, self.devices[address]
+
+
+    # Records what worked for a device, keeping previously cached fields not given here
+    # `is_connection` marks it as the device to auto-connect to at the next start
+    def remember(self, address, name=None, characteristic_handle=None, characteristic_uuid=None, connection_parameters=None,
+                 is_connection=True):
+        entry = self.devices.setdefault(address.upper(), {})
+        if is_connection:
+            entry["last_connected"] = time()
+
+        if name is not None:
+            entry["name"] = name
+        if characteristic_handle is not None:
+            entry["characteristic_handle"] = characteristic_handle
+        if characteristic_uuid is not None:
+            entry["characteristic_uuid"] = characteristic_uuid
+        if connection_parameters is not None:
+            entry["connection_parameters"] = connection_parameters
+
+        self.save()
+
+
+    # Forgets the cached characteristic of a device, forcing discovery on the next start
+    def invalidate_characteristic(self, address):
+        entry = self.get(address)
+        if entry is None:
+            return
+        entry.pop("characteristic_handle", None)
+        entry.pop("characteristic_uuid", None)
+        self.save()
@@ -0,0 +1,204 @@
+import ui_design_variables as ui
+import tkinter as tk
+
+from ekg_renderer import EKGRenderer
+from ekg_synth import synthesize_beat
+from time import monotonic
+
+
+'''
+A compact EKG pane for one device of the grid
+
+The pane keeps a beat phase instead of a beat loop of its own: every render tick
+advances it by the elapsed time over the device's current RR interval and extends
+the trace, so a pane costs one canvas call per tick and no task, thread or timer.
+'''
+class EKGPane:
+
+    session = None
+    renderer = None
+
+    # Fraction of the current beat drawn so far, and the beat it belongs to
+    phase = 0.0
+    waveform = None
+    is_flat = False
+
+    # Last shown label text, Tk is only called when it changes
+    bpm_text = None
+
+
+    def __init__(self, parent, session, coordinates_for):
+        self.session = session
+        self.coordinates_for = coordinates_for
+
+        self.frame = tk.Frame(parent, bg=ui.background_color)
+        self.name_label = tk.Label(self.frame, text=session.name, font=(ui.font, ui.md_font), bg=ui.background_color)
+        self.name_label.grid(row=0, column=0, sticky="w")
+        self.bpm_label = tk.Label(self.frame, font=(ui.font, ui.md_font), bg=ui.background_color)
+        self.bpm_label.grid(row=0, column=1, sticky="e")
+
+        self.canvas = tk.Canvas(
+            self.frame,
+            width=ui.device_pane_width,
+            height=ui.device_pane_height,
+            bg=ui.graph_background_color,
+            highlightthickness=0,
+        )
+        self.canvas.grid(row=1, column=0, columnspan=2)
+        self.renderer = EKGRenderer(self.canvas, line_width=2)
+        self.flatline()
+
+
+    # Advances the trace by `elapsed` seconds
+    def tick(self, elapsed):
+        session = self.session
+        self.show_labels()
+
+        if not session.is_connected or session.current_bpm == 0:
+            if not self.is_flat:
+                self.flatline()
+            return
+
+        if self.waveform is None:
+            self.begin_beat()
+        else:
+            self.phase += elapsed / self.waveform.rr_seconds
+            if self.phase >= 1.0:
+                self.phase %= 1.0
+                self.begin_beat()
+
+        self.renderer.draw_to(int(self.phase * len(self.waveform)) + 1)
+
+
+    def flatline(self):
+        self.renderer.flatline(ui.device_pane_height / 1.5, ui.device_pane_width)
+        self.waveform = None
+        self.phase = 0.0
+        self.is_flat = True
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # Picks up the latest BPM at the start of every beat, as the main window does
+    def begin_beat(self):
+        waveform = synthesize_beat(self.session.current_bpm, ui.device_pane_width)
+        if waveform is not self.waveform:
+            self.waveform = waveform
+            self.renderer.set_waveform(self.coordinates_for(waveform))
+        self.renderer.begin_beat()
+        self.is_flat = False
+
+
+    def show_labels(self):
+        session = self.session
+        if session.is_connected:
+            bpm_text = f"{session.current_bpm or '--'} BPM" + ("" if session.is_confident else "?")
+        else:
+            bpm_text = session.state.capitalize()
+
+        if bpm_text != self.bpm_text:
+            self.bpm_text = bpm_text
+            self.bpm_label.config(text=bpm_text)
+
+
+'''
+Grid of EKG panes, one per device of a MultiDeviceController
+
+A single root.after() tick renders every pane, so adding a device adds one pane
+update per frame rather than another beat loop. Panes are added and removed on
+the tick as the controller's sessions change.
+Canvas coordinates depend only on the BPM, every pane has the same size, so they
+are computed once per BPM and shared by all panes.
+'''
+class DeviceGridUI:
+
+    RENDER_INTERVAL_MS = 33
+
+    root = None
+    controller = None
+    columns = 2
+
+    tick_id = None
+    last_tick_at = None
+
+    # Counters
+    tick_count = 0
+
+
+    def __init__(self, root, controller, columns=None, clock=monotonic):
+        self.root = root
+        self.controller = controller
+        self.columns = columns or self.columns
+        self.clock = clock
+
+        self.frame = tk.Frame(root, bg=ui.background_color)
+
+        # Panes by session address
+        self.panes = {}
+
+        # Canvas coordinates by BPM, shared by every pane
+        self.coordinates = {}
+
+
+    def start(self):
+        if self.tick_id is None:
+            self.last_tick_at = self.clock()
+            self.tick_id = self.root.after(self.RENDER_INTERVAL_MS, self.tick)
+
+
+    def stop(self):
+        if self.tick_id is not None:
+            self.root.after_cancel(self.tick_id)
+            self.tick_id = None
+
+
+    def tick(self):
+        now = self.clock()
+        elapsed, self.last_tick_at = now - self.last_tick_at, now
+        self.tick_count += 1
+
+        self.sync_panes()
+        for pane in self.panes.values():
+            pane.tick(elapsed)
+
+        self.tick_id = self.root.after(self.RENDER_INTERVAL_MS, self.tick)
+
+
+    # Returns the (x, y) canvas coordinates of a synthesized beat
+    def coordinates_for(self, waveform):
+        coordinates = self.coordinates.get(waveform.bpm)
+        if coordinates is None or len(coordinates) != len(waveform):
+            x_scale = ui.device_pane_width / len(waveform)
+            y_scale = ui.device_pane_height * 1.25
+            y_offset = ui.device_pane_height / 1.5
+            coordinates = [(int(i * x_scale), y_offset - amplitude * y_scale) for i, amplitude in enumerate(waveform.samples)]
+            self.coordinates[waveform.bpm] = coordinates
+        return coordinates
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def sync_panes(self):
+        sessions = {session.address: session for session in self.controller}
+        if sessions.keys() == self.panes.keys():
+            return
+
+        for address in self.panes.keys() - sessions.keys():
+            self.panes.pop(address).frame.destroy()
+
+        for address, session in sessions.items():
+            if address not in self.panes:
+                self.panes[address] = EKGPane(self.frame, session, self.coordinates_for)
+
+        for i, pane in enumerate(self.panes.values()):
+            pane.frame.grid(row=i // self.columns, column=i % self.columns, padx=5, pady=5)
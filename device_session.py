@@ -0,0 +1,199 @@
+from asyncio import run_coroutine_threadsafe, gather
+from time import monotonic
+
+from bluetooth_controller import subscribe_heart_rate_notifications, get_connection_parameters
+from connection_supervisor import ConnectionSupervisor
+from bluetooth_transport import BleakTransport
+from device_cache import DeviceCache
+from heart_rate_parser import parse_heart_rate_measurement
+from bpm_filter import BPMFilter, FLAG_NO_CONTACT, FLAG_HELD
+from bpm_history import BPMHistory
+from event_log import events
+
+
+'''
+One heart rate strap monitored alongside others
+
+A session owns everything that is per device: its connection supervisor, BPM filter
+and history. Notifications only update plain attributes, nothing is pushed to the UI;
+the device grid reads them once per render tick, so a notification costs the same
+however many devices are connected.
+'''
+class DeviceSession:
+
+    # One hour of one-per-second readings, the full-size history is meant for the single-device window
+    HISTORY_CAPACITY = 3600
+    HISTORY_BPM_WINDOWS = (10, 60)
+    HISTORY_RR_WINDOWS = (30,)
+
+    address = None
+    name = None
+    transport = None
+    device_cache = None
+    connection_supervisor = None
+    characteristic_uuid = None
+
+    state = ConnectionSupervisor.IDLE
+    current_bpm = 0
+    is_confident = False
+    updated_at = None
+
+    # Counters
+    notification_count = 0
+    parse_error_count = 0
+
+
+    def __init__(self, address, name=None, transport=None, device_cache=None, clock=monotonic):
+        self.address = address
+        self.name = name or address
+        self.transport = transport or BleakTransport()
+        self.device_cache = device_cache or DeviceCache(is_persistent=self.transport.is_persistent)
+        self.clock = clock
+
+        self.bpm_filter = BPMFilter()
+        self.bpm_history = BPMHistory(self.HISTORY_CAPACITY, self.HISTORY_BPM_WINDOWS, self.HISTORY_RR_WINDOWS)
+
+
+    @property
+    def is_connected(self):
+        return self.state == ConnectionSupervisor.CONNECTED
+
+
+    # Starts connecting in the background, must run on the controller's loop
+    async def start(self):
+        if self.connection_supervisor is not None:
+            return
+
+        self.connection_supervisor = ConnectionSupervisor(
+            self.create_client,
+            on_connected=self.on_connected,
+            on_state_change=self.on_state_change,
+        )
+        self.connection_supervisor.start()
+
+
+    async def stop(self):
+        if self.connection_supervisor is None:
+            return
+
+        await self.connection_supervisor.stop()
+        self.connection_supervisor = None
+        self.current_bpm = 0
+        self.is_confident = False
+
+
+    # Decodes a raw 0x2A37 notification into this device's filter and history
+    def handle_notification(self, sender, data):
+        self.notification_count += 1
+        try:
+            measurement = parse_heart_rate_measurement(data)
+        except ValueError as e:
+            self.parse_error_count += 1
+            events.warning("parse_error", device=self.address, error=e, size=len(data))
+            return
+
+        filtered = self.bpm_filter.update(measurement.heart_rate, measurement.sensor_contact)
+
+        rr_intervals = measurement.rr_intervals_seconds
+        if rr_intervals and not filtered.flags & FLAG_NO_CONTACT:
+            self.bpm_history.append_rr_intervals(rr_intervals)
+
+        if filtered.has_estimate and not filtered.flags & FLAG_HELD:
+            self.current_bpm = int(round(filtered.bpm))
+            self.updated_at = self.clock()
+            self.bpm_history.append(self.current_bpm, self.updated_at)
+        self.is_confident = filtered.is_confident
+
+
+    def average_bpm(self, window=60):
+        return self.bpm_history.mean(window)
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def create_client(self, disconnected_callback):
+        return self.transport.create_client(
+            self.address,
+            disconnected_callback=disconnected_callback,
+            **get_connection_parameters(self.device_cache, self.address),
+        )
+
+
+    # Runs after every (re)connect, notifications do not survive a reconnect
+    async def on_connected(self, client):
+        # Cached for its name and handle only, a grid strap never becomes the device auto-connected at startup
+        self.device_cache.remember(self.address, name=self.name, is_connection=False)
+        self.characteristic_uuid = await subscribe_heart_rate_notifications(
+            client, self.address, self.device_cache, self.handle_notification,
+        )
+        if self.characteristic_uuid is None:
+            events.warning("no_heart_rate", device=self.address, name=self.name)
+
+
+    def on_state_change(self, state):
+        self.state = state
+        if state != ConnectionSupervisor.CONNECTED:
+            self.is_confident = False
+
+
+'''
+Monitors several straps at once on a single asyncio loop
+
+Every device gets its own DeviceSession; they share the loop, and with it the
+Bluetooth adapter, and one device cache, which should be the main controller's so
+both write the same entries to disk. add_device() and remove_device() may be called
+from any thread.
+'''
+class MultiDeviceController:
+
+    loop = None
+    transport = None
+
+
+    def __init__(self, loop, transport=None, device_cache=None):
+        self.loop = loop
+        self.transport = transport or BleakTransport()
+        self.device_cache = device_cache or DeviceCache(is_persistent=self.transport.is_persistent)
+
+        # Sessions by address, in the order they were added
+        self.sessions = {}
+
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+    def __iter__(self):
+        return iter(list(self.sessions.values()))
+
+
+    # Starts monitoring a device, `transport` overrides the controller's, e.g. one simulated strap per device
+    def add_device(self, address, name=None, transport=None):
+        if address in self.sessions:
+            return self.sessions[address]
+
+        if name is None:
+            name = (self.device_cache.get(address) or {}).get("name")
+
+        session = DeviceSession(address, name, transport or self.transport, self.device_cache)
+        self.sessions[address] = session
+        run_coroutine_threadsafe(session.start(), self.loop)
+        return session
+
+
+    def remove_device(self, address):
+        session = self.sessions.pop(address, None)
+        if session is not None:
+            run_coroutine_threadsafe(session.stop(), self.loop)
+        return session
+
+
+    async def stop_all(self):
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        await gather(*(session.stop() for session in sessions))
@@ -0,0 +1,105 @@
+import ui_design_variables as ui
+
+
+'''
+Draws an EKG trace onto a Tk canvas
+
+A single line item is owned per trace and is grown in place instead of being deleted
+and re-created for every point of the beat: once a beat has begun, only the new points
+are appended to it with Canvas.insert(), so a beat costs O(n) however often it is drawn.
+The coordinates come from a flat [x0, y0, x1, y1, ...] buffer that is built once
+per waveform.
+'''
+class EKGRenderer:
+
+    canvas = None
+    tag = "ekg"
+    fill = ui.heart_rate_line_color
+    line_width = 3
+
+    # The persistent canvas line item for this trace
+    line_id = None
+
+    # Flat coordinate buffer for the current waveform
+    coordinate_buffer = None
+    point_count = 0
+    drawn_points = 0
+
+
+    def __init__(self, canvas, tag="ekg", fill=None, line_width=None):
+        self.canvas = canvas
+        self.tag = tag
+        self.fill = fill or self.fill
+        self.line_width = line_width or self.line_width
+        self.coordinate_buffer = []
+
+
+    # Loads a new waveform given as a list of (x, y) canvas coordinates
+    def set_waveform(self, precomputed_coords):
+        buffer = [0.0] * (len(precomputed_coords) * 2)
+        for i, (x, y) in enumerate(precomputed_coords):
+            buffer[i * 2] = x
+            buffer[i * 2 + 1] = y
+
+        self.coordinate_buffer = buffer
+        self.point_count = len(precomputed_coords)
+        self.drawn_points = 0
+
+
+    # Collapses the line onto the first point of the waveform, ready to draw a new beat
+    def begin_beat(self):
+        x, y = self.coordinate_buffer[0], self.coordinate_buffer[1]
+        self._set_coords((x, y, x, y))
+        self.drawn_points = 1
+
+
+    # Extends the trace so that the first `point_count` points of the waveform are visible
+    def draw_to(self, point_count):
+        point_count = min(point_count, self.point_count)
+        drawn_points = self.drawn_points
+        if point_count <= drawn_points:
+            return
+
+        # A begun beat only needs the points it does not show yet, anything else is reshaped into the trace
+        if drawn_points >= 1 and self.line_id is not None:
+            self.canvas.insert(self.line_id, "end", self.coordinate_buffer[drawn_points * 2:point_count * 2])
+        elif point_count >= 2:
+            self._set_coords(self.coordinate_buffer[:point_count * 2])
+        else:
+            return
+
+        self.drawn_points = point_count
+
+
+    # Reshapes the trace into a flat baseline across the canvas
+    def flatline(self, y, width):
+        self._set_coords((0, y, width, y))
+        self.drawn_points = 0
+
+
+    # Removes the trace from the canvas, the next draw creates a fresh line item
+    def clear(self):
+        if self.line_id is not None:
+            self.canvas.delete(self.line_id)
+        self.line_id = None
+        self.drawn_points = 0
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # Updates the line item in place, creating it the first time it is needed
+    def _set_coords(self, coords):
+        if self.line_id is None:
+            self.line_id = self.canvas.create_line(
+                *coords,
+                fill=self.fill,
+                width=self.line_width,
+                tags=self.tag,
+            )
+        else:
+            self.canvas.coords(self.line_id, *coords)
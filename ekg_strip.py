@@ -0,0 +1,219 @@
+import ui_design_variables as ui
+
+from array import array
+
+
+'''
+Fixed-capacity ring buffer of (timestamp, amplitude) samples
+
+Backed by two preallocated arrays, so memory use never grows with the session length.
+Once full, each append overwrites the oldest sample.
+'''
+class SampleRingBuffer:
+
+    capacity = 0
+    size = 0
+
+    # Index the next sample will be written to
+    head = 0
+
+    # Samples appended since the last clear(), including those overwritten since
+    append_count = 0
+
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("SampleRingBuffer capacity must be positive")
+
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.amplitudes = array("d", bytes(8 * capacity))
+
+
+    def __len__(self):
+        return self.size
+
+
+    def append(self, timestamp, amplitude):
+        self.timestamps[self.head] = timestamp
+        self.amplitudes[self.head] = amplitude
+        self.head = (self.head + 1) % self.capacity
+        self.append_count += 1
+        if self.size < self.capacity:
+            self.size += 1
+
+
+    # Returns the i-th stored sample, 0 being the oldest
+    def get(self, i):
+        if not 0 <= i < self.size:
+            raise IndexError("SampleRingBuffer index out of range")
+        idx = (self.head - self.size + i) % self.capacity
+        return self.timestamps[idx], self.amplitudes[idx]
+
+
+    # Returns the most recent sample or None when empty
+    def latest(self):
+        if self.size == 0:
+            return None
+        return self.get(self.size - 1)
+
+
+    def clear(self):
+        self.size = 0
+        self.head = 0
+        self.append_count = 0
+
+
+'''
+Scrolling multi-beat EKG strip
+
+Samples are pushed with their timestamp into a preallocated SampleRingBuffer, and the
+strip is drawn from it, scrolling left at a fixed number of pixels per second. Only the newly exposed columns are drawn: a single
+short segment is placed at the right edge and every existing segment is shifted
+with one Canvas.move() call on the strip tag.
+
+Segment items are recycled once the strip is full, so the number of canvas items,
+the memory used and the per-frame cost stay constant however long the session runs.
+'''
+class ScrollingEKGStrip:
+
+    canvas = None
+    tag = "ekg_strip"
+    fill = ui.heart_rate_line_color
+    line_width = 3
+
+    width = ui.ekg_canvas_width
+    height = ui.ekg_canvas_height
+    window_seconds = ui.ekg_strip_seconds
+
+    # Maps waveform amplitudes onto canvas coordinates
+    y_offset = 0
+    y_scale = 300
+
+    pixels_per_second = 0
+
+    # Fractional pixels not yet scrolled
+    pending_pixels = 0.0
+
+    last_timestamp = None
+    last_y = None
+
+    # Ring buffer samples already drawn, compared to its append_count
+    drawn_count = 0
+
+
+    def __init__(self, canvas, width=None, height=None, window_seconds=None, tag="ekg_strip"):
+        self.canvas = canvas
+        self.tag = tag
+        self.width = width or self.width
+        self.height = height or self.height
+        self.window_seconds = window_seconds or self.window_seconds
+
+        self.y_offset = self.height / 1.5
+        self.pixels_per_second = self.width / self.window_seconds
+
+        # The strip's sample history, one sample per column covers the visible window
+        # Samples not drawn yet that a huge batch overwrote would have scrolled out anyway
+        self.samples = SampleRingBuffer(int(self.width))
+
+        # Every segment covers at least one column, so `width` segments always fill the strip
+        self.segment_ids = []
+        self.next_segment = 0
+
+
+    # Adds a sample to the strip and scrolls it by the elapsed time
+    def push(self, timestamp, amplitude):
+        self.push_many(((timestamp, amplitude),))
+
+
+    # Adds a batch of (timestamp, amplitude) samples with a single scroll of the strip
+    def push_many(self, samples):
+        ring = self.samples
+        for timestamp, amplitude in samples:
+            ring.append(timestamp, amplitude)
+        self._draw_new_samples()
+
+
+    # Removes the strip from the canvas and forgets the sample history
+    def clear(self):
+        self.canvas.delete(self.tag)
+        self.segment_ids = []
+        self.next_segment = 0
+        self.samples.clear()
+        self.drawn_count = 0
+        self.pending_pixels = 0.0
+        self.last_timestamp = None
+        self.last_y = None
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # Scrolls the strip by the samples the ring buffer received since the last draw
+    def _draw_new_samples(self):
+        ring = self.samples
+        new_count = min(ring.append_count - self.drawn_count, len(ring))
+        self.drawn_count = ring.append_count
+
+        segments = []
+        scrolled_columns = 0
+
+        for i in range(len(ring) - new_count, len(ring)):
+            timestamp, amplitude = ring.get(i)
+            y = self.y_offset - (amplitude * self.y_scale)
+
+            if self.last_timestamp is None:
+                self.last_timestamp = timestamp
+                self.last_y = y
+                continue
+
+            self.pending_pixels += (timestamp - self.last_timestamp) * self.pixels_per_second
+            self.last_timestamp = timestamp
+
+            columns = int(self.pending_pixels)
+            if columns < 1:
+                # Not enough time passed to expose a column, hold the most prominent amplitude so peaks are not lost
+                self.last_y = y if abs(y - self.y_offset) > abs(self.last_y - self.y_offset) else self.last_y
+                continue
+
+            self.pending_pixels -= columns
+            segments.append((columns, self.last_y, y))
+            scrolled_columns += columns
+            self.last_y = y
+
+        if not segments:
+            return
+
+        scrolled_columns = min(scrolled_columns, int(self.width))
+        self.canvas.move(self.tag, -scrolled_columns, 0)
+
+        # Segments end at the right edge, the newest one last, older ones that scrolled out are skipped
+        x1 = self.width
+        drawn_segments = []
+        for columns, y0, y1 in reversed(segments):
+            if x1 <= self.width - scrolled_columns:
+                break
+            drawn_segments.append((x1 - columns, y0, x1, y1))
+            x1 -= columns
+
+        for x0, y0, x1, y1 in reversed(drawn_segments):
+            self._draw_segment(max(x0, self.width - scrolled_columns), y0, x1, y1)
+
+
+    # Draws a segment at the right edge, reusing the oldest (scrolled out) item once the strip is full
+    def _draw_segment(self, x0, y0, x1, y1):
+        if len(self.segment_ids) < self.width:
+            self.segment_ids.append(self.canvas.create_line(
+                x0, y0, x1, y1,
+                fill=self.fill,
+                width=self.line_width,
+                tags=self.tag,
+            ))
+            return
+
+        self.canvas.coords(self.segment_ids[self.next_segment], x0, y0, x1, y1)
+        self.next_segment = (self.next_segment + 1) % len(self.segment_ids)
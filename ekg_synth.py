@@ -0,0 +1,151 @@
+from array import array
+from asyncio import sleep
+from functools import lru_cache
+from math import exp, sqrt
+from time import perf_counter
+
+
+'''
+Parametric EKG beat synthesizer
+
+A beat is the sum of five Gaussians, one per wave (P, Q, R, S, T), sampled at the
+canvas resolution. Their timing follows the RR interval the way a real heart does:
+
+    QT  Bazett, QT = QTc * sqrt(RR), so the T wave moves in as the rate rises
+    PR  shortens gently with the rate, PR = PR at 60 BPM * RR^(1/3)
+    QRS stays the same width at any rate
+
+Gaussians wrap around the beat, so at high rates the P wave rides on the previous
+T wave instead of being cut off. Beats are cached per (BPM, sample count): a BPM
+change inside the beat loop is a dictionary lookup.
+'''
+
+# Wave amplitudes, in the units of the original hand-drawn 21-point pattern
+P_AMPLITUDE = 0.04
+Q_AMPLITUDE = -0.05
+R_AMPLITUDE = 0.35
+S_AMPLITUDE = -0.095
+T_AMPLITUDE = 0.06
+
+# Intervals at 60 BPM (RR = 1 s), in seconds
+QTC = 0.40
+PR_AT_60_BPM = 0.16
+MIN_PR = 0.08
+
+# QRS timing around the R peak, in seconds
+Q_OFFSET = 0.025
+S_OFFSET = 0.025
+QRS_ONSET = 0.04
+QRS_SIGMA = 0.008
+
+# Wave widths at 60 BPM, scaled by sqrt(RR)
+P_SIGMA = 0.02
+T_SIGMA = 0.05
+
+# Flat baseline before the P wave, as a fraction of the beat
+LEAD_IN_FRACTION = 0.05
+
+# Names of the beat phases actions can be attached to
+BEAT_PHASES = ("beat_start", "p_wave", "qrs", "r_peak", "t_wave")
+
+MIN_BPM = 20
+MAX_BPM = 300
+
+# Longest stretch prepare_waveforms_async() synthesizes before yielding to the event loop
+PREPARE_SLICE_SECONDS = 0.002
+
+
+# One synthesized beat: its samples and when each phase happens, as fractions of the beat
+class EKGWaveform:
+
+    __slots__ = ("bpm", "rr_seconds", "samples", "phase_fractions")
+
+
+    def __init__(self, bpm, rr_seconds, samples, phase_fractions):
+        self.bpm = bpm
+        self.rr_seconds = rr_seconds
+        self.samples = samples
+        self.phase_fractions = phase_fractions
+
+
+    def __len__(self):
+        return len(self.samples)
+
+
+    def __repr__(self):
+        return f"EKGWaveform(bpm={self.bpm}, samples={len(self.samples)})"
+
+
+# Returns the cached beat for a BPM, rounded to a whole BPM and clamped to MIN_BPM..MAX_BPM
+def synthesize_beat(bpm, sample_count):
+    return _synthesize_beat(min(MAX_BPM, max(MIN_BPM, int(round(bpm)))), sample_count)
+
+
+# Large enough for every whole BPM at a couple of resolutions
+@lru_cache(maxsize=2 * (MAX_BPM - MIN_BPM + 1))
+def _synthesize_beat(bpm, sample_count):
+    rr = 60 / bpm
+    rate_scale = sqrt(rr)
+
+    qt = QTC * rate_scale
+    pr = max(MIN_PR, PR_AT_60_BPM * rr ** (1 / 3))
+    p_sigma = P_SIGMA * rate_scale
+    t_sigma = T_SIGMA * rate_scale
+
+    # Lay the beat out from the R peak, leaving the P wave room after the lead-in
+    r_time = LEAD_IN_FRACTION * rr + pr + 2.5 * p_sigma
+    qrs_onset = r_time - QRS_ONSET
+    p_time = qrs_onset - pr + 2.5 * p_sigma
+    t_time = qrs_onset + qt - 2 * t_sigma
+
+    waves = (
+        (P_AMPLITUDE, p_time, p_sigma),
+        (Q_AMPLITUDE, r_time - Q_OFFSET, QRS_SIGMA),
+        (R_AMPLITUDE, r_time, QRS_SIGMA),
+        (S_AMPLITUDE, r_time + S_OFFSET, QRS_SIGMA),
+        (T_AMPLITUDE, t_time, t_sigma),
+    )
+
+    samples = array("d", bytes(8 * sample_count))
+    seconds_per_sample = rr / sample_count
+    for amplitude, center, sigma in waves:
+        inverse_width = 1 / (2 * sigma * sigma)
+        # Only samples within 4 sigma matter, evaluated once per wrap of the beat
+        reach = 4 * sigma
+        for shift in (-rr, 0.0, rr):
+            wave_center = center + shift
+            first = max(0, int((wave_center - reach) / seconds_per_sample))
+            last = min(sample_count, int((wave_center + reach) / seconds_per_sample) + 1)
+            for i in range(first, last):
+                offset = i * seconds_per_sample - wave_center
+                samples[i] += amplitude * exp(-offset * offset * inverse_width)
+
+    phase_fractions = {
+        "beat_start": 0.0,
+        "p_wave": (p_time % rr) / rr,
+        "qrs": qrs_onset / rr,
+        "r_peak": r_time / rr,
+        "t_wave": (t_time % rr) / rr,
+    }
+
+    return EKGWaveform(bpm, rr, samples, phase_fractions)
+
+
+# Synthesizes every whole BPM up front, so no beat is ever computed inside the beat loop
+def prepare_waveforms(sample_count):
+    for bpm in range(MIN_BPM, MAX_BPM + 1):
+        _synthesize_beat(bpm, sample_count)
+
+
+# Same, from a coroutine: the loop keeps serving Tk and Bluetooth callbacks in between
+async def prepare_waveforms_async(sample_count):
+    sliced_at = perf_counter()
+    for bpm in range(MIN_BPM, MAX_BPM + 1):
+        _synthesize_beat(bpm, sample_count)
+        if perf_counter() - sliced_at >= PREPARE_SLICE_SECONDS:
+            await sleep(0)
+            sliced_at = perf_counter()
+
+
+def cache_info():
+    return _synthesize_beat.cache_info()
@@ -0,0 +1,216 @@
+import json
+import sys
+
+from collections import deque
+from datetime import datetime
+from os import path as os_path, makedirs, replace, remove
+from threading import Thread, Event
+from time import time
+
+
+'''
+Structured event log written by a background thread
+
+Logging an event is a level check and a deque append of (timestamp, level, name, fields);
+nothing is formatted and no I/O happens on the calling thread. A writer thread wakes
+every FLUSH_INTERVAL, or right away for errors, and writes the queued events as compact
+JSON lines to a size-rotated file under ~/.i_heart_clicking/logs, echoing them to the
+console when there is one (the windowed build has none).
+
+The queue is bounded: when the writer falls behind, new events are dropped and counted
+instead of growing memory or blocking the beat loop.
+
+    from event_log import events
+    events.info("notification", bpm=72, rr_count=1)
+    events.warning("parse_error", error=e)
+'''
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+LOGS_DIRECTORY = os_path.join(os_path.expanduser("~"), ".i_heart_clicking", "logs")
+
+
+class EventLog:
+
+    MAX_QUEUED_EVENTS = 8192
+    FLUSH_INTERVAL = 0.25
+
+    # The file is rotated to events.1.jsonl ... once it grows past MAX_FILE_BYTES
+    MAX_FILE_BYTES = 5 * 1024 * 1024
+    BACKUP_COUNT = 3
+
+    level = INFO
+    echo_level = INFO
+    clock = None
+
+    path = None
+    is_echoing = False
+    file = None
+    thread = None
+
+    # Counters
+    written_count = 0
+    dropped_count = 0
+
+
+    def __init__(self, level=None, clock=time):
+        self.level = level or self.level
+        self.clock = clock
+        self.queue = deque()
+        self.wake = Event()
+        self.stopping = Event()
+
+
+    def debug(self, name, **fields):
+        if DEBUG >= self.level:
+            self.event(DEBUG, name, fields)
+
+
+    def info(self, name, **fields):
+        if INFO >= self.level:
+            self.event(INFO, name, fields)
+
+
+    def warning(self, name, **fields):
+        if WARNING >= self.level:
+            self.event(WARNING, name, fields)
+
+
+    def error(self, name, **fields):
+        if ERROR >= self.level:
+            self.event(ERROR, name, fields)
+
+
+    # Queues an event, fields are only turned into text on the writer thread
+    def event(self, level, name, fields):
+        if level < self.level:
+            return
+
+        queue = self.queue
+        if len(queue) >= self.MAX_QUEUED_EVENTS:
+            self.dropped_count += 1
+            return
+
+        queue.append((self.clock(), level, name, fields))
+        if level >= ERROR:
+            self.wake.set()
+
+
+    # Starts the writer, `path` None writes to LOGS_DIRECTORY, False only echoes
+    # Echoes to the console by default when there is one
+    def start(self, path=None, echo=None):
+        if self.thread is not None:
+            return
+
+        if path is None:
+            path = os_path.join(LOGS_DIRECTORY, "events.jsonl")
+        self.path = path or None
+        self.is_echoing = sys.stdout is not None if echo is None else echo
+
+        if self.path is not None:
+            try:
+                makedirs(os_path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, "a", encoding="utf-8")
+            except OSError as e:
+                print(f"Could not open the event log, events are only echoed:\n{e}")
+                self.path = None
+
+        self.stopping.clear()
+        self.thread = Thread(target=self.run_writer, name="event-log", daemon=True)
+        self.thread.start()
+
+
+    # Writes everything still queued and stops the writer
+    def stop(self, timeout=2.0):
+        if self.thread is None:
+            return
+
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+    def register_metrics(self, metrics):
+        metrics.counter_callback("events_written_total", "Events written by the event log", lambda: self.written_count)
+        metrics.counter_callback("events_dropped_total", "Events dropped because the event log queue was full", lambda: self.dropped_count)
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def run_writer(self):
+        while not self.stopping.is_set():
+            self.wake.wait(self.FLUSH_INTERVAL)
+            self.wake.clear()
+            self.write_pending()
+        self.write_pending()
+
+
+    def write_pending(self):
+        queue = self.queue
+        if not queue:
+            return
+
+        lines = []
+        while queue:
+            timestamp, level, name, fields = queue.popleft()
+            record = {"t": round(timestamp, 6), "level": LEVEL_NAMES.get(level, level), "event": name}
+            record.update(fields)
+            lines.append(json.dumps(record, separators=(",", ":"), default=str))
+
+            if self.is_echoing and level >= self.echo_level:
+                self.echo(timestamp, level, name, fields)
+
+        self.written_count += len(lines)
+        if self.file is None:
+            return
+
+        try:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+            if self.file.tell() >= self.MAX_FILE_BYTES:
+                self.rotate()
+        except (OSError, ValueError) as e:
+            print(f"Could not write the event log, events are only echoed from now on:\n{e}")
+            self.file = None
+
+
+    # events.jsonl -> events.1.jsonl -> events.2.jsonl ..., dropping the oldest
+    def rotate(self):
+        self.file.close()
+        base, extension = os_path.splitext(self.path)
+
+        oldest = f"{base}.{self.BACKUP_COUNT}{extension}"
+        if os_path.exists(oldest):
+            remove(oldest)
+        for index in range(self.BACKUP_COUNT - 1, 0, -1):
+            source = f"{base}.{index}{extension}"
+            if os_path.exists(source):
+                replace(source, f"{base}.{index + 1}{extension}")
+        replace(self.path, f"{base}.1{extension}")
+
+        self.file = open(self.path, "a", encoding="utf-8")
+
+
+    def echo(self, timestamp, level, name, fields):
+        details = " ".join(f"{key}={value}" for key, value in fields.items())
+        prefix = "" if level == INFO else f"{LEVEL_NAMES.get(level, level).upper()} "
+        print(f"{datetime.fromtimestamp(timestamp):%H:%M:%S.%f}"[:-3] + f" {prefix}{name} {details}".rstrip())
+
+
+# The application's event log, started by start.py
+events = EventLog()
@@ -0,0 +1,386 @@
+import asyncio
+import ui_design_variables as ui
+
+from heart_rate_parser import parse_heart_rate_measurement
+from bpm_history import BPMHistory
+from beat_clock import BeatClock
+from bpm_filter import BPMFilter, FLAG_HELD, FLAG_NO_CONTACT, FLAG_WARMING_UP, UNTRUSTED_FLAGS
+from ekg_synth import synthesize_beat, prepare_waveforms_async, BEAT_PHASES
+from latency_tracer import LatencyTracer, NOTIFY, BPM_UPDATE, BEAT_START, R_PEAK
+from metrics import DRIFT_BUCKETS
+from event_log import events
+from time import monotonic
+
+
+'''
+Headless core of the application: notifications -> BPM -> beat scheduling -> actions
+
+Nothing in here touches Tk. Drawing goes through a renderer object and the per-beat
+actions (heartbeat sound, click) through callbacks, so the same pipeline drives the
+window, runs on a CI machine with NullRenderer, or is benchmarked from recorded streams.
+
+A renderer provides:
+    flatline()                               reset the trace and the heart
+    set_waveform(ekg_points)                 a new beat shape, amplitudes per sample
+    begin_beat()                             a beat starts
+    draw_point(point_idx, amplitude, now)    the beat is drawn up to sample `point_idx` (1-based),
+                                             amplitude is the most prominent since the last call
+    pulse_heart(frame_index)                 show a heart animation frame
+    show_bpm(bpm, average_bpm)               a new BPM reading arrived
+'''
+
+# Heart animation frames, spread evenly from the R peak to the top of the T wave
+HEART_PULSE_SEQUENCE = (3, 2, 1, 0)
+
+# Beat events, in the order they sort in when due at the same moment
+HEARTBEAT_SOUND_EVENT = 0
+R_PEAK_EVENT = 1
+HEART_PULSE_EVENT = 2
+
+
+# Renderer that draws nothing, for headless runs and benchmarks
+class NullRenderer:
+
+    def flatline(self):
+        pass
+
+
+    def set_waveform(self, ekg_points):
+        pass
+
+
+    def begin_beat(self):
+        pass
+
+
+    def draw_point(self, point_idx, amplitude, now):
+        pass
+
+
+    def pulse_heart(self, frame_index):
+        pass
+
+
+    def show_bpm(self, bpm, average_bpm):
+        pass
+
+
+class HeartPipeline:
+
+    # Number of BPM readings averaged for the displayed average
+    AVERAGE_BPM_WINDOW = 60
+
+    # Seconds the EKG waits for the first BPM reading after starting
+    FIRST_BPM_TIMEOUT = 5
+    FIRST_BPM_POLL_SLEEP = 0.1
+
+    # The trace advances once per display frame, beat events fire on time in between
+    DRAW_INTERVAL = 1 / 60
+
+    # Samples and events due this close to a wake-up are handled in it, event loops wake timers
+    # up to their clock resolution early and float rounding would otherwise cost an extra wake-up
+    WAKE_TOLERANCE = 0.0005
+
+    renderer = None
+    clock = None
+    tracer = None
+    dispatcher = None
+    broadcaster = None
+    drift_histogram = None
+
+    current_bpm = 0
+    last_measurement = None
+    last_filtered = None
+    is_running = False
+
+    # While paused the EKG keeps beating but no beat actions are armed, e.g. while the strap reconnects
+    are_actions_paused = False
+
+    # Samples per synthesized beat, one per canvas column
+    waveform_resolution = ui.ekg_canvas_width
+    waveform = None
+    beat_events = None
+
+    # Counters
+    notification_count = 0
+    parse_error_count = 0
+    beat_count = 0
+
+
+    def __init__(self, renderer=None, on_heartbeat_sound=None, on_r_peak=None, on_no_bpm=None, clock=monotonic, tracer=None,
+                 dispatcher=None, beat_actions=None, waveform_resolution=None, bpm_filter=None, broadcaster=None,
+                 metrics=None):
+        self.renderer = renderer or NullRenderer()
+        self.clock = clock
+        self.waveform_resolution = waveform_resolution or self.waveform_resolution
+
+        # Stage timestamps from notification to click, the click stages are marked by the action
+        self.tracer = tracer or LatencyTracer(clock=clock)
+
+        # on_heartbeat_sound(bpm) and on_r_peak() run at their phase of every beat, on the pipeline's loop
+        # on_no_bpm() runs when the EKG gives up waiting for a first reading
+        self.on_heartbeat_sound = on_heartbeat_sound
+        self.on_r_peak = on_r_peak
+        self.on_no_bpm = on_no_bpm
+
+        # Actions fired by the dispatcher at their phase of every beat, {phase name: [actions]}
+        # The dispatcher must run on the same clock as the pipeline
+        self.dispatcher = dispatcher
+        self.beat_actions = []
+        for phase, actions in (beat_actions or {}).items():
+            if phase not in BEAT_PHASES:
+                raise ValueError(f"Unknown beat phase {phase!r}, expected one of {', '.join(BEAT_PHASES)}")
+            self.beat_actions.extend((phase, action, phase == "r_peak") for action in actions)
+
+        # Rejects strap glitches and smooths the readings before they reach the beat clock
+        self.bpm_filter = bpm_filter or BPMFilter()
+
+        # Schedules EKG beats, drift metrics live on this object
+        self.beat_clock = BeatClock(clock=clock)
+
+        # Bounded BPM/RR history with rolling statistics, one per session
+        self.bpm_history = BPMHistory()
+
+        # Publishes readings and beat timing to other local processes, see bpm_broadcast
+        self.broadcaster = broadcaster
+
+        # Counters are read by the registry when scraped, only the drift is recorded per beat
+        if metrics is not None:
+            self.register_metrics(metrics)
+
+
+    # Decodes a raw 0x2A37 notification and feeds it through the pipeline
+    # Returns the decoded measurement, or None when the payload is malformed
+    def handle_notification(self, sender, data):
+        self.tracer.mark(NOTIFY)
+        self.notification_count += 1
+        try:
+            measurement = parse_heart_rate_measurement(data)
+        except ValueError as e:
+            self.parse_error_count += 1
+            events.warning("parse_error", error=e, size=len(data))
+            return None
+
+        self.last_measurement = measurement
+        filtered = self.bpm_filter.update(measurement.heart_rate, measurement.sensor_contact)
+        self.last_filtered = filtered
+
+        # RR intervals measured without skin contact are noise
+        rr_intervals = measurement.rr_intervals_seconds
+        if rr_intervals and not filtered.flags & FLAG_NO_CONTACT:
+            self.beat_clock.push_rr_intervals(rr_intervals)
+            self.bpm_history.append_rr_intervals(rr_intervals)
+
+        if filtered.has_estimate and not filtered.flags & FLAG_HELD:
+            # Warming-up readings are not trusted, but the first one seeds an empty schedule so the EKG can start
+            is_seed = filtered.flags & UNTRUSTED_FLAGS == FLAG_WARMING_UP and not self.beat_clock.current_bpm
+            self.update_bpm(filtered.bpm, filtered.is_confident or is_seed)
+
+        if self.broadcaster is not None:
+            self.broadcaster.publish_sample(filtered, rr_intervals)
+        return measurement
+
+
+    # Records a BPM reading, only confident ones steer the beat schedule
+    def update_bpm(self, heart_rate, is_confident=True):
+        self.current_bpm = int(round(heart_rate))
+        self.bpm_history.append(self.current_bpm, self.clock())
+        if is_confident:
+            self.beat_clock.push_bpm(heart_rate)
+        self.tracer.mark(BPM_UPDATE)
+        self.renderer.show_bpm(self.current_bpm, self.bpm_history.mean(self.AVERAGE_BPM_WINDOW))
+
+
+    # Runs the beat loop until stop() is called, returns False when no BPM ever arrived
+    async def run(self):
+        self.is_running = True
+        self.renderer.flatline()
+
+        # Give the heart rate monitor a moment to deliver its first reading
+        events.info("ekg_waiting_for_bpm")
+        waited = 0
+        while self.current_bpm == 0 and waited < self.FIRST_BPM_TIMEOUT and self.is_running:
+            await asyncio.sleep(self.FIRST_BPM_POLL_SLEEP)
+            waited += self.FIRST_BPM_POLL_SLEEP
+
+        if self.current_bpm == 0:
+            events.warning("ekg_no_bpm", waited=self.FIRST_BPM_TIMEOUT)
+            self.is_running = False
+            if self.on_no_bpm is not None:
+                self.on_no_bpm()
+            return False
+
+        self.waveform = None
+        # In single-threaded mode this loop is pumped by Tk, the window must not freeze meanwhile
+        await prepare_waveforms_async(self.waveform_resolution)
+
+        events.info("ekg_started", bpm=self.current_bpm)
+
+        self.beat_clock.start()
+
+        try:
+
+            while self.is_running:
+
+                # Each beat has an absolute deadline, its length comes from RR intervals or the BPM
+                beat_start_time, seconds_per_beat = self.beat_clock.begin_beat()
+                self.tracer.mark(BEAT_START)
+                if self.drift_histogram is not None:
+                    self.drift_histogram.observe(abs(self.beat_clock.last_drift))
+                self.select_waveform(seconds_per_beat)
+                self.arm_beat_actions(beat_start_time, seconds_per_beat)
+                self.publish_beat(beat_start_time, seconds_per_beat)
+
+                self.renderer.begin_beat()
+
+                # Draw the EKG line frame by frame within a single beat
+                await self.run_beat(beat_start_time, seconds_per_beat)
+                if not self.is_running:
+                    break
+                self.beat_count += 1
+
+                # Wait for the next beat's deadline, late beats start right away
+                await asyncio.sleep(max(0, self.beat_clock.time_until_next_beat()))
+
+        finally:
+            # This block will execute when the loop ends for any reason
+            if self.dispatcher is not None:
+                self.dispatcher.cancel_all()
+            self.renderer.flatline()
+
+        return True
+
+
+    # Stops the beat loop, clicks already armed for the current beat are cancelled right away
+    def stop(self):
+        self.is_running = False
+        if self.dispatcher is not None:
+            self.dispatcher.cancel_all()
+
+
+    # Stops firing beat actions, including those already armed, until resume_actions()
+    def pause_actions(self):
+        self.are_actions_paused = True
+        if self.dispatcher is not None:
+            self.dispatcher.cancel_all()
+
+
+    def resume_actions(self):
+        self.are_actions_paused = False
+
+
+    # Exposes the pipeline's counters and latencies on a metrics.MetricsRegistry
+    def register_metrics(self, metrics):
+        metrics.counter_callback("notifications_total", "Heart rate notifications received", lambda: self.notification_count)
+        metrics.counter_callback("parse_errors_total", "Malformed heart rate notifications", lambda: self.parse_error_count)
+        metrics.counter_callback("outliers_total", "BPM readings rejected as outliers", lambda: self.bpm_filter.outlier_count)
+        metrics.counter_callback("beats_total", "EKG beats drawn", lambda: self.beat_count)
+        metrics.counter_callback("beat_resyncs_total", "Beats that fell too far behind and were resynchronised", lambda: self.beat_clock.resync_count)
+        metrics.gauge("bpm", "Latest BPM reading", lambda: self.current_bpm)
+        self.drift_histogram = metrics.histogram("beat_drift_seconds", "Lateness of each beat start against its deadline", DRIFT_BUCKETS)
+
+        for name, _, _ in self.tracer.SPANS:
+            metrics.latency_summary(
+                f"latency_{name}_seconds", f"Traced {name.replace('_', ' ')} latency",
+                lambda name=name: self.tracer.histograms[name],
+            )
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # Switches to the synthesized beat for this beat's rate, cached per BPM
+    def select_waveform(self, seconds_per_beat):
+        waveform = synthesize_beat(60 / seconds_per_beat, self.waveform_resolution)
+        if waveform is self.waveform:
+            return
+
+        self.waveform = waveform
+        self.beat_events = self.build_beat_events(waveform)
+        self.renderer.set_waveform(waveform.samples)
+
+
+    # (fraction of the beat, event, value) for the sounds, the R peak and the heart pulse, in firing order
+    def build_beat_events(self, waveform):
+        phases = waveform.phase_fractions
+        events = [
+            (phases["qrs"], HEARTBEAT_SOUND_EVENT, None),
+            (phases["r_peak"], R_PEAK_EVENT, None),
+        ]
+
+        # The heart contracts at the R peak and is relaxed again by the T wave, which wraps past the beat end at high rates
+        pulse_step = ((phases["t_wave"] - phases["r_peak"]) % 1.0) / (len(HEART_PULSE_SEQUENCE) - 1)
+        for step, frame_index in enumerate(HEART_PULSE_SEQUENCE):
+            events.append((min(1.0, phases["r_peak"] + step * pulse_step), HEART_PULSE_EVENT, frame_index))
+        events.sort()
+        return events
+
+
+    # Hands the beat's actions to the dispatcher as soon as the beat's timing is known
+    def arm_beat_actions(self, beat_start_time, seconds_per_beat):
+        if self.dispatcher is None or self.are_actions_paused:
+            return
+        phases = self.waveform.phase_fractions
+        for phase, action, is_traced in self.beat_actions:
+            self.dispatcher.arm(beat_start_time + phases[phase] * seconds_per_beat, action, is_traced)
+
+
+    def publish_beat(self, beat_start_time, seconds_per_beat):
+        if self.broadcaster is None:
+            return
+        r_peak_at = beat_start_time + self.waveform.phase_fractions["r_peak"] * seconds_per_beat
+        self.broadcaster.publish_beat(beat_start_time, seconds_per_beat, r_peak_at)
+
+
+    # Draws one beat and fires its events, waking up for every display frame and every event
+    async def run_beat(self, beat_start_time, seconds_per_beat):
+        samples = self.waveform.samples
+        sample_count = len(samples)
+        events = self.beat_events
+        next_event = 0
+        drawn = 0
+
+        # The last sample is due one sample before the beat ends
+        last_sample_at = beat_start_time + seconds_per_beat * (sample_count - 1) / sample_count
+
+        while self.is_running:
+            now = self.clock()
+            fraction = (now + self.WAKE_TOLERANCE - beat_start_time) / seconds_per_beat
+
+            # Extend the trace to the current sample, passing on the most prominent amplitude skipped over
+            index = min(sample_count, int(fraction * sample_count) + 1)
+            if index > drawn:
+                amplitude = max(samples[drawn:index], key=abs)
+                self.renderer.draw_point(index, amplitude, now)
+                drawn = index
+
+            while next_event < len(events) and events[next_event][0] <= fraction:
+                _, event, value = events[next_event]
+                next_event += 1
+
+                # Beat the heart at the QRS Complex
+                if event == HEARTBEAT_SOUND_EVENT:
+                    if self.on_heartbeat_sound is not None:
+                        self.on_heartbeat_sound(self.current_bpm)
+                # The peak R wave, clicks are fired by the dispatcher
+                elif event == R_PEAK_EVENT:
+                    self.tracer.mark(R_PEAK)
+                    if self.on_r_peak is not None:
+                        self.on_r_peak()
+                else:
+                    self.renderer.pulse_heart(value)
+
+            if drawn >= sample_count and next_event >= len(events):
+                return
+
+            # Sleep until the next frame, or the next event or the last sample when they come first
+            wake_at = now + self.DRAW_INTERVAL
+            if drawn < sample_count:
+                wake_at = min(wake_at, last_sample_at)
+            if next_event < len(events):
+                wake_at = min(wake_at, beat_start_time + events[next_event][0] * seconds_per_beat)
+            await asyncio.sleep(max(0.001, wake_at - self.clock()))
@@ -0,0 +1,229 @@
+from struct import Struct, error as StructError
+from array import array
+
+
+'''
+Parser for the Bluetooth GATT Heart Rate Measurement characteristic (0x2A37)
+
+Payload layout, all values little-endian:
+    flags            uint8
+    heart rate       uint8, or uint16 when FLAG_HEART_RATE_UINT16 is set
+    energy expended  uint16 kJ, present when FLAG_ENERGY_EXPENDED is set
+    RR intervals     uint16 each in 1/1024 s, present when FLAG_RR_INTERVALS is set,
+                     filling the remainder of the payload
+
+Parsing works on a memoryview of the notification, so no intermediate bytes objects are created.
+'''
+
+FLAG_HEART_RATE_UINT16 = 0x01
+FLAG_SENSOR_CONTACT_DETECTED = 0x02
+FLAG_SENSOR_CONTACT_SUPPORTED = 0x04
+FLAG_ENERGY_EXPENDED = 0x08
+FLAG_RR_INTERVALS = 0x10
+
+RR_INTERVAL_UNITS_PER_SECOND = 1024
+
+# Used when a field is absent in the batch arrays
+NO_ENERGY_EXPENDED = -1
+
+_UINT8 = Struct("<B")
+_UINT16 = Struct("<H")
+
+# Struct per RR interval count, built on first use
+_RR_STRUCTS = {}
+
+
+# A single decoded Heart Rate Measurement notification
+class HeartRateMeasurement:
+
+    __slots__ = ("flags", "heart_rate", "energy_expended", "rr_intervals")
+
+
+    def __init__(self, flags, heart_rate, energy_expended=None, rr_intervals=()):
+        self.flags = flags
+        self.heart_rate = heart_rate
+        self.energy_expended = energy_expended
+        self.rr_intervals = rr_intervals
+
+
+    # None when the sensor does not report contact, otherwise whether the strap touches skin
+    @property
+    def sensor_contact(self):
+        if not self.flags & FLAG_SENSOR_CONTACT_SUPPORTED:
+            return None
+        return bool(self.flags & FLAG_SENSOR_CONTACT_DETECTED)
+
+
+    # RR intervals converted from 1/1024 s units to seconds
+    @property
+    def rr_intervals_seconds(self):
+        return tuple(rr / RR_INTERVAL_UNITS_PER_SECOND for rr in self.rr_intervals)
+
+
+    def __repr__(self):
+        return (
+            f"HeartRateMeasurement(heart_rate={self.heart_rate}, sensor_contact={self.sensor_contact}, "
+            f"energy_expended={self.energy_expended}, rr_intervals={self.rr_intervals})"
+        )
+
+
+'''
+Decoded notifications stored column-wise in compact arrays
+
+Produced by parse_heart_rate_measurements() for recorded streams.
+RR intervals of every notification are concatenated into `rr_intervals`;
+notification i owns rr_intervals[rr_offsets[i]:rr_offsets[i + 1]].
+'''
+class HeartRateMeasurementBatch:
+
+    __slots__ = ("flags", "heart_rates", "energy_expended", "rr_intervals", "rr_offsets")
+
+
+    def __init__(self):
+        self.flags = array("B")
+        self.heart_rates = array("H")
+        self.energy_expended = array("i")
+        self.rr_intervals = array("H")
+        self.rr_offsets = array("I", [0])
+
+
+    def __len__(self):
+        return len(self.heart_rates)
+
+
+    # Builds the record for notification i
+    def get(self, i):
+        energy = self.energy_expended[i]
+        return HeartRateMeasurement(
+            self.flags[i],
+            self.heart_rates[i],
+            None if energy == NO_ENERGY_EXPENDED else energy,
+            tuple(self.rr_intervals[self.rr_offsets[i]:self.rr_offsets[i + 1]]),
+        )
+
+
+# Decodes one notification payload, raising ValueError when it is malformed
+def parse_heart_rate_measurement(data):
+    view = memoryview(data)
+    flags, heart_rate, energy, rr_start, rr_count = _decode_header(view)
+
+    rr_intervals = ()
+    if rr_count:
+        rr_intervals = _rr_struct(rr_count).unpack_from(view, rr_start)
+
+    return HeartRateMeasurement(
+        flags,
+        heart_rate,
+        None if energy == NO_ENERGY_EXPENDED else energy,
+        rr_intervals,
+    )
+
+
+# Decodes many notification payloads into column arrays, without a record object per notification
+# Malformed payloads are skipped and counted in the returned (batch, error_count)
+def parse_heart_rate_measurements(payloads):
+    batch = HeartRateMeasurementBatch()
+    error_count = 0
+
+    flags_append = batch.flags.append
+    heart_rates_append = batch.heart_rates.append
+    energy_append = batch.energy_expended.append
+    rr_extend = batch.rr_intervals.frombytes
+    rr_offsets_append = batch.rr_offsets.append
+    rr_total = 0
+
+    for data in payloads:
+        view = memoryview(data)
+        try:
+            flags, heart_rate, energy, rr_start, rr_count = _decode_header(view)
+        except ValueError:
+            error_count += 1
+            continue
+
+        flags_append(flags)
+        heart_rates_append(heart_rate)
+        energy_append(energy)
+        if rr_count:
+            rr_extend(view[rr_start:rr_start + rr_count * 2])
+            rr_total += rr_count
+        rr_offsets_append(rr_total)
+
+    # RR intervals were copied as raw little-endian bytes
+    if array("H", [1]).tobytes() != b"\x01\x00":
+        batch.rr_intervals.byteswap()
+
+    return batch, error_count
+
+
+# Encodes a notification payload, the inverse of parse_heart_rate_measurement()
+def encode_heart_rate_measurement(heart_rate, energy_expended=None, rr_intervals=(), sensor_contact=None):
+    flags = 0
+    payload = bytearray(1)
+
+    if heart_rate > 0xFF:
+        flags |= FLAG_HEART_RATE_UINT16
+        payload += _UINT16.pack(heart_rate)
+    else:
+        payload += _UINT8.pack(heart_rate)
+
+    if sensor_contact is not None:
+        flags |= FLAG_SENSOR_CONTACT_SUPPORTED
+        if sensor_contact:
+            flags |= FLAG_SENSOR_CONTACT_DETECTED
+
+    if energy_expended is not None:
+        flags |= FLAG_ENERGY_EXPENDED
+        payload += _UINT16.pack(energy_expended)
+
+    if rr_intervals:
+        flags |= FLAG_RR_INTERVALS
+        payload += _rr_struct(len(rr_intervals)).pack(*rr_intervals)
+
+    payload[0] = flags
+    return bytes(payload)
+
+
+# # # # # # # # #
+#
+#  Sub Functions
+#
+# # # # # # # # #
+
+
+# Returns (flags, heart_rate, energy_expended, rr_start, rr_count) for a payload view
+def _decode_header(view):
+    length = len(view)
+    if length < 2:
+        raise ValueError(f"Heart rate measurement too short ({length} bytes)")
+
+    try:
+        flags = view[0]
+        if flags & FLAG_HEART_RATE_UINT16:
+            heart_rate = _UINT16.unpack_from(view, 1)[0]
+            offset = 3
+        else:
+            heart_rate = view[1]
+            offset = 2
+
+        energy = NO_ENERGY_EXPENDED
+        if flags & FLAG_ENERGY_EXPENDED:
+            energy = _UINT16.unpack_from(view, offset)[0]
+            offset += 2
+    except StructError:
+        raise ValueError(f"Heart rate measurement truncated (flags 0x{flags:02x}, {length} bytes)")
+
+    rr_count = 0
+    if flags & FLAG_RR_INTERVALS:
+        remaining = length - offset
+        if remaining % 2:
+            raise ValueError(f"Heart rate measurement has an odd number of RR interval bytes ({remaining})")
+        rr_count = remaining // 2
+
+    return flags, heart_rate, energy, offset, rr_count
+
+
+def _rr_struct(count):
+    rr_struct = _RR_STRUCTS.get(count)
+    if rr_struct is None:
+        rr_struct = _RR_STRUCTS[count] = Struct(f"<{count}H")
+    return rr_struct
@@ -0,0 +1,56 @@
+'''
+Precomputed frames of the beating heart animation
+
+The heart image is loaded and resized into every pulse frame once, so a beat
+only swaps which PhotoImage the label shows. Loading and resizing, and the PIL
+import itself, can run on a background thread with load_images(); build() then
+turns the frames into PhotoImages and must run on the Tk thread.
+The cache keeps a reference to every frame, which also stops Tk from garbage collecting them.
+'''
+class HeartSpriteCache:
+
+    # Frame sizes in pixels, from the relaxed heart down to the fully contracted one
+    PULSE_SIZES = (160, 157, 154, 150)
+
+    image_path = None
+    images = None
+    frames = None
+
+
+    def __init__(self, image_path):
+        self.image_path = image_path
+
+
+    @property
+    def is_built(self):
+        return self.frames is not None
+
+
+    # Returns the PhotoImage for frame `index`, 0 being the relaxed heart
+    def frame(self, index):
+        if self.frames is None:
+            self.build()
+        return self.frames[index]
+
+
+    # Decodes and resizes every frame, safe to call from any thread
+    def load_images(self):
+        from PIL import Image
+
+        original_heart_image = Image.open(self.image_path)
+        self.images = [
+            original_heart_image.resize((size, size), Image.NEAREST)
+            for size in self.PULSE_SIZES
+        ]
+
+
+    def build(self):
+        from PIL import ImageTk
+
+        if self.images is None:
+            self.load_images()
+        self.frames = [ImageTk.PhotoImage(image) for image in self.images]
+
+
+    def __len__(self):
+        return len(self.PULSE_SIZES)
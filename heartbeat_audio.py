@@ -0,0 +1,147 @@
+from threading import Thread, Event
+from queue import Queue, Full
+from array import array
+
+
+'''
+Click and heartbeat sounds
+
+Decoding the MP3 assets is slow, so it happens on a background thread and the
+window can appear straight away. pygame itself is only imported there.
+Sounds requested before loading finishes are skipped.
+
+Every BPM maps through a precomputed lookup table to the closest recorded heartbeat.
+A copy of that recording resampled to the exact BPM is then built on the same
+background thread and cached as decoded PCM, so the tempo is smooth across the whole range
+rather than in 10 BPM steps. Until it is ready the closest recording is played instead.
+'''
+class HeartbeatAudio:
+
+    CLICK_SOUND_PATH = "sounds/single-dull-mouse-click.mp3"
+    HEARTBEAT_SOUND_PATH = "sounds/single-dull-heartbeat-{}-BPM.mp3"
+
+    # BPMs that have a recorded heartbeat asset
+    RECORDED_BPMS = (50, 60, 70, 80, 90, 100, 110, 120)
+
+    MIN_BPM = 30
+    MAX_BPM = 255
+
+    MAX_PENDING_RESAMPLES = 16
+
+    # Array typecodes able to hold one PCM frame of 16-bit samples, by channel count
+    FRAME_TYPECODES = {1: "h", 2: "i", 4: "q"}
+
+    resource_path = None
+    mixer = None
+    click_sound = None
+
+    is_loaded = False
+    is_resampling_supported = False
+
+
+    def __init__(self, resource_path):
+        self.resource_path = resource_path
+        self.ready = Event()
+
+        self.recorded_sounds = {}
+        self.tempo_sounds = {}
+
+        # BPM -> closest recorded BPM, computed once for the whole range
+        self.bpm_lookup = [
+            min(self.RECORDED_BPMS, key=lambda recorded: abs(recorded - bpm))
+            for bpm in range(self.MAX_BPM + 1)
+        ]
+
+        self.pending_resamples = Queue(maxsize=self.MAX_PENDING_RESAMPLES)
+        self.requested_bpms = set()
+
+
+    # Decodes every asset on a background thread, then keeps serving resample requests
+    def load_async(self):
+        Thread(target=self._worker, daemon=True).start()
+
+
+    def play_click(self):
+        if self.is_loaded:
+            self.click_sound.play()
+
+
+    def play_heartbeat(self, bpm):
+        if not self.is_loaded:
+            return
+
+        bpm = min(self.MAX_BPM, max(self.MIN_BPM, int(round(bpm))))
+
+        sound = self.tempo_sounds.get(bpm)
+        if sound is None:
+            self._request_resample(bpm)
+            sound = self.recorded_sounds[self.bpm_lookup[bpm]]
+
+        sound.play()
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def _worker(self):
+        try:
+            self._load()
+        except Exception as e:
+            print(f"Audio unavailable, continuing without sound:\n{e}")
+            return
+        finally:
+            self.ready.set()
+
+        while True:
+            bpm = self.pending_resamples.get()
+            try:
+                self.tempo_sounds[bpm] = self._resample(bpm)
+            except Exception as e:
+                print(f"Could not build the {bpm} BPM heartbeat:\n{e}")
+                self.is_resampling_supported = False
+
+
+    def _load(self):
+        from pygame import mixer
+        self.mixer = mixer
+
+        mixer.init()
+        self.click_sound = mixer.Sound(self.resource_path(self.CLICK_SOUND_PATH))
+        for bpm in self.RECORDED_BPMS:
+            self.recorded_sounds[bpm] = mixer.Sound(self.resource_path(self.HEARTBEAT_SOUND_PATH.format(bpm)))
+
+        # Resampling works on raw 16-bit frames
+        _, size, channels = mixer.get_init()
+        self.frame_typecode = self.FRAME_TYPECODES.get(channels)
+        self.is_resampling_supported = abs(size) == 16 and self.frame_typecode is not None
+        if self.is_resampling_supported:
+            # Recorded BPMs need no resampling
+            self.tempo_sounds.update(self.recorded_sounds)
+
+        self.is_loaded = True
+
+
+    def _request_resample(self, bpm):
+        if not self.is_resampling_supported or bpm in self.requested_bpms:
+            return
+        try:
+            self.pending_resamples.put_nowait(bpm)
+            self.requested_bpms.add(bpm)
+        except Full:
+            pass
+
+
+    # Speeds the closest recording up or down so one heartbeat lasts exactly as long as at `bpm`
+    def _resample(self, bpm):
+        recorded_bpm = self.bpm_lookup[bpm]
+        source = array(self.frame_typecode, self.recorded_sounds[recorded_bpm].get_raw())
+
+        ratio = bpm / recorded_bpm
+        frame_count = int(len(source) / ratio)
+        resampled = array(self.frame_typecode, [source[int(i * ratio)] for i in range(frame_count)])
+
+        return self.mixer.Sound(buffer=resampled.tobytes())
@@ -0,0 +1,234 @@
+import json
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from os import path as os_path, makedirs
+from time import monotonic
+
+
+'''
+End-to-end latency tracing from BLE notification to simulated click
+
+Every stage of a beat marks a monotonic timestamp:
+
+    NOTIFY          a heart rate notification arrived
+    BPM_UPDATE      the reading was decoded and applied
+    BEAT_START      the beat that uses the reading started
+    R_PEAK          the R peak point was drawn
+    CLICK_DISPATCH  the click started executing on its worker
+    CLICK_DONE      pyautogui.click() returned
+
+A beat start snapshots the latest notification and BPM update, so a beat's trace
+always describes the reading it was scheduled from. When the click completes,
+the time between consecutive stages and the end-to-end latency are added to
+log-bucketed histograms.
+
+Marking a stage is one clock read and a list store, cheap enough to leave on.
+Histograms are written from the thread completing the click only.
+'''
+
+NOTIFY = 0
+BPM_UPDATE = 1
+BEAT_START = 2
+R_PEAK = 3
+CLICK_DISPATCH = 4
+CLICK_DONE = 5
+
+STAGE_NAMES = ("notify", "bpm_update", "beat_start", "r_peak", "click_dispatch", "click_done")
+
+TRACES_DIRECTORY = os_path.join(os_path.expanduser("~"), ".i_heart_clicking", "traces")
+
+
+'''
+Fixed-size histogram of durations in seconds
+
+Buckets grow geometrically (BUCKETS_PER_DOUBLING per power of two) from MIN_SECONDS
+to MAX_SECONDS, so percentiles are within about 9% anywhere from microseconds to a minute
+and recording never allocates.
+'''
+class LatencyHistogram:
+
+    MIN_SECONDS = 1e-6
+    MAX_SECONDS = 60.0
+    BUCKETS_PER_DOUBLING = 8
+
+    bounds = None
+
+    count = 0
+    total = 0.0
+    minimum = 0.0
+    maximum = 0.0
+
+
+    def __init__(self):
+        if LatencyHistogram.bounds is None:
+            bounds = []
+            bound = self.MIN_SECONDS
+            ratio = 2 ** (1 / self.BUCKETS_PER_DOUBLING)
+            while bound < self.MAX_SECONDS:
+                bounds.append(bound)
+                bound *= ratio
+            bounds.append(self.MAX_SECONDS)
+            LatencyHistogram.bounds = bounds
+
+        # One extra bucket catches everything above MAX_SECONDS
+        self.counts = array("Q", bytes(8 * (len(self.bounds) + 1)))
+
+
+    def record(self, seconds):
+        if seconds < 0:
+            seconds = 0.0
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+
+        if self.count == 0 or seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.count += 1
+        self.total += seconds
+
+
+    # Upper bound of the bucket holding the given fraction of samples, capped at the maximum
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index == len(self.bounds):
+                    return self.maximum
+                return min(self.bounds[index], self.maximum)
+        return self.maximum
+
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+    # Milliseconds, for reports
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.mean,
+            "min_ms": 1000 * self.minimum,
+            "p50_ms": 1000 * self.percentile(0.5),
+            "p90_ms": 1000 * self.percentile(0.9),
+            "p99_ms": 1000 * self.percentile(0.99),
+            "max_ms": 1000 * self.maximum,
+        }
+
+
+    def clear(self):
+        self.counts = array("Q", bytes(8 * (len(self.bounds) + 1)))
+        self.count = 0
+        self.total = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+
+
+class LatencyTracer:
+
+    # Spans reported for every completed beat, (name, from stage, to stage)
+    SPANS = (
+        ("notify_to_bpm_update", NOTIFY, BPM_UPDATE),
+        ("bpm_update_to_beat_start", BPM_UPDATE, BEAT_START),
+        ("beat_start_to_r_peak", BEAT_START, R_PEAK),
+        ("r_peak_to_click_dispatch", R_PEAK, CLICK_DISPATCH),
+        ("click_dispatch_to_click_done", CLICK_DISPATCH, CLICK_DONE),
+        ("r_peak_to_click_done", R_PEAK, CLICK_DONE),
+        ("notify_to_click_done", NOTIFY, CLICK_DONE),
+    )
+
+    is_enabled = True
+    clock = None
+
+    completed_beat_count = 0
+
+
+    def __init__(self, clock=monotonic, is_enabled=True):
+        self.clock = clock
+        self.is_enabled = is_enabled
+
+        # Latest timestamp of every stage, and the stages of the beat in flight
+        self.latest = [None] * len(STAGE_NAMES)
+        self.beat = [None] * len(STAGE_NAMES)
+
+        self.histograms = {name: LatencyHistogram() for name, _, _ in self.SPANS}
+
+
+    # Records that `stage` happened now, or at `timestamp`
+    def mark(self, stage, timestamp=None):
+        if not self.is_enabled:
+            return
+
+        now = self.clock() if timestamp is None else timestamp
+        self.latest[stage] = now
+
+        if stage == BEAT_START:
+            # A new beat starts from whatever reading is current
+            latest = self.latest
+            self.beat = [latest[NOTIFY], latest[BPM_UPDATE], now, None, None, None]
+        elif stage > BEAT_START:
+            self.beat[stage] = now
+            if stage == CLICK_DONE:
+                self.complete_beat()
+
+
+    def complete_beat(self):
+        beat = self.beat
+        for name, start_stage, end_stage in self.SPANS:
+            started_at = beat[start_stage]
+            ended_at = beat[end_stage]
+            if started_at is not None and ended_at is not None:
+                self.histograms[name].record(ended_at - started_at)
+
+        self.completed_beat_count += 1
+        self.beat = [None] * len(STAGE_NAMES)
+
+
+    # Percentile summaries of every span, in milliseconds
+    def report(self):
+        return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+
+    def format_report(self):
+        lines = [f"Latency over {self.completed_beat_count} beats (ms):"]
+        for name, summary in self.report().items():
+            lines.append(
+                f"  {name:<30} n={summary['count']:<6} p50={summary['p50_ms']:8.2f} "
+                f"p90={summary['p90_ms']:8.2f} p99={summary['p99_ms']:8.2f} max={summary['max_ms']:8.2f}"
+            )
+        return "\n".join(lines)
+
+
+    # Writes the report and raw bucket counts as JSON, returns the path written
+    def dump(self, path=None):
+        if path is None:
+            path = os_path.join(TRACES_DIRECTORY, f"trace-{datetime.now():%Y%m%d-%H%M%S}.json")
+        makedirs(os_path.dirname(os_path.abspath(path)), exist_ok=True)
+
+        trace = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "completed_beats": self.completed_beat_count,
+            "bucket_bounds_seconds": LatencyHistogram.bounds,
+            "spans": {
+                name: dict(histogram.summary(), buckets=list(histogram.counts))
+                for name, histogram in self.histograms.items()
+            },
+        }
+        with open(path, "w", encoding="utf-8") as trace_file:
+            json.dump(trace, trace_file)
+        return path
+
+
+    def clear(self):
+        for histogram in self.histograms.values():
+            histogram.clear()
+        self.latest = [None] * len(STAGE_NAMES)
+        self.beat = [None] * len(STAGE_NAMES)
+        self.completed_beat_count = 0
@@ -0,0 +1,303 @@
+from array import array
+from bisect import bisect_left
+from threading import local, Lock, Thread
+
+
+'''
+In-process metrics, served as Prometheus text on a loopback-only HTTP endpoint
+
+Counters and histograms are sharded per thread: each thread increments its own
+cell, created under a lock the first time that thread touches the metric, so the
+hot path takes no lock and never contends. A scrape sums the shards.
+Values the app already counts (notifications, beats, clicks) are exposed through
+callbacks read at scrape time, and the log-bucketed latency histograms of the tracer
+and the dispatcher as quantile summaries, so they add nothing to the hot path.
+
+    registry = MetricsRegistry()
+    frames = registry.histogram("frame_seconds", "Time to apply a frame", FRAME_TIME_BUCKETS)
+    frames.observe(0.004)
+    MetricsServer(registry).start()    # http://127.0.0.1:9464/metrics
+'''
+
+# Bucket upper bounds, in seconds
+DRIFT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+FRAME_TIME_BUCKETS = (0.001, 0.002, 0.004, 0.008, 0.016, 0.033, 0.05, 0.1)
+
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+METRICS_PORT = 9464
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost")
+
+
+class Counter:
+
+    kind = "counter"
+
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.local = local()
+        self.lock = Lock()
+
+        # One single-element list per thread that ever incremented the counter
+        self.shards = []
+
+
+    def inc(self, amount=1):
+        try:
+            self.local.cell[0] += amount
+        except AttributeError:
+            cell = self.local.cell = [amount]
+            with self.lock:
+                self.shards.append(cell)
+
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in self.shards)
+
+
+    def samples(self):
+        yield self.name, "", self.value
+
+
+'''
+Histogram with fixed bucket bounds, in the Prometheus sense
+
+A shard is an array of per-bucket counts plus the running sum; observing a value
+is a bisect and two increments on the calling thread's shard.
+'''
+class Histogram:
+
+    kind = "histogram"
+
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.bounds = tuple(sorted(buckets))
+        self.local = local()
+        self.lock = Lock()
+        self.shards = []
+
+
+    def observe(self, value):
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            # One extra bucket catches everything above the last bound, the last element is the sum
+            shard = self.local.shard = array("d", bytes(8 * (len(self.bounds) + 2)))
+            with self.lock:
+                self.shards.append(shard)
+
+        shard[bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+
+    # Per-bucket counts, the overflow bucket last, and the sum over every shard
+    def totals(self):
+        counts = [0] * (len(self.bounds) + 1)
+        total = 0.0
+        for shard in self.shards:
+            for i in range(len(counts)):
+                counts[i] += int(shard[i])
+            total += shard[-1]
+        return counts, total
+
+
+    def samples(self):
+        counts, total = self.totals()
+        cumulative = 0
+        for bound, count in zip(self.bounds, counts):
+            cumulative += count
+            yield f"{self.name}_bucket", f'{{le="{bound:g}"}}', cumulative
+        cumulative += counts[-1]
+        yield f"{self.name}_bucket", '{le="+Inf"}', cumulative
+        yield f"{self.name}_sum", "", total
+        yield f"{self.name}_count", "", cumulative
+
+
+# A counter or gauge whose value is read from func() at scrape time
+class CallbackMetric:
+
+    def __init__(self, name, help_text, kind, func):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.func = func
+
+
+    def samples(self):
+        value = self.func()
+        if value is not None:
+            yield self.name, "", value
+
+
+# Quantiles of a latency_tracer.LatencyHistogram returned by func(), read at scrape time
+class LatencySummary:
+
+    kind = "summary"
+
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+
+
+    def samples(self):
+        histogram = self.func()
+        if histogram is None:
+            return
+        for quantile in SUMMARY_QUANTILES:
+            yield self.name, f'{{quantile="{quantile:g}"}}', histogram.percentile(quantile)
+        yield f"{self.name}_sum", "", histogram.total
+        yield f"{self.name}_count", "", histogram.count
+
+
+class MetricsRegistry:
+
+    # Prepended to every metric name
+    namespace = "i_heart_clicking"
+
+
+    def __init__(self, namespace=None):
+        self.namespace = namespace or self.namespace
+        self.metrics = {}
+        self.lock = Lock()
+
+
+    def counter(self, name, help_text):
+        return self.register(Counter(self.full_name(name), help_text))
+
+
+    def histogram(self, name, help_text, buckets):
+        return self.register(Histogram(self.full_name(name), help_text, buckets))
+
+
+    # Exposes a count kept elsewhere, func() must only ever grow
+    def counter_callback(self, name, help_text, func):
+        return self.register(CallbackMetric(self.full_name(name), help_text, "counter", func))
+
+
+    def gauge(self, name, help_text, func):
+        return self.register(CallbackMetric(self.full_name(name), help_text, "gauge", func))
+
+
+    def latency_summary(self, name, help_text, func):
+        return self.register(LatencySummary(self.full_name(name), help_text, func))
+
+
+    # Prometheus text exposition format, version 0.0.4
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"Could not collect metric {metric.name}:\n{e}")
+                continue
+
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {value!r}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def full_name(self, name):
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name!r} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+
+'''
+Serves a registry at http://127.0.0.1:<port>/metrics
+
+Binds to the loopback interface only, the metrics are for watching a local session,
+not for the network. http.server is imported in start(), off the startup path.
+'''
+class MetricsServer:
+
+    registry = None
+    host = "127.0.0.1"
+    port = METRICS_PORT
+
+    server = None
+    thread = None
+
+
+    def __init__(self, registry, port=None, host=None):
+        host = host or self.host
+        if host not in LOOPBACK_HOSTS:
+            raise ValueError(f"The metrics endpoint only binds to loopback, not {host!r}")
+
+        self.registry = registry
+        self.host = host
+        self.port = self.port if port is None else port
+
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/metrics"
+
+
+    def start(self):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        registry = self.registry
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+            # Scrapes are not worth a line on stderr each
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+
+        # Port 0 picks a free port
+        self.port = self.server.server_address[1]
+
+        self.thread = Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+        print(f"Serving metrics on {self.url}")
+
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
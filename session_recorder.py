@@ -0,0 +1,251 @@
+import mmap
+
+from asyncio import sleep as async_sleep, get_running_loop, CancelledError
+from simulated_peripheral import SimulatedTransport, SimulatedHeartRatePeripheral
+from event_log import events
+from os import path as os_path, makedirs
+from datetime import datetime
+from struct import Struct
+from time import monotonic
+
+
+'''
+Session recording and replay of raw heart rate notifications
+
+A recording is a small header followed by fixed-size records:
+
+    header  8s magic, uint16 record size, 6 reserved bytes
+    record  float64 monotonic timestamp, uint8 payload length, 23-byte payload
+
+Fixed-size records make the log trivially seekable and let the replay
+read it through a memory map without parsing or copying anything up front.
+23 bytes covers any 0x2A37 notification that fits the default BLE MTU.
+'''
+
+MAGIC = b"IHCREC01"
+HEADER = Struct("<8sH6x")
+RECORD = Struct("<dB23s")
+MAX_PAYLOAD_SIZE = 23
+
+SESSIONS_DIRECTORY = os_path.join(os_path.expanduser("~"), ".i_heart_clicking", "sessions")
+
+
+# Returns a timestamped path for a new recording
+def new_session_path(directory=SESSIONS_DIRECTORY):
+    return os_path.join(directory, f"session-{datetime.now():%Y%m%d-%H%M%S}.ihcrec")
+
+
+'''
+Appends raw notification payloads to a recording
+
+Writes go through a buffered file, flushed every FLUSH_EVERY records,
+so recording costs one struct pack and a memory copy per notification.
+'''
+class SessionRecorder:
+
+    FLUSH_EVERY = 64
+
+    path = None
+    record_count = 0
+    truncated_count = 0
+
+
+    def __init__(self, path):
+        self.path = path
+        makedirs(os_path.dirname(os_path.abspath(path)), exist_ok=True)
+
+        is_new_file = not os_path.exists(path) or os_path.getsize(path) == 0
+        if not is_new_file:
+            self.check_appendable(path)
+
+        self.file = open(path, "ab")
+        if is_new_file:
+            self.file.write(HEADER.pack(MAGIC, RECORD.size))
+
+
+    # Appends one payload, payloads longer than MAX_PAYLOAD_SIZE are truncated and counted
+    def record(self, data, timestamp=None):
+        length = len(data)
+        if length > MAX_PAYLOAD_SIZE:
+            self.truncated_count += 1
+            length = MAX_PAYLOAD_SIZE
+            data = bytes(data[:MAX_PAYLOAD_SIZE])
+
+        self.file.write(RECORD.pack(monotonic() if timestamp is None else timestamp, length, bytes(data)))
+        self.record_count += 1
+
+        if self.record_count % self.FLUSH_EVERY == 0:
+            self.file.flush()
+
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    # Only appends to a recording with the same record layout that ends on a whole record
+    def check_appendable(self, path):
+        with open(path, "rb") as existing_file:
+            header = existing_file.read(HEADER.size)
+
+        if (
+            len(header) < HEADER.size
+            or HEADER.unpack(header) != (MAGIC, RECORD.size)
+            or (os_path.getsize(path) - HEADER.size) % RECORD.size
+        ):
+            raise ValueError(f"{path} is not a session recording that can be appended to")
+
+
+'''
+Replays a recording through a notification handler
+
+The log is memory-mapped, so even multi-hour sessions open instantly and are
+only paged in as they are read. Payloads are handed out as memoryview slices of the map.
+'''
+class SessionReplay:
+
+    path = None
+    record_count = 0
+
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, record_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a session recording")
+
+        self.record_count = (len(self.map) - HEADER.size) // RECORD.size
+
+
+    def __len__(self):
+        return self.record_count
+
+
+    def __iter__(self):
+        return self.records()
+
+
+    # Yields (timestamp, payload memoryview) for every record from index `start` on
+    def records(self, start=0):
+        view = self.view
+        unpack_from = RECORD.unpack_from
+        payload_offset = RECORD.size - MAX_PAYLOAD_SIZE
+
+        for offset in range(HEADER.size + start * RECORD.size, HEADER.size + self.record_count * RECORD.size, RECORD.size):
+            timestamp, length, _ = unpack_from(view, offset)
+            yield timestamp, view[offset + payload_offset:offset + payload_offset + length]
+
+
+    # Every payload, for the batch parser
+    def payloads(self):
+        return (payload for _, payload in self)
+
+
+    # Feeds every payload to handler(sender, data) as fast as possible, returns the count
+    def replay_now(self, handler, sender=None):
+        count = 0
+        for _, payload in self:
+            handler(sender, bytearray(payload))
+            count += 1
+        return count
+
+
+    # Feeds every payload from record `start` on to handler(sender, data) paced by the recorded timestamps
+    # speed 2.0 replays twice as fast, speed 0 does not wait at all
+    async def replay(self, handler, speed=1.0, sender=None, clock=monotonic, start=0):
+        first_timestamp = None
+        started_at = clock()
+        count = 0
+
+        for timestamp, payload in self.records(start):
+            if first_timestamp is None:
+                first_timestamp = timestamp
+
+            if speed > 0:
+                # Absolute deadlines, so handler time does not accumulate as drift
+                due_at = started_at + (timestamp - first_timestamp) / speed
+                delay = due_at - clock()
+                if delay > 0:
+                    await async_sleep(delay)
+
+            handler(sender, bytearray(payload))
+            count += 1
+
+        return count
+
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+# A strap replaying a recording, notifications resume where the previous connection left off
+class ReplayPeripheral(SimulatedHeartRatePeripheral):
+
+    def on_payload(self, callback):
+        def handler(sender, data):
+            self.transport.position += 1
+            callback(sender, data)
+        return handler
+
+
+    async def _notify(self, callback):
+        transport = self.transport
+        try:
+            await transport.replay.replay(
+                self.on_payload(callback),
+                speed=transport.speed,
+                sender=self.characteristic,
+                clock=transport.clock or get_running_loop().time,
+                start=transport.position,
+            )
+            events.info("replay_finished", path=transport.replay.path, records=transport.position)
+        except CancelledError:
+            pass
+
+
+'''
+Transport replaying a recorded session in place of a strap
+
+Recorded payloads reach the controller's notification handler, and through it the
+pipeline, exactly as they arrived from the strap, paced by their recorded timestamps.
+Like the simulated strap it is not persistent: nothing replayed is cached or recorded again.
+'''
+class ReplayTransport(SimulatedTransport):
+
+    ADDRESS = "RE:PL:AY:ED:00:01"
+    NAME = "Replayed Session"
+
+    speed = 1.0
+
+    # Index of the next record to replay
+    position = 0
+
+
+    def __init__(self, path, speed=None, clock=None):
+        super().__init__(clock=clock)
+        self.replay = SessionReplay(path)
+        self.speed = self.speed if speed is None else speed
+
+
+    def create_client(self, address, disconnected_callback=None, **connection_parameters):
+        client = ReplayPeripheral(self, address, disconnected_callback)
+        self.clients.append(client)
+        return client
+
+
+    def close(self):
+        self.replay.close()
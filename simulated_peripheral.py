@@ -0,0 +1,320 @@
+from asyncio import create_task, sleep, get_running_loop, CancelledError
+from heart_rate_parser import encode_heart_rate_measurement, RR_INTERVAL_UNITS_PER_SECOND
+from bluetooth_controller import HEART_RATE_SERVICE_UUID, HEART_RATE_CHAR_UUID
+from random import Random
+from math import sin, pi
+
+
+'''
+Local stand-in for a Bluetooth heart rate strap
+
+Emits byte-exact Heart Rate Measurement (0x2A37) notifications, RR intervals included,
+following a BPM profile at a configurable notification rate.
+Latency and disconnects can be injected to exercise the reconnect path.
+Lets the whole connect -> notify -> EKG -> click pipeline run without Bluetooth hardware.
+'''
+
+# The UUIDs are the controller's, so the simulated strap always answers what it looks up
+HEART_RATE_CHAR_HANDLE = 0x000E
+
+
+# # # # # # # # #
+#
+#  BPM Profiles
+#
+#  A profile is a callable taking the seconds since the session started and returning a BPM
+#
+# # # # # # # # #
+
+
+def constant_profile(bpm):
+    return lambda elapsed: bpm
+
+
+# Moves linearly from start_bpm to end_bpm, then holds end_bpm
+def ramp_profile(start_bpm, end_bpm, duration):
+    return lambda elapsed: start_bpm + (end_bpm - start_bpm) * min(1.0, elapsed / duration)
+
+
+# Alternates smoothly between low_bpm and high_bpm, like interval training
+def interval_profile(low_bpm, high_bpm, period):
+    middle = (low_bpm + high_bpm) / 2
+    amplitude = (high_bpm - low_bpm) / 2
+    return lambda elapsed: middle - amplitude * sin(2 * pi * elapsed / period)
+
+
+# Random walk between low_bpm and high_bpm, changing by up to `step` per second
+def random_walk_profile(start_bpm, low_bpm=60, high_bpm=180, step=3, seed=None):
+    rng = Random(seed)
+    state = {"bpm": start_bpm, "second": 0}
+
+    def profile(elapsed):
+        while state["second"] < int(elapsed):
+            state["bpm"] = min(high_bpm, max(low_bpm, state["bpm"] + rng.uniform(-step, step)))
+            state["second"] += 1
+        return state["bpm"]
+
+    return profile
+
+
+# Minimal GATT objects matching what BluetoothController looks up
+class SimulatedCharacteristic:
+
+    def __init__(self, uuid, handle):
+        self.uuid = uuid
+        self.handle = handle
+
+
+class SimulatedService:
+
+    def __init__(self, uuid, characteristics):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+
+    def get_characteristic(self, uuid):
+        for characteristic in self.characteristics:
+            if characteristic.uuid == uuid.lower():
+                return characteristic
+        return None
+
+
+class SimulatedServices:
+
+    def __init__(self, services):
+        self.services = services
+
+
+    def __iter__(self):
+        return iter(self.services)
+
+
+    def get_service(self, uuid):
+        for service in self.services:
+            if service.uuid == uuid.lower():
+                return service
+        return None
+
+
+    # By handle, like BleakGATTServiceCollection
+    def get_characteristic(self, handle):
+        for service in self.services:
+            for characteristic in service.characteristics:
+                if characteristic.handle == handle:
+                    return characteristic
+        return None
+
+
+'''
+A simulated strap, used in place of a BleakClient
+
+Every notification carries the current BPM and the RR intervals of the beats
+that completed since the previous notification, exactly as a strap would send them.
+'''
+class SimulatedHeartRatePeripheral:
+
+    address = None
+    disconnected_callback = None
+    transport = None
+
+    is_connected = False
+    notify_task = None
+
+
+    def __init__(self, transport, address, disconnected_callback=None):
+        self.transport = transport
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+
+        characteristic = SimulatedCharacteristic(HEART_RATE_CHAR_UUID, HEART_RATE_CHAR_HANDLE)
+        self.services = SimulatedServices([SimulatedService(HEART_RATE_SERVICE_UUID, [characteristic])])
+        self.characteristic = characteristic
+
+
+    async def connect(self, **kwargs):
+        await sleep(self.transport.connect_latency)
+        if self.transport.take_connect_failure():
+            raise OSError(f"Simulated connection failure to {self.address}")
+        self.is_connected = True
+        return True
+
+
+    async def disconnect(self):
+        self._cancel_notifications()
+        self.is_connected = False
+        return True
+
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        if not self.is_connected:
+            raise OSError("Simulated peripheral is not connected")
+        self._cancel_notifications()
+        self.notify_task = create_task(self._notify(callback))
+
+
+    async def stop_notify(self, char_specifier):
+        self._cancel_notifications()
+
+
+    # Drops the connection as if the strap went out of range
+    def inject_disconnect(self):
+        if not self.is_connected:
+            return
+        self._cancel_notifications()
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    async def _notify(self, callback):
+        transport = self.transport
+        interval = 1 / transport.notification_rate
+        clock = transport.clock or get_running_loop().time
+        next_notification = clock()
+
+        try:
+            while self.is_connected:
+                next_notification += interval
+                await sleep(max(0, next_notification - clock()))
+
+                if transport.take_disconnect(clock()):
+                    self.inject_disconnect()
+                    return
+
+                payload = transport.next_payload(clock())
+
+                latency = transport.next_latency()
+                if latency:
+                    await sleep(latency)
+
+                if self.is_connected:
+                    callback(self.characteristic, bytearray(payload))
+        except CancelledError:
+            pass
+
+
+    def _cancel_notifications(self):
+        if self.notify_task is not None and not self.notify_task.done():
+            self.notify_task.cancel()
+        self.notify_task = None
+
+
+'''
+Transport creating simulated peripherals instead of Bleak clients
+
+The BPM profile and beat timing live on the transport, so a reconnect
+resumes the same session rather than starting the profile over.
+Time comes from `clock`, by default the running event loop's time(); a custom
+clock must tick with the loop, since notifications are paced with asyncio.sleep().
+'''
+class SimulatedTransport:
+
+    ADDRESS = "SI:MU:LA:TE:D0:01"
+    NAME = "Simulated Strap"
+
+    # Simulated devices must not end up in the real device cache
+    is_persistent = False
+
+    notification_rate = 1.0
+    connect_latency = 0.05
+
+    # Notification delivery delay, in seconds, plus uniform random jitter
+    latency = 0.0
+    latency_jitter = 0.0
+
+    include_rr_intervals = True
+    include_energy_expended = False
+
+    # Remaining connection attempts that will fail
+    connect_failures = 0
+
+    # Seconds between injected disconnects, None never disconnects
+    disconnect_interval = None
+
+    clock = None
+    started_at = None
+    next_disconnect_at = None
+    last_beat_at = None
+    energy_expended = 0.0
+
+
+    def __init__(self, profile=None, notification_rate=None, latency=None, latency_jitter=None,
+                 disconnect_interval=None, connect_failures=0, include_rr_intervals=True,
+                 include_energy_expended=False, seed=None, clock=None):
+        self.profile = profile or random_walk_profile(120, seed=seed)
+        self.notification_rate = notification_rate or self.notification_rate
+        self.latency = latency or self.latency
+        self.latency_jitter = latency_jitter or self.latency_jitter
+        self.disconnect_interval = disconnect_interval
+        self.connect_failures = connect_failures
+        self.include_rr_intervals = include_rr_intervals
+        self.include_energy_expended = include_energy_expended
+        self.rng = Random(seed)
+        self.clock = clock
+        self.clients = []
+
+
+    def create_client(self, address, disconnected_callback=None, **connection_parameters):
+        client = SimulatedHeartRatePeripheral(self, address, disconnected_callback)
+        self.clients.append(client)
+        return client
+
+
+    # Builds the next 0x2A37 payload at time `now`
+    def next_payload(self, now):
+        if self.started_at is None:
+            self.started_at = now
+            self.last_beat_at = now
+
+        bpm = max(1, int(round(self.profile(now - self.started_at))))
+
+        # Emit an RR interval for every beat that completed since the last notification
+        rr_intervals = []
+        beat_seconds = 60 / bpm
+        while self.last_beat_at + beat_seconds <= now:
+            self.last_beat_at += beat_seconds
+            rr_intervals.append(int(round(beat_seconds * RR_INTERVAL_UNITS_PER_SECOND)))
+
+        energy = None
+        if self.include_energy_expended:
+            # Roughly 0.1 kJ per beat is plenty for a plausible counter
+            self.energy_expended += len(rr_intervals) * 0.1
+            energy = int(self.energy_expended) & 0xFFFF
+
+        return encode_heart_rate_measurement(
+            bpm,
+            energy_expended=energy,
+            rr_intervals=tuple(rr_intervals) if self.include_rr_intervals else (),
+            sensor_contact=True,
+        )
+
+
+    def next_latency(self):
+        return self.latency + self.rng.uniform(0, self.latency_jitter)
+
+
+    def take_connect_failure(self):
+        if self.connect_failures > 0:
+            self.connect_failures -= 1
+            return True
+        return False
+
+
+    # Returns True when a disconnect is due at time `now`
+    def take_disconnect(self, now):
+        if self.disconnect_interval is None:
+            return False
+        if self.next_disconnect_at is None:
+            self.next_disconnect_at = now + self.disconnect_interval
+            return False
+        if now >= self.next_disconnect_at:
+            self.next_disconnect_at = now + self.disconnect_interval
+            return True
+        return False
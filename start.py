@@ -6,20 +6,67 @@ import asyncio
 
 from bluetooth_device_list import BluetoothDeviceList
 from bluetooth_controller import BluetoothController
-from random import randint, random
-from keyboard import add_hotkey
-from PIL import Image, ImageTk
+from device_session import MultiDeviceController
+from device_grid import DeviceGridUI
+from simulated_peripheral import SimulatedTransport
+from heart_pipeline import HeartPipeline
+from bpm_filter import BPMFilter
+from bpm_broadcast import BPMBroadcaster
+from ekg_renderer import EKGRenderer
+from session_recorder import SessionRecorder, ReplayTransport, new_session_path
+from heartbeat_audio import HeartbeatAudio
+from heart_sprites import HeartSpriteCache
+from ekg_strip import ScrollingEKGStrip
+from action_dispatcher import ActionDispatcher, ClickAction
+from ui_scheduler import UIUpdateQueue, UIFrameCoalescer, TkAsyncioScheduler
+from startup import StagedStartup
+from metrics import MetricsRegistry, MetricsServer
+from event_log import events
 from os import path as os_path
 from tkinter.font import Font
 from threading import Thread
-from pyautogui import click
-from pygame import mixer
-from time import time
 
 
 CANCEL_BUTTON = "esc"
+
+# Prints the latency report and writes it to ~/.i_heart_clicking/traces
+TRACE_DUMP_BUTTON = "f9"
+
+# Uses a simulated heart rate strap instead of Bluetooth hardware
 DEBUG = False
 
+# Records every raw heart rate notification so sessions can be replayed later
+# Only sessions from a real strap are recorded, never simulated (DEBUG) or replayed ones
+RECORD_SESSIONS = True
+
+# Replays a recording in place of a strap, through the same handler and pipeline, e.g.
+# "~/.i_heart_clicking/sessions/session-20240101-120000.ihcrec"
+REPLAY_SESSION = None
+REPLAY_SPEED = 1.0
+
+# What happens at each phase of every beat, see ekg_synth.BEAT_PHASES
+# e.g. {"r_peak": [ClickAction()], "t_wave": [KeyPressAction("space")]}
+BEAT_ACTIONS = {
+    "r_peak": [ClickAction()],
+}
+
+# Smoothing of the BPM readings after outlier rejection: "ema", "kalman" or None
+BPM_SMOOTHER = "ema"
+
+# Extra straps monitored side by side in a grid window, e.g. ["AA:BB:CC:DD:EE:FF"]
+# In DEBUG this many simulated straps are added instead
+MULTI_DEVICE_ADDRESSES = []
+MULTI_DEVICE_COLUMNS = 2
+
+# Shares the BPM stream with other local processes through shared memory, see bpm_broadcast.BPMReader
+BROADCAST_BPM = True
+
+# Serves counters and histograms as Prometheus text on http://127.0.0.1:<port>/metrics, None turns it off
+METRICS_PORT = 9464
+
+# Runs Tk and a single asyncio loop on one thread instead of two event-loop threads
+SINGLE_THREADED = True
+
 
 class NotABotUI:
 
@@ -30,30 +77,76 @@ class NotABotUI:
     # Application Logic
     bluetooth_device_list = None
     bluetooth_controller = None
+    multi_device_controller = None
+    device_grid = None
     bluetooth_loop = None
     ekg_loop = None
-    current_bpm = 0
+    pipeline = None
+    bpm_broadcaster = None
+    metrics_server = None
+    session_recorder = None
 
     is_closing_application = False
     is_running = False # Used for development/debug purposes
-    bpm_data = []
     ekg_data = []
     threads = []  # List to keep track of threads
     tasks = []  # List to keep track of asyncio tasks
 
+    # Beats begun by the pipeline, and the one the sweep trace is showing
+    beat_number = 0
+    drawn_beat_number = None
+
     # Application Variables
     START_TEXT = f"Start ({CANCEL_BUTTON})"
     STOP_TEXT = f"Stop ({CANCEL_BUTTON})"
+
+    # Seconds the grid straps get to disconnect when the application closes
+    DEVICE_STOP_TIMEOUT = 3
     bluetooth_device_verbiage = "Bluetooth Device:\n"
 
 
-    def __init__(self, root, bluetooth_loop, ekg_loop, heart_beat_loop):
+    def __init__(self, root, bluetooth_loop, ekg_loop):
         self.root = root
         self.bluetooth_loop = bluetooth_loop
         self.ekg_loop = ekg_loop
-        self.heart_beat_loop = heart_beat_loop
 
-        self.bluetooth_controller = BluetoothController(self, self.bluetooth_loop)
+        # Counters and histograms of every part of the app, scraped through the metrics endpoint
+        self.metrics = MetricsRegistry()
+        events.register_metrics(self.metrics)
+
+        # Widget updates coming from other threads are marshalled through this queue
+        self.ui_queue = UIUpdateQueue(root)
+
+        # High-rate display state (BPM text, heart frame, trace) is applied once per frame
+        self.ui_frames = UIFrameCoalescer(root, self.ui_queue)
+        self.ui_frames.register_metrics(self.metrics)
+
+        # Fires the clicks at their deadlines from its own thread
+        self.action_dispatcher = ActionDispatcher()
+        self.action_dispatcher.start()
+
+        # Headless BPM -> beat scheduling -> actions pipeline, this window is its renderer
+        self.pipeline = HeartPipeline(
+            renderer=self,
+            on_heartbeat_sound=self.play_heartbeat_sound,
+            on_r_peak=self.play_click_sound,
+            on_no_bpm=lambda: self.run_on_ui(self.toggle_start_stop),
+            dispatcher=self.action_dispatcher,
+            beat_actions=BEAT_ACTIONS,
+            bpm_filter=BPMFilter(smoother=BPM_SMOOTHER),
+            metrics=self.metrics,
+        )
+        self.action_dispatcher.tracer = self.pipeline.tracer
+        self.action_dispatcher.register_metrics(self.metrics)
+
+        if REPLAY_SESSION:
+            transport = ReplayTransport(os_path.expanduser(REPLAY_SESSION), REPLAY_SPEED)
+        elif DEBUG:
+            transport = SimulatedTransport()
+        else:
+            transport = None
+        self.bluetooth_controller = BluetoothController(self, self.bluetooth_loop, transport)
+        self.bluetooth_controller.register_metrics(self.metrics)
         self.bluetooth_device_list = BluetoothDeviceList(self, self.bluetooth_loop, self.bluetooth_controller)
         
         # Make a custom font
@@ -70,20 +163,65 @@ class NotABotUI:
         #  asyncio.run_coroutine_threadsafe(async_function(), self.bluetooth_loop)
         self.create_ui(root)
 
-        # Listeners
-        self.listen_for_toggle()
+        # Sound Logic, decoded in the background so the window shows right away
+        self.heartbeat_audio = HeartbeatAudio(self.resource_path)
+
+        # Heavy imports and initialisation run in the background once the window is up
+        self.startup = StagedStartup(self.ui_queue)
+        self.startup.add("sprites", self.heart_sprites.load_images)
+        self.startup.add("hotkeys", self.listen_for_toggle)
+        self.startup.add("actions", self.prepare_beat_actions)
+        self.startup.add("audio", self.load_audio)
+        self.startup.add("bluetooth", self.load_bluetooth)
+        if BROADCAST_BPM:
+            self.startup.add("broadcast", self.open_bpm_broadcast)
+        if METRICS_PORT is not None:
+            self.startup.add("metrics", self.start_metrics_server)
+
+        self.startup.when_ready("sprites", self.show_heart)
+        self.startup.when_all_finished(lambda: print(self.startup.format_report()))
+        self.root.after_idle(self.startup.mark_window_shown)
+
+        # Reconnect to the last used device without a manual scan
+        if REPLAY_SESSION or DEBUG:
+            self.bluetooth_controller.selected_device_address = transport.ADDRESS
+            self.bluetooth_controller.selected_device_name = transport.NAME
+            asyncio.run_coroutine_threadsafe(self.bluetooth_controller.connect_bluetooth(), self.bluetooth_loop)
+        else:
+            self.startup.when_ready("bluetooth", lambda: asyncio.run_coroutine_threadsafe(self.bluetooth_controller.auto_connect(), self.bluetooth_loop))
+
+        if MULTI_DEVICE_ADDRESSES:
+            self.create_device_grid()
+
+        self.startup.start()
+
 
-        # Sound Logic
-        mixer.init()
-        self.click_sound = mixer.Sound(self.resource_path("sounds/single-dull-mouse-click.mp3"))
-        self.heart_beat_sound_50_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-50-bpm.mp3"))
-        self.heart_beat_sound_60_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-60-bpm.mp3"))
-        self.heart_beat_sound_70_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-70-bpm.mp3"))
-        self.heart_beat_sound_80_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-80-bpm.mp3"))
-        self.heart_beat_sound_90_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-90-bpm.mp3"))
-        self.heart_beat_sound_100_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-100-bpm.mp3"))
-        self.heart_beat_sound_110_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-110-bpm.mp3"))
-        self.heart_beat_sound_120_bpm = mixer.Sound(self.resource_path("sounds/single-dull-heartbeat-120-bpm.mp3"))
+    # Monitors MULTI_DEVICE_ADDRESSES on the Bluetooth loop, each in a pane of its own window
+    def create_device_grid(self):
+        self.multi_device_controller = MultiDeviceController(
+            self.bluetooth_loop, self.bluetooth_controller.transport, self.bluetooth_controller.device_cache,
+        )
+
+        window = tk.Toplevel(self.root)
+        window.title("Devices")
+        window.config(bg=ui.background_color)
+        window.protocol("WM_DELETE_WINDOW", window.withdraw)
+
+        self.device_grid = DeviceGridUI(window, self.multi_device_controller, MULTI_DEVICE_COLUMNS)
+        self.device_grid.frame.pack(padx=5, pady=5)
+        self.device_grid.start()
+
+        if DEBUG:
+            # One simulated strap per pane, each on its own BPM walk
+            for i, _ in enumerate(MULTI_DEVICE_ADDRESSES):
+                self.multi_device_controller.add_device(
+                    f"SI:MU:LA:TE:D1:{i:02X}", f"Simulated Strap {i + 1}", SimulatedTransport(seed=i),
+                )
+        else:
+            def add_devices():
+                for address in MULTI_DEVICE_ADDRESSES:
+                    self.multi_device_controller.add_device(address)
+            self.startup.when_ready("bluetooth", add_devices)
 
 
     def create_ui(self, root):
@@ -98,33 +236,30 @@ class NotABotUI:
 
         self.root.iconbitmap(icon_path)
         self.root.iconbitmap(default=icon_path)
-        icon_img = ImageTk.PhotoImage(file=png_path)
-        self.root.iconphoto(True, icon_img)
+        self.icon_image = tk.PhotoImage(file=png_path)
+        self.root.iconphoto(True, self.icon_image)
 
         # Create a frame to center the elements
         self.frame = tk.Frame(root)
         self.frame.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
         self.frame.config(bg=ui.foreground_color)
 
-        # Heart and EKG content
-        original_heart_image = Image.open(png_path)
-        self.small_heart_image = original_heart_image.resize((150, 150), Image.NEAREST)
-        self.big_heart_image = original_heart_image.resize((160, 160), Image.NEAREST)
-        self.is_big_heart = True
+        # Heart and EKG content, the pulse frames are loaded during startup and shown once ready
+        self.heart_sprites = HeartSpriteCache(png_path)
+        self.heart_frame_index = 0
 
         # Fixed frame for the heart to prevent window re-sizing
         self.heart_frame = tk.Frame(self.frame, width=160, height=160, bg=ui.foreground_color)
         self.heart_frame.grid(row=0, columnspan=3, padx=10, pady=0)
         self.heart_frame.grid_propagate(False)
 
-        self.heart_image = ImageTk.PhotoImage(self.big_heart_image)
-        self.heart_label = tk.Label(self.heart_frame, image=self.heart_image, bg=ui.foreground_color)
+        self.heart_label = tk.Label(self.heart_frame, bg=ui.foreground_color)
         self.heart_label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)  # Center in the frame
 
         # BPM Display Label
         self.bpm_label = tk.Label(
             self.frame,
-            text=f"BPM: {self.current_bpm}",
+            text=f"BPM: {self.pipeline.current_bpm}",
             bg=ui.foreground_color,
             font=(ui.font, ui.lg_font)
         )
@@ -133,11 +268,14 @@ class NotABotUI:
         # EKG Canvas
         self.ekg_canvas = tk.Canvas(
             self.frame, 
-            width=240, 
-            height=160, 
+            width=ui.ekg_canvas_width, 
+            height=ui.ekg_canvas_height, 
             bg=ui.graph_background_color
         )
         self.ekg_canvas.grid(row=2, columnspan=3, padx=10, pady=0)
+        self.ekg_renderer = EKGRenderer(self.ekg_canvas)
+        self.ekg_strip = ScrollingEKGStrip(self.ekg_canvas)
+        self.is_strip_mode = ui.ekg_display_mode == "strip"
         self.ekg_data = []
 
 
@@ -160,14 +298,15 @@ class NotABotUI:
 
     # Start and stop button control
     def toggle_start_stop(self):
+        # Stopping always works, even while the strap is reconnecting
+        if self.is_running:
+            self.stop_actions()
+
         # When there is no Bluetooth device connected, open the Bluetooth device list
-        if not self.bluetooth_controller.is_bluetooth_device_connected and not DEBUG:
+        elif not self.bluetooth_controller.is_bluetooth_device_connected:
             print("No Bluetooth device connected. Please connect a device first.")
             self.bluetooth_device_list.open_bluetooth_devices()
 
-        elif self.is_running:
-            self.stop_actions()
-        
         else:
             self.start_actions()
     
@@ -177,6 +316,7 @@ class NotABotUI:
         self.is_running = False
         self.start_stop_button.config(text=self.START_TEXT, bg=ui.start_button_color)
         self.bluetooth_controller.stop_heart_rate_monitor()
+        self.pipeline.stop()
 
 
     # Start the heart rate monitoring, EKG visualization, and clicking actions
@@ -184,12 +324,9 @@ class NotABotUI:
         self.is_running = True
         self.start_stop_button.config(text=self.STOP_TEXT, bg=ui.stop_button_color)
 
-        if DEBUG:
-            asyncio.run_coroutine_threadsafe(self.simulate_heart_rate(), self.bluetooth_loop)
-        else:
-            asyncio.run_coroutine_threadsafe(self.bluetooth_controller.start_heart_rate_monitor(), self.bluetooth_loop)
+        asyncio.run_coroutine_threadsafe(self.bluetooth_controller.start_heart_rate_monitor(), self.bluetooth_loop)
 
-        asyncio.run_coroutine_threadsafe(self.start_ekg(), self.ekg_loop)
+        asyncio.run_coroutine_threadsafe(self.pipeline.run(), self.ekg_loop)
 
 
     # Bluetooth button logic
@@ -202,90 +339,141 @@ class NotABotUI:
             self.bluetooth_device_list.open_bluetooth_devices()
     
 
-    # Simulate a screen click
-    async def click_screen(self, action_delay):
-        await asyncio.sleep(action_delay)
-        click()
-    
-
     # Simulates a mouse click sound
     def play_click_sound(self):
-        self.click_sound.play()
+        self.heartbeat_audio.play_click()
     
 
-    '''
-    Simulates a heartbeat sound
-
-    I don't feel like altering a single audio file to match the actual BPM,
-    so I'm lazy and did this.
-    '''
+    # Plays a heartbeat sound matching the given BPM
     def play_heartbeat_sound(self, bpm):
-        # Modify the tempo of the heartbeat sound based on the BPM. Standard is 60BPM, 120 BPM will double the speed of the beat
-        if bpm <= 50:
-            self.heart_beat_sound_50_bpm.play()
-        elif bpm <= 60:
-            self.heart_beat_sound_60_bpm.play()
-        elif bpm <= 70:
-            self.heart_beat_sound_70_bpm.play()
-        elif bpm <= 80:
-            self.heart_beat_sound_80_bpm.play()
-        elif bpm <= 90:
-            self.heart_beat_sound_90_bpm.play()
-        elif bpm <= 100:
-            self.heart_beat_sound_100_bpm.play()
-        elif bpm <= 110:
-            self.heart_beat_sound_110_bpm.play()
-        else:
-            self.heart_beat_sound_120_bpm.play()
+        self.heartbeat_audio.play_heartbeat(bpm)
 
     
     # Listens for keyboard strokes to start and stop the heart rate monitor / clicker
     def listen_for_toggle(self):
+        from keyboard import add_hotkey
+
         print(f"Listening for '{self.start_button_keybind}' keybind...")
         if not self.is_closing_application:
-            add_hotkey(self.start_button_keybind, self.toggle_start_stop)
+            # The hotkey fires on the keyboard thread, so hand the toggle to the Tk thread
+            add_hotkey(self.start_button_keybind, lambda: self.run_on_ui(self.toggle_start_stop))
+            add_hotkey(TRACE_DUMP_BUTTON, self.dump_latency_trace)
+
+
+    # Prints the notification -> click latency percentiles and saves them to a file
+    def dump_latency_trace(self):
+        tracer = self.pipeline.tracer
+        print(tracer.format_report())
+        dispatcher = self.action_dispatcher
+        print(f"Beat actions: {dispatcher.fired_count} fired, {dispatcher.miss_count} missed, "
+              f"p99 lateness {1000 * dispatcher.lateness.percentile(0.99):.2f} ms")
+        try:
+            print(f"Latency trace written to {tracer.dump()}")
+        except OSError as e:
+            print(f"Could not write the latency trace:\n{e}")
+
+
+    # Runs a UI mutation on the Tk thread, immediately if already on it
+    def run_on_ui(self, func, *args, **kwargs):
+        self.ui_queue.submit(func, *args, **kwargs)
 
 
     # Used to close the application properly
     def close_application(self):
         self.is_closing_application = True
+        self.pipeline.stop()
+        self.action_dispatcher.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.bpm_broadcaster is not None:
+            self.pipeline.broadcaster = None
+            self.bpm_broadcaster.close()
+        if self.device_grid is not None:
+            self.device_grid.stop()
+        if self.multi_device_controller is not None:
+            self.wait_on_bluetooth_loop(self.multi_device_controller.stop_all(), self.DEVICE_STOP_TIMEOUT)
+        if self.session_recorder is not None:
+            self.session_recorder.close()
         self.root.destroy()
         self.bluetooth_loop.call_soon_threadsafe(self.bluetooth_loop.stop)
+        events.stop()
         exit(0)
 
 
-    # Begins reading BPM data and plotting EKG data on the graph
-    async def start_ekg(self):
-        
-        self.flatline_ekg()
+    # # # # # # # # #
+    # 
+    #  Sub Functions
+    # 
+    # # # # # # # # #
+
+
+    # Called by the Bluetooth controller when a new heart rate is received
+    def heart_rate_handler(self, sender, data):
+        self.record_notification(data)
+
+        measurement = self.pipeline.handle_notification(sender, data)
+        if measurement is not None:
+            events.info("heart_rate", bpm=measurement.heart_rate, filtered_bpm=self.pipeline.current_bpm, rr=measurement.rr_intervals)
 
-        if self.current_bpm == 0:
-            print("No BPM data available. Please start the heart rate monitor first.")
-            self.toggle_start_stop()
+
+    # Appends the raw notification to this session's recording, started on the first notification
+    def record_notification(self, data):
+        if not RECORD_SESSIONS or not self.bluetooth_controller.transport.is_persistent:
             return
 
-        # Define the EKG waveform pattern
-        ekg_points = [
-            0.0, 0.0, 0.0, 0.0, 0.0, 0.0,       # Delays and pre-wave 
-            0.04,                               # Peak P Wave
-            0.0, 0.0,                           # Post P/Pre Q
-            -0.05,                              # Peak Q Dip
-            0.35,                               # Peak R Wave
-            -0.095,                             # Peak S Dip
-            0.0, 0.0,                           # Post S/Pre T
-            0.06,                               # Peak T Wave
-            0.0, 0.0, 0.0, 0.0, 0.0, 0.0        # Post wave delays
-        ]
+        if self.session_recorder is None:
+            self.session_recorder = SessionRecorder(new_session_path())
+            print(f"Recording session to {self.session_recorder.path}")
+
+        self.session_recorder.record(data)
+
+
+    # # # # # # # # #
+    # 
+    #  Pipeline Renderer
+    # 
+    #  Called by the HeartPipeline, possibly from another thread.
+    #  Resets go through the UI queue, per-point state through the frame coalescer
+    # 
+    # # # # # # # # #
+
+
+    def flatline(self):
+        self.ui_frames.discard("trace", "trace_samples", "heart")
+        self.run_on_ui(self.flatline_ekg)
+
+
+    def set_waveform(self, ekg_points):
+        self.run_on_ui(self.set_ekg_waveform, ekg_points)
 
 
-        # Calculate settings once
-        points_per_beat = len(ekg_points)
+    # Numbers the beat, the sweep trace restarts once the frame showing it is applied
+    def begin_beat(self):
+        self.beat_number += 1
+
+
+    # Scroll the strip by every sample since the last frame, or extend the persistent line up to the latest index
+    def draw_point(self, point_idx, amplitude, now):
+        if self.is_strip_mode:
+            self.ui_frames.append("trace_samples", self.ekg_strip.push_many, (now, amplitude))
+        else:
+            self.ui_frames.set("trace", self.draw_sweep_to, point_idx, self.beat_number)
+
 
-        # Pre-calculate all point coordinates - do this only once!
+    def pulse_heart(self, frame_index):
+        self.ui_frames.set("heart", self.show_heart_frame, frame_index)
+
+
+    def show_bpm(self, bpm, average_bpm):
+        self.ui_frames.set("bpm", self.bpm_label.config, text=f"BPM: {bpm}  Avg: {average_bpm:.0f}")
+
+
+    # Pre-calculates the canvas coordinates of every point of the beat
+    def set_ekg_waveform(self, ekg_points):
         canvas_width = self.ekg_canvas.winfo_width() or 300
         canvas_height = self.ekg_canvas.winfo_height() or 200
         
-        x_scale = canvas_width / points_per_beat
+        x_scale = canvas_width / len(ekg_points)
         y_scale = 300
         y_offset = canvas_height / 1.5
 
@@ -295,184 +483,106 @@ class NotABotUI:
             y = y_offset - (amp * y_scale)
             precomputed_coords.append((x, y))
 
-        print("Preparing EKG simulation...")
-        await asyncio.sleep(2)  
-        print("Starting EKG visualization")
+        self.ekg_renderer.set_waveform(precomputed_coords)
 
-        beat_counter = 0
-        start_time = time()
-        
-        # Hold the line object reference to update it
-        line_id = None
+        # The scrolling strip replaces the single-beat trace and its baseline
+        if self.is_strip_mode:
+            self.ekg_renderer.clear()
+
+
+    # Shows beat `beat_number` up to `point_idx`, starting it over after a reset or when the beat changed
+    # A frame held back for about a beat can skip ahead to a larger index of the next beat
+    def draw_sweep_to(self, point_idx, beat_number):
+        if self.ekg_renderer.drawn_points == 0 or beat_number != self.drawn_beat_number:
+            self.ekg_renderer.begin_beat()
+            self.drawn_beat_number = beat_number
+        self.ekg_renderer.draw_to(point_idx)
+
+
+    # Resets the EKG graph to appear as a flatline
+    def flatline_ekg(self):
+        self.ekg_strip.clear()
+
+        # Reset the baseline
+        canvas_width = self.ekg_canvas.winfo_width() or 300
+        canvas_height = self.ekg_canvas.winfo_height() or 200
+
+        self.ekg_renderer.flatline(canvas_height / 1.5, canvas_width)
         
-        try:
+        # Make sure the heart is in its default state
+        self.show_heart_frame(0)
+        events.debug("ekg_flatline")
 
-            while self.is_running and not self.is_closing_application:
-
-                # Calculate settings once
-                seconds_per_beat = 60 / self.current_bpm  # 0.6 seconds per beat at 100 BPM
-                points_per_beat = len(ekg_points)
-                seconds_per_point = seconds_per_beat / points_per_beat  # Time to show each point
-
-                # Start with clean canvas for each beat
-                self.ekg_canvas.delete("ekg")
-                
-                # Calculate the beat start time
-                beat_start_time = time()
-                
-                # Draw the EKG line point by point within a single beat
-                await self.draw_ekg_line(
-                    points_per_beat,
-                    precomputed_coords,
-                    beat_start_time,
-                    seconds_per_point,
-                    line_id,
-                )
-                
-                # Update counter for performance tracking
-                beat_counter += 1
-
-                # Calculate how long the beat took
-                beat_elapsed = time() - beat_start_time
-
-                # If we finished faster than the BPM needed, sleep the difference
-                if beat_elapsed < seconds_per_beat:
-                    await asyncio.sleep(seconds_per_beat - beat_elapsed)
-                
-                # # Log performance stats every 10 beats
-                if beat_counter % 10 == 0:
-                    elapsed = time() - start_time
-                    expected = beat_counter * seconds_per_beat
-                    print(f"EKG Counter: {beat_counter}, Elapsed: {elapsed:.2f}s, Expected: {expected:.2f}s, Drift: {elapsed-expected:.2f}s")
-            
-        finally:
-            # This block will execute when the loop ends for any reason
-            self.flatline_ekg()
+
+    # Shows one of the precomputed heart frames, 0 being the relaxed heart
+    def show_heart_frame(self, frame_index):
+        if frame_index == self.heart_frame_index:
+            return
+
+        self.heart_frame_index = frame_index
+        if self.heart_sprites.is_built:
+            self.heart_label.config(image=self.heart_sprites.frame(frame_index))
+
+
+    # Waits for a coroutine to finish on the Bluetooth loop, from the Tk thread
+    # In single-threaded mode that loop is only pumped by Tk, so it is run here until the coroutine is done
+    def wait_on_bluetooth_loop(self, coroutine, timeout):
+        try:
+            if self.bluetooth_loop.is_running():
+                asyncio.run_coroutine_threadsafe(coroutine, self.bluetooth_loop).result(timeout)
+            else:
+                self.bluetooth_loop.run_until_complete(asyncio.wait_for(coroutine, timeout))
+        except Exception as e:
+            print(f"Error while waiting on the Bluetooth loop:\n{e}")
 
 
     # # # # # # # # #
     # 
-    #  Sub Functions
+    #  Startup Stages
+    # 
+    #  Run on background threads after the window is shown, see startup.StagedStartup
     # 
     # # # # # # # # #
 
 
-    # Called by the Bluetooth controller when a new heart rate is received
-    def heart_rate_handler(self, sender, data):
-        heart_rate = data[1]
-        print(f"Heart Rate: {heart_rate} bpm")
-        self.update_bpm(heart_rate)
-
-
-    # Updates the BPM data and label
-    def update_bpm(self, heart_rate):
-        self.current_bpm = heart_rate
-        self.bpm_data.append(heart_rate)
-        self.bpm_label.config(text=f"BPM: {heart_rate}")
-        self.root.update()
-
-
-    # DEBUGGING FUNCTION
-    # Simulate heart rate data for demonstration purposes
-    async def simulate_heart_rate(self):
-        heart_rate_change = 3
-        heart_rate_change_chance = 0.4
-        while self.is_running and not self.is_closing_application:
-            last_heart_rate = self.bpm_data[-1] if self.bpm_data else randint(115, 125)
-            if random() > heart_rate_change_chance:
-                heart_rate = last_heart_rate
-            else:
-                heart_rate = randint(max(60, last_heart_rate - heart_rate_change), min(125, last_heart_rate + heart_rate_change))
-            self.update_bpm(heart_rate)
-            await asyncio.sleep(1)
+    # Turns the loaded heart frames into PhotoImages, on the Tk thread
+    def show_heart(self):
+        self.heart_sprites.build()
+        self.heart_label.config(image=self.heart_sprites.frame(self.heart_frame_index))
 
 
-    # Resets the EKG graph to appear as a flatline
-    def flatline_ekg(self):
-        print("Cleaning up EKG visualization...")
-        # Clear the canvas
-        self.ekg_canvas.delete("ekg")
+    # Imports pyautogui and the like before the first beat needs them
+    def prepare_beat_actions(self):
+        for actions in BEAT_ACTIONS.values():
+            for action in actions:
+                prepare = getattr(action, "prepare", None)
+                if prepare is not None:
+                    prepare()
 
-        # Reset the baseline
-        canvas_width = self.ekg_canvas.winfo_width() or 300
-        canvas_height = self.ekg_canvas.winfo_height() or 200
 
-        self.ekg_canvas.create_line(
-            0, canvas_height / 1.5, 
-            canvas_width, canvas_height / 1.5, 
-            fill=ui.heart_rate_line_color, 
-            width=3, 
-            tags="ekg"
-        )
-        
-        # Make sure the heart is in its default state
-        if not self.is_big_heart:
-            self.toggle_heart_image()  # Return to big heart state
-        
-        print("EKG visualization cleanup complete")
+    def load_audio(self):
+        self.heartbeat_audio.load_async()
+        self.heartbeat_audio.ready.wait()
+        if not self.heartbeat_audio.is_loaded:
+            raise RuntimeError("audio unavailable")
 
 
-    # Beats the heart back and forth
-    def toggle_heart_image(self):
-        # Save the previous image to prevent garbage collection
-        self.previous_heart_image = self.heart_image
-        
-        if self.is_big_heart:
-            self.heart_image = ImageTk.PhotoImage(self.small_heart_image)
-            self.is_big_heart = False
-        else:
-            self.heart_image = ImageTk.PhotoImage(self.big_heart_image)
-            self.is_big_heart = True
-        
-        # Update the label with the new image
-        self.heart_label.config(image=self.heart_image)
-        self.root.update()  # Force a UI update
-
-
-    # Draws the EKG line on the canvas
-    async def draw_ekg_line(self, points_per_beat, precomputed_coords, beat_start_time, seconds_per_point, line_id=None):
-        for point_idx in range(1, points_per_beat + 1):
-            # Clear previous line
-            if line_id:
-                self.ekg_canvas.delete(line_id)
-            
-            # Create points up to current index
-            points_to_draw = []
-            for i in range(min(point_idx, len(precomputed_coords))):
-                points_to_draw.append(precomputed_coords[i][0])  # x coord
-                points_to_draw.append(precomputed_coords[i][1])  # y coord
-            
-            # Draw the line
-            if len(points_to_draw) >= 4:  # Need at least 2 points for a line
-                line_id = self.ekg_canvas.create_line(
-                    points_to_draw,
-                    fill=ui.heart_rate_line_color,
-                    width=3,
-                    tags="ekg",
-                )
-            
-            # Beat the heart at the QRS Complex
-            if point_idx == 9:
-                self.play_heartbeat_sound(self.current_bpm)
-            # Perform a click at the peak R wave
-            elif point_idx == 10:
-                asyncio.run_coroutine_threadsafe(self.click_screen(0), self.heart_beat_loop)
-                self.play_click_sound()
-                await asyncio.sleep(0.01)
-                self.toggle_heart_image()
-                await asyncio.sleep(0.01)
-            # Beat the heart at the QRS Complex
-            elif point_idx == 11 or point_idx == 12:
-                self.toggle_heart_image()
-                await asyncio.sleep(0.01)
-            
-            # Calculate exact time for this point
-            point_time = beat_start_time + (point_idx * seconds_per_point)
-            current_time = time()
-            
-            # Sleep precisely until next point time
-            sleep_time = max(0.001, point_time - current_time)
-            await asyncio.sleep(sleep_time)
+    # The pipeline starts publishing once the shared block exists
+    def open_bpm_broadcast(self):
+        broadcaster = BPMBroadcaster()
+        broadcaster.open()
+        self.bpm_broadcaster = broadcaster
+        self.pipeline.broadcaster = broadcaster
+
+
+    def start_metrics_server(self):
+        self.metrics_server = MetricsServer(self.metrics, METRICS_PORT)
+        self.metrics_server.start()
+
+
+    # Bleak is slow to import, load it before the first connect or scan needs it
+    def load_bluetooth(self):
+        import bleak
 
 
     def resource_path(self, relative_path):
@@ -488,25 +598,37 @@ class NotABotUI:
 
 if __name__ == "__main__":
 
-    bluetooth_loop = asyncio.new_event_loop()
-    bluetooth_loop_thread = Thread(target=bluetooth_loop.run_forever, daemon=True)
-    bluetooth_loop_thread.start()
-    asyncio.set_event_loop(bluetooth_loop)
+    # Events are queued from the first line on and written off the hot path
+    events.start()
+
+    if SINGLE_THREADED:
+        # One asyncio loop shared by Bluetooth and the EKG, pumped from Tk
+        main_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(main_loop)
 
-    ekg_loop = asyncio.new_event_loop()
-    ekg_loop_thread = Thread(target=ekg_loop.run_forever, daemon=True)
-    ekg_loop_thread.start()
+        bluetooth_loop = ekg_loop = main_loop
 
-    heart_beat_loop = asyncio.new_event_loop()
-    heart_beat_loop_thread = Thread(target=heart_beat_loop.run_forever, daemon=True)
-    heart_beat_loop_thread.start()
+    else:
+        bluetooth_loop = asyncio.new_event_loop()
+        bluetooth_loop_thread = Thread(target=bluetooth_loop.run_forever, daemon=True)
+        bluetooth_loop_thread.start()
+        asyncio.set_event_loop(bluetooth_loop)
+
+        ekg_loop = asyncio.new_event_loop()
+        ekg_loop_thread = Thread(target=ekg_loop.run_forever, daemon=True)
+        ekg_loop_thread.start()
 
     root = tk.Tk()
     app = NotABotUI(
         root,
         bluetooth_loop,
         ekg_loop,
-        heart_beat_loop,
     )
+
+    if SINGLE_THREADED:
+        TkAsyncioScheduler(root, main_loop, app.ui_queue).start()
+    else:
+        app.ui_queue.start_polling()
+
     root.mainloop()
 
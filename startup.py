@@ -0,0 +1,174 @@
+from threading import Thread, Event, Lock
+from time import monotonic
+
+
+'''
+Staged application startup
+
+The window is shown first. Slow imports and initialisation (Bluetooth, audio,
+sprites, input hooks) run as named stages on background threads, each stage
+starting once the stages it depends on are ready.
+
+Every stage has a readiness Event that any thread can wait on, and callbacks
+registered with when_ready() run on the Tk thread through the UI queue once
+the stage succeeded. Stage timings are kept for the startup report.
+'''
+class StartupStage:
+
+    name = None
+    func = None
+    dependencies = ()
+
+    started_at = None
+    finished_at = None
+    error = None
+
+
+    def __init__(self, name, func, dependencies=()):
+        self.name = name
+        self.func = func
+        self.dependencies = tuple(dependencies)
+        self.ready = Event()
+
+
+    # True once the stage finished without an error
+    @property
+    def is_ready(self):
+        return self.ready.is_set() and self.error is None
+
+
+    @property
+    def elapsed(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class StagedStartup:
+
+    ui_queue = None
+    clock = None
+    created_at = None
+    window_shown_at = None
+
+
+    def __init__(self, ui_queue, clock=monotonic):
+        self.ui_queue = ui_queue
+        self.clock = clock
+        self.created_at = clock()
+        self.stages = {}
+        self.callbacks = {}
+        self.lock = Lock()
+
+
+    # Registers a stage, func() runs on its own thread once every dependency is ready
+    def add(self, name, func, depends_on=()):
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Startup stage {name!r} depends on unknown stage {dependency!r}")
+        self.stages[name] = StartupStage(name, func, depends_on)
+        self.callbacks[name] = []
+
+
+    def start(self):
+        for stage in self.stages.values():
+            Thread(target=self._run_stage, args=(stage,), name=f"startup-{stage.name}", daemon=True).start()
+
+
+    # Runs callback() on the Tk thread once `name` is ready, right away if it already is
+    def when_ready(self, name, callback):
+        with self.lock:
+            stage = self.stages[name]
+            if not stage.ready.is_set():
+                self.callbacks[name].append(callback)
+                return
+
+        if stage.error is None:
+            self.ui_queue.submit(callback)
+
+
+    # Runs callback() on the Tk thread once every stage finished, whether it failed or not
+    def when_all_finished(self, callback):
+        def wait_for_all():
+            for stage in self.stages.values():
+                stage.ready.wait()
+            self.ui_queue.submit(callback)
+
+        Thread(target=wait_for_all, name="startup-all", daemon=True).start()
+
+
+    # Blocks until `name` finished, returns whether it is ready
+    def wait(self, name, timeout=None):
+        stage = self.stages[name]
+        stage.ready.wait(timeout)
+        return stage.is_ready
+
+
+    def is_ready(self, name):
+        return self.stages[name].is_ready
+
+
+    # Called on the Tk thread once the window is first idle, i.e. drawn
+    def mark_window_shown(self):
+        self.window_shown_at = self.clock()
+
+
+    # Milliseconds from the start of startup to the window and to every stage being ready
+    def report(self):
+        report = {}
+        if self.window_shown_at is not None:
+            report["window_shown_ms"] = 1000 * (self.window_shown_at - self.created_at)
+
+        for stage in self.stages.values():
+            report[stage.name] = {
+                "ready_ms": None if stage.finished_at is None else 1000 * (stage.finished_at - self.created_at),
+                "took_ms": None if stage.elapsed is None else 1000 * stage.elapsed,
+                "error": None if stage.error is None else str(stage.error),
+            }
+        return report
+
+
+    def format_report(self):
+        report = self.report()
+        lines = ["Startup:"]
+        if "window_shown_ms" in report:
+            lines.append(f"  {'window':<12} shown at {report['window_shown_ms']:7.1f} ms")
+        for name in self.stages:
+            stage = report[name]
+            if stage["ready_ms"] is None:
+                lines.append(f"  {name:<12} pending")
+            elif stage["error"] is not None:
+                lines.append(f"  {name:<12} failed at {stage['ready_ms']:7.1f} ms: {stage['error']}")
+            else:
+                lines.append(f"  {name:<12} ready at {stage['ready_ms']:7.1f} ms (took {stage['took_ms']:.1f} ms)")
+        return "\n".join(lines)
+
+
+    # # # # # # # # #
+    #
+    #  Sub Functions
+    #
+    # # # # # # # # #
+
+
+    def _run_stage(self, stage):
+        failed_dependency = next((name for name in stage.dependencies if not self.wait(name)), None)
+
+        stage.started_at = self.clock()
+        if failed_dependency is not None:
+            stage.error = RuntimeError(f"{failed_dependency} did not start")
+        else:
+            try:
+                stage.func()
+            except Exception as e:
+                stage.error = e
+                print(f"Startup stage {stage.name} failed:\n{e}")
+        stage.finished_at = self.clock()
+
+        with self.lock:
+            stage.ready.set()
+            callbacks, self.callbacks[stage.name] = self.callbacks[stage.name], []
+
+        if stage.error is None:
+            for callback in callbacks:
+                self.ui_queue.submit(callback)
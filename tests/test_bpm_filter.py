@@ -0,0 +1,31 @@
+import unittest
+
+from bpm_filter import BPMFilter, FLAG_WARMING_UP, FLAG_OUTLIER
+
+
+class WarmUpTrustTest(unittest.TestCase):
+
+    # Until the Hampel window is full an outlier cannot be told apart, so nothing is confident yet
+    def test_warming_up_readings_are_not_confident(self):
+        bpm_filter = BPMFilter()
+        for _ in range(BPMFilter.WINDOW - 1):
+            filtered = bpm_filter.update(80)
+            self.assertTrue(filtered.flags & FLAG_WARMING_UP)
+            self.assertTrue(filtered.has_estimate)
+            self.assertFalse(filtered.is_confident)
+
+        filtered = bpm_filter.update(80)
+        self.assertFalse(filtered.flags & FLAG_WARMING_UP)
+        self.assertTrue(filtered.is_confident)
+
+
+    def test_spike_during_warm_up_is_not_confident(self):
+        bpm_filter = BPMFilter()
+        bpm_filter.update(80)
+        filtered = bpm_filter.update(200)
+        self.assertFalse(filtered.flags & FLAG_OUTLIER)
+        self.assertFalse(filtered.is_confident)
+
+
+if __name__ == "__main__":
+    unittest.main()
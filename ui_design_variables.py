@@ -19,3 +19,17 @@ graph_background_color = "#D2B48C"
 graph_foreground_color = "#FAEBD7"
 
 heart_rate_line_color = "#FF7F50"
+
+# EKG Canvas
+ekg_canvas_width = 240
+ekg_canvas_height = 160
+
+# Compact EKG panes of the multi-device grid
+device_pane_width = 160
+device_pane_height = 80
+
+# "sweep" redraws a single beat at a time, "strip" scrolls a multi-beat history
+ekg_display_mode = "sweep"
+
+# Seconds of history visible in the scrolling strip
+ekg_strip_seconds = 6
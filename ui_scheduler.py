@@ -0,0 +1,221 @@
+from queue import Queue, Empty, Full
+from threading import get_ident, Lock
+from time import monotonic
+from metrics import FRAME_TIME_BUCKETS
+
+
+'''
+Bounded queue used to marshal UI mutations onto the Tk thread
+
+Tk widgets must only be touched from the thread running mainloop().
+Any other thread submits its widget updates here instead, and the Tk thread drains them.
+Calls made from the Tk thread itself run immediately.
+When the queue is full the update is dropped and counted rather than blocking the caller.
+'''
+class UIUpdateQueue:
+
+    root = None
+    tk_thread_id = None
+
+    MAX_PENDING_UPDATES = 512
+    MAX_UPDATES_PER_DRAIN = 256
+    POLL_INTERVAL_MS = 10
+
+    dropped_updates = 0
+
+
+    # Must be created on the Tk thread
+    def __init__(self, root, maxsize=None):
+        self.root = root
+        self.tk_thread_id = get_ident()
+        self.pending_updates = Queue(maxsize=maxsize or self.MAX_PENDING_UPDATES)
+
+
+    # Runs `func(*args, **kwargs)` on the Tk thread, returns False when the update was dropped
+    def submit(self, func, *args, **kwargs):
+        if get_ident() == self.tk_thread_id:
+            func(*args, **kwargs)
+            return True
+
+        try:
+            self.pending_updates.put_nowait((func, args, kwargs))
+        except Full:
+            self.dropped_updates += 1
+            return False
+        return True
+
+
+    # Applies pending updates, called from the Tk thread
+    def drain(self):
+        for _ in range(self.MAX_UPDATES_PER_DRAIN):
+            try:
+                func, args, kwargs = self.pending_updates.get_nowait()
+            except Empty:
+                return
+            func(*args, **kwargs)
+
+
+    # Drains the queue periodically using Tk's own timer
+    def start_polling(self):
+        self.drain()
+        self.root.after(self.POLL_INTERVAL_MS, self.start_polling)
+
+
+'''
+Collects UI state written at any rate and applies it at most once per display frame
+
+Producers, on any thread, either set the latest value of a piece of state, such as
+the BPM text or the heart frame, which replaces a value not yet shown, or append items
+to a stream, such as trace samples, which are all handed over as one batch.
+The first write after a flush schedules the next flush through after_idle, no sooner
+than FRAME_INTERVAL_MS after the previous one, so a fast strap or a sped up replay
+costs one redraw per frame instead of one per notification.
+'''
+class UIFrameCoalescer:
+
+    root = None
+    ui_queue = None
+
+    # About 60 frames per second
+    FRAME_INTERVAL_MS = 16
+
+    is_flush_scheduled = False
+    last_flush_time = 0.0
+
+    # Time spent applying each frame, a metrics.Histogram, see register_metrics()
+    frame_histogram = None
+
+    # Counters
+    flush_count = 0
+    coalesced_updates = 0
+
+
+    def __init__(self, root, ui_queue):
+        self.root = root
+        self.ui_queue = ui_queue
+        self.lock = Lock()
+
+        # key -> (func, args, kwargs), flushed as func(*args, **kwargs)
+        self.latest = {}
+        # key -> (func, items), flushed as func(items)
+        self.streams = {}
+
+
+    # Sets the latest state for `key`, replacing any value not shown yet
+    def set(self, key, func, *args, **kwargs):
+        with self.lock:
+            if key in self.latest:
+                self.coalesced_updates += 1
+            self.latest[key] = (func, args, kwargs)
+            should_schedule = self._mark_dirty()
+
+        if should_schedule:
+            self.request_flush()
+
+
+    # Appends `item` to the batch flushed as func(items)
+    def append(self, key, func, item):
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is None:
+                self.streams[key] = (func, [item])
+            else:
+                stream[1].append(item)
+                self.coalesced_updates += 1
+            should_schedule = self._mark_dirty()
+
+        if should_schedule:
+            self.request_flush()
+
+
+    # Forgets pending state, e.g. trace updates that a reset makes obsolete
+    def discard(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.latest.pop(key, None)
+                self.streams.pop(key, None)
+
+
+    # A flush dropped by a full UI queue would never run, the next write tries again
+    def request_flush(self):
+        if not self.ui_queue.submit(self.schedule_flush):
+            with self.lock:
+                self.is_flush_scheduled = False
+
+
+    # Called on the Tk thread
+    def schedule_flush(self):
+        remaining_ms = self.FRAME_INTERVAL_MS - (monotonic() - self.last_flush_time) * 1000
+        if remaining_ms > 1:
+            self.root.after(int(remaining_ms), self.root.after_idle, self.flush)
+        else:
+            self.root.after_idle(self.flush)
+
+
+    # Applies every pending update, called on the Tk thread
+    def flush(self):
+        with self.lock:
+            latest, self.latest = self.latest, {}
+            streams, self.streams = self.streams, {}
+            self.is_flush_scheduled = False
+
+        self.last_flush_time = monotonic()
+        self.flush_count += 1
+
+        for func, items in streams.values():
+            func(items)
+        for func, args, kwargs in latest.values():
+            func(*args, **kwargs)
+
+        if self.frame_histogram is not None:
+            self.frame_histogram.observe(monotonic() - self.last_flush_time)
+
+
+    def register_metrics(self, metrics):
+        metrics.counter_callback("ui_frames_total", "Display frames applied", lambda: self.flush_count)
+        metrics.counter_callback("ui_coalesced_updates_total", "UI updates replaced or batched before being shown", lambda: self.coalesced_updates)
+        self.frame_histogram = metrics.histogram("ui_frame_seconds", "Time spent applying each display frame", FRAME_TIME_BUCKETS)
+
+
+    # Returns True when the caller has to schedule a flush, the lock must be held
+    def _mark_dirty(self):
+        if self.is_flush_scheduled:
+            return False
+        self.is_flush_scheduled = True
+        return True
+
+
+'''
+Runs an asyncio event loop on the Tk thread
+
+Instead of giving every loop its own thread, a single loop is pumped from Tk's
+after() timer: each tick runs one pass of the asyncio loop and then drains the UI queue.
+Coroutines, Bluetooth callbacks and widget updates all execute on one thread,
+so there is no cross-thread widget access and no GIL contention between loops.
+'''
+class TkAsyncioScheduler:
+
+    root = None
+    loop = None
+    ui_queue = None
+
+    # Bounds the latency of asyncio timers, e.g. asyncio.sleep() resolution
+    PUMP_INTERVAL_MS = 2
+
+
+    def __init__(self, root, loop, ui_queue):
+        self.root = root
+        self.loop = loop
+        self.ui_queue = ui_queue
+
+
+    def start(self):
+        self.root.after(0, self.pump)
+
+
+    # Runs every ready asyncio callback once, then reschedules itself
+    def pump(self):
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        self.ui_queue.drain()
+        self.root.after(self.PUMP_INTERVAL_MS, self.pump)
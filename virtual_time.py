@@ -0,0 +1,71 @@
+import asyncio
+import selectors
+
+
+'''
+Virtual time for running the beat loop faster than real time
+
+VirtualTimeEventLoop is a regular selector event loop whose time() is a VirtualClock.
+Whenever the loop would block waiting for its next timer, the clock jumps straight to
+that timer instead, so asyncio.sleep(), call_at() and wait_for() all complete at once
+while every callback still runs in deadline order. Anything whose clock is the loop's
+time() (the pipeline, the beat clock, the simulated strap, the connection supervisor)
+then runs deterministically, an hour of beats taking a fraction of a second.
+
+Ready I/O is still polled, without waiting, before the clock moves, so
+call_soon_threadsafe() keeps working; but nothing on the loop should wait for a
+real-time thread.
+
+    loop = VirtualTimeEventLoop()
+    pipeline = HeartPipeline(clock=loop.time, dispatcher=LoopActionDispatcher(loop))
+    loop.run_until_complete(session())
+'''
+class VirtualClock:
+
+    now = 0.0
+
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+
+    def __call__(self):
+        return self.now
+
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+
+# Polls without blocking, then advances the clock by the time the loop wanted to wait
+# Callbacks already ready are run first, I/O is only polled before time moves on
+class VirtualSelector(selectors.DefaultSelector):
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+
+    def select(self, timeout=None):
+        if timeout == 0:
+            return []
+
+        ready = super().select(0)
+        if not ready and timeout:
+            self.clock.advance(timeout)
+        return ready
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+
+    clock = None
+
+
+    def __init__(self, clock=None):
+        self.clock = clock or VirtualClock()
+        super().__init__(VirtualSelector(self.clock))
+
+
+    def time(self):
+        return self.clock.now